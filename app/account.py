@@ -0,0 +1,105 @@
+import threading
+
+import clock
+import settings
+from recorder import get_recorder
+
+# REST polling interval while waiting on a balance without the user data stream
+POLL_INTERVAL = 1
+STREAM_CHECK_INTERVAL = 5
+
+
+class AccountService:
+    '''
+    Free balances kept up to date by outboundAccountPosition events
+
+    Without a connected user data stream every lookup falls back to REST.
+    '''
+
+    def __init__(self, client, stream=None):
+        self.client = client
+        self.stream = stream
+        self.balances = {}
+        self.syncedGeneration = None
+        self.condition = threading.Condition()
+        if stream:
+            stream.subscribe(self.on_event)
+
+    def on_event(self, event):
+        if event.get('e') != 'outboundAccountPosition':
+            return
+        with self.condition:
+            for balance in event['B']:
+                self.balances[balance['a']] = float(balance['f'])
+            self.condition.notify_all()
+
+    def streaming(self):
+        return self.stream is not None and self.stream.connected.is_set()
+
+    def refresh(self):
+        '''
+        Reload every balance from the account endpoint
+        '''
+        generation = self.stream.generation if self.stream else None
+        balances = {b['asset']: float(b['free']) for b in self.client.get_account()['balances']}
+        recorder = get_recorder()
+        if recorder:
+            recorder.balances(balances)
+        with self.condition:
+            self.balances.update(balances)
+            self.syncedGeneration = generation
+            self.condition.notify_all()
+
+    def balance(self, asset):
+        '''
+        Free balance of an asset, from memory while the stream is connected
+        '''
+        if not self.streaming() or self.syncedGeneration != self.stream.generation:
+            # Events may have been missed since the last sync
+            self.refresh()
+        return self.balances.get(asset)
+
+    def wait_for_balance(self, asset, predicate, timeout=None):
+        '''
+        Block until predicate(free balance) holds, returning the balance or None on timeout
+        '''
+        deadline = None if timeout is None else clock.monotonic() + timeout
+        while True:
+            try:
+                value = self.balance(asset)
+            except Exception as e:
+                # A timeout or dropped connection, the next lookup tries again
+                print("Unexpected Error: {0}".format(e))
+                value = None
+            if value is not None and predicate(value):
+                return value
+            remaining = None if deadline is None else deadline - clock.monotonic()
+            if remaining is not None and remaining <= 0:
+                return None
+            if self.streaming():
+                # Wake up now and then to notice a dropped stream
+                wait = STREAM_CHECK_INTERVAL if remaining is None else min(STREAM_CHECK_INTERVAL, remaining)
+                with self.condition:
+                    self.condition.wait_for(
+                        lambda: predicate(self.balances.get(asset, 0.0)), wait)
+            else:
+                clock.sleep(POLL_INTERVAL if remaining is None else min(POLL_INTERVAL, remaining))
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_account_service(client):
+    '''
+    Get the process-wide account service, on the user data stream if enabled
+    '''
+    global _service
+    with _service_lock:
+        if _service is None:
+            stream = None
+            if settings.user_data_stream:
+                from user_stream import get_user_stream
+                stream = get_user_stream(client)
+            _service = AccountService(client, stream)
+        return _service
@@ -0,0 +1,317 @@
+#!python3
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import talib
+from numpy.lib.stride_tricks import sliding_window_view
+
+import settings
+from bot import TradeState
+from candles import BUCKET_OFFSET, INTERVAL_MS
+from indicators import WMA
+from strategy import get_pipeline
+
+# Binance kline dumps: open time, open, high, low, close, volume, close time, ...
+COLUMNS = ['open_time', 'open', 'high', 'low', 'close', 'volume', 'close_time']
+
+
+def load_klines(path):
+    '''
+    Load historical klines from a Binance CSV dump, a Parquet file or a kline store into arrays
+    '''
+    if os.path.isdir(path):
+        # KLINE_CACHE_DIR/<symbol>/<interval>, memory-mapped as is
+        from kline_store import get_kline_store
+        root, symbol, interval = path.rstrip('/').rsplit('/', 2)
+        data = get_kline_store(symbol, interval, root).read()
+        return {name: data[name] for name in COLUMNS}
+    if path.endswith('.parquet'):
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_csv(path, header=None)
+        if not str(df.iloc[0, 0]).isdigit():
+            # Header row
+            df = df.iloc[1:]
+    df = df.iloc[:, :len(COLUMNS)]
+    df.columns = COLUMNS
+    data = {name: df[name].to_numpy(dtype=np.int64 if name.endswith('time') else np.float64)
+            for name in COLUMNS}
+    return data
+
+
+def guess_interval(data):
+    step = int(np.median(np.diff(data['open_time'][:1000])))
+    for interval, ms in INTERVAL_MS.items():
+        if ms == step:
+            return interval
+    raise ValueError(f"Unknown candle interval of {step}ms")
+
+
+def rolling(values, window, reduce):
+    '''
+    Rolling reduction aligned like pandas, NaN until the window is full or if it holds a NaN
+    '''
+    out = np.full(len(values), np.nan)
+    if len(values) >= window:
+        out[window - 1:] = reduce(sliding_window_view(values, window), axis=1)
+    return out
+
+
+def stoch(rsi, smoothk, smoothd, n):
+    '''
+    Vectorized Stoch(rsi, rsi, rsi, smoothk, smoothd, n)
+    '''
+    lowestlow = rolling(rsi, n, np.min)
+    highesthigh = rolling(rsi, n, np.max)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        raw = 100 * ((rsi - lowestlow) / (highesthigh - lowestlow))
+    raw[~np.isfinite(raw)] = np.nan
+    K = rolling(raw, smoothk, np.mean)
+    D = rolling(K, smoothd, np.mean)
+    return raw, K, D
+
+
+class IndicatorCache:
+    '''
+    Whole-history indicator arrays, computed once per parameter set
+    '''
+
+    def __init__(self, data, maxsize=None):
+        self.data = data
+        self.close = data['close']
+        self.maxsize = maxsize
+        self.arrays = {}
+
+    def _get(self, key, compute):
+        if key not in self.arrays:
+            if self.maxsize and len(self.arrays) >= self.maxsize:
+                # Drop the oldest entry, callers visit parameters in order
+                del self.arrays[next(iter(self.arrays))]
+            self.arrays[key] = compute()
+        return self.arrays[key]
+
+    def rsi(self, n):
+        return self._get(('rsi', n), lambda: talib.RSI(self.close, n))
+
+    def stochrsi(self, n, s, k, d):
+        return self._get(('stochrsi', n, s, k, d),
+                         lambda: stoch(self.rsi(n), k, d, s)[1:])
+
+    def ema(self, n):
+        return self._get(('ema', n), lambda: talib.EMA(self.close, n))
+
+    def wma(self, n):
+        return self._get(('wma', n), lambda: talib.WMA(self.close, n))
+
+    def upper_stochrsi(self, interval, n, s, k, d):
+        return self._get(('upper', interval, n, s, k, d),
+                         lambda: upper_stochrsi(self.data, interval, n, s, k, d))
+
+
+def _shifted(values, window, reduce, j):
+    '''
+    Reduction over values[j-window+1:j], the closed part of a window ending at j
+    '''
+    if window == 1:
+        return None
+    prev = rolling(values, window - 1, reduce)
+    out = np.full(len(j), np.nan)
+    valid = j >= 1
+    out[valid] = prev[j[valid] - 1]
+    return out
+
+
+def upper_stochrsi(data, interval, n, s, k, d):
+    '''
+    Upper timeframe StochRSI as seen at the close of every base candle
+
+    The upper candle containing a base candle is still open at that point, so
+    its close is the base close.  Each reading combines the closed upper candles
+    with that partial close, the same series the live loop downloads.
+    '''
+    base_ms = int(data['close_time'][0] - data['open_time'][0] + 1)
+    upper_ms = INTERVAL_MS.get(interval)
+    if not upper_ms or upper_ms % base_ms:
+        raise ValueError(f"{interval} candles can not be built from {base_ms}ms candles")
+    offset = BUCKET_OFFSET.get(interval, 0)
+    bucket = (data['open_time'] - offset) // upper_ms
+    # Index of the upper candle every base candle belongs to
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    j = np.cumsum(np.r_[False, bucket[1:] != bucket[:-1]])
+    last = np.r_[starts[1:] - 1, len(bucket) - 1]
+    upperClose = data['close'][last]
+    close = data['close']
+
+    # Wilder averages after each closed upper candle, scaled so the open candle
+    # reading is (prev * (n - 1) + gain) / n for every j >= n
+    diff = np.diff(upperClose, prepend=np.nan)
+    gains = np.where(diff > 0, diff, 0.0)
+    losses = np.where(diff < 0, -diff, 0.0)
+    prevGain = np.full(len(upperClose), np.nan)
+    prevLoss = np.full(len(upperClose), np.nan)
+    if len(upperClose) > n:
+        prevGain[n] = gains[1:n].sum() / (n - 1)
+        prevLoss[n] = losses[1:n].sum() / (n - 1)
+        avgGain, avgLoss = gains[1:n + 1].sum() / n, losses[1:n + 1].sum() / n
+        for m in range(n + 1, len(upperClose)):
+            prevGain[m], prevLoss[m] = avgGain, avgLoss
+            avgGain = (avgGain * (n - 1) + gains[m]) / n
+            avgLoss = (avgLoss * (n - 1) + losses[m]) / n
+
+    partial = close - np.r_[np.nan, upperClose][j]
+    gain = (prevGain[j] * (n - 1) + np.where(partial > 0, partial, 0.0)) / n
+    loss = (prevLoss[j] * (n - 1) + np.where(partial < 0, -partial, 0.0)) / n
+    total = gain + loss
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsi = np.where(total == 0, 0.0, 100 * gain / total)
+
+    closedRsi = talib.RSI(upperClose, n)
+    closedRaw, closedK, _ = stoch(closedRsi, k, d, s)
+    low = np.minimum(_shifted(closedRsi, s, np.min, j), rsi) if s > 1 else rsi
+    high = np.maximum(_shifted(closedRsi, s, np.max, j), rsi) if s > 1 else rsi
+    with np.errstate(divide='ignore', invalid='ignore'):
+        raw = 100 * (rsi - low) / (high - low)
+    raw[~np.isfinite(raw)] = np.nan
+    K = raw if k == 1 else (_shifted(closedRaw, k, np.sum, j) + raw) / k
+    D = K if d == 1 else (_shifted(closedK, d, np.sum, j) + K) / d
+    return K, D
+
+
+def readings_arrays(cache, conf=settings):
+    '''
+    Rounded per-candle arrays of every reading evaluate() uses
+    '''
+    arrays = {
+        'timeend': cache.data['close_time'],
+        'close': cache.close,
+        'rsi': cache.rsi(conf.trade_rsi_ifr),
+    }
+    arrays['K'], arrays['D'] = cache.stochrsi(
+        conf.trade_rsi_ifr, conf.trade_rsi_stochastic, conf.trade_rsi_k, conf.trade_rsi_d)
+    if conf.trade_upper_stoch_validator:
+        arrays['K_upper'], arrays['D_upper'] = cache.upper_stochrsi(
+            conf.trade_upper_stoch_validator_value, conf.trade_rsi_ifr,
+            conf.trade_rsi_stochastic, conf.trade_rsi_k, conf.trade_rsi_d)
+    for name, kind, period in get_pipeline(conf).averages:
+        arrays[name] = cache.wma(period) if kind is WMA else cache.ema(period)
+    return {name: (values if name == 'timeend' else np.round(values, 8)).tolist()
+            for name, values in arrays.items()}
+
+
+def decisions(arrays, conf=settings):
+    '''
+    Replay evaluate() candle by candle, yielding (index, validateBuy, validateSell)
+    '''
+    pipeline = get_pipeline(conf)
+    state = TradeState()
+    names = list(arrays)
+    for i, values in enumerate(zip(*arrays.values())):
+        pipeline.evaluate(state, dict(zip(names, values)))
+        yield i, state.validateBuy, state.validateSell
+
+
+def backtest(data, conf=settings, cash=1000.0, fee=0.001, cache=None):
+    '''
+    Trade the signals at candle close, one position at a time like trade()
+    '''
+    cache = cache or IndicatorCache(data)
+    arrays = readings_arrays(cache, conf)
+    close = arrays['close']
+    lastStatus = 0
+    quantity = 0.0
+    entry = None
+    trades = []
+    equity = np.empty(len(close))
+    for i, validateBuy, validateSell in decisions(arrays, conf):
+        price = close[i]
+        if validateBuy and lastStatus != 1:
+            lastStatus = 1
+            if cash > 0:
+                quantity = cash / price * (1 - fee)
+                entry = (i, price, cash)
+                cash = 0.0
+        elif validateSell and lastStatus != 2:
+            lastStatus = 2
+            if quantity > 0:
+                cash = quantity * price * (1 - fee)
+                trades.append({'open_time': int(arrays['timeend'][entry[0]]),
+                               'close_time': int(arrays['timeend'][i]),
+                               'buy': entry[1], 'sell': price,
+                               'pnl': cash - entry[2]})
+                quantity = 0.0
+        equity[i] = cash + quantity * price
+    peak = np.maximum.accumulate(equity) if len(equity) else equity
+    drawdown = float(np.max((peak - equity) / peak)) if len(equity) else 0.0
+    return {
+        'trades': trades,
+        'equity': equity,
+        'pnl': float(equity[-1] - equity[0]) if len(equity) else 0.0,
+        'return': float(equity[-1] / equity[0] - 1) if len(equity) else 0.0,
+        'max_drawdown': drawdown,
+        'win_rate': sum(t['pnl'] > 0 for t in trades) / len(trades) if trades else 0.0,
+    }
+
+
+def verify(data, conf=settings):
+    '''
+    Compare the vectorized decisions with the live loop's incremental readings
+    '''
+    from indicators import IndicatorEngine
+
+    arrays = readings_arrays(IndicatorCache(data), conf)
+    engine = IndicatorEngine(conf)
+    upper = IndicatorEngine(conf, upper=True) if conf.trade_upper_stoch_validator else None
+    if upper:
+        upper_ms = INTERVAL_MS[conf.trade_upper_stoch_validator_value]
+        offset = BUCKET_OFFSET.get(conf.trade_upper_stoch_validator_value, 0)
+    pipeline = get_pipeline(conf)
+    state = TradeState()
+    replay = decisions(arrays, conf)
+    mismatches = 0
+    for i in range(len(arrays['close'])):
+        kline = [int(data['open_time'][i]), 0, 0, 0, data['close'][i], 0,
+                 int(data['close_time'][i])]
+        readings = dict(engine.update(kline))
+        if upper:
+            start = (kline[0] - offset) // upper_ms * upper_ms + offset
+            readings.update(upper.update([start, 0, 0, 0, data['close'][i], 0, 0]))
+        readings['timeend'] = kline[6]
+        pipeline.evaluate(state, readings)
+        if next(replay)[1:] != (state.validateBuy, state.validateSell):
+            mismatches += 1
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Backtest the strategy configured in the environment on historical klines')
+    parser.add_argument('path', help='CSV (Binance kline dump), Parquet file or kline store directory')
+    parser.add_argument('--cash', type=float, default=1000.0)
+    parser.add_argument('--fee', type=float, default=0.001)
+    parser.add_argument('--verify', action='store_true',
+                        help='check the decisions against the live incremental indicators')
+    args = parser.parse_args()
+
+    data = load_klines(args.path)
+    interval = guess_interval(data)
+    start = time.perf_counter()
+    result = backtest(data, cash=args.cash, fee=args.fee)
+    elapsed = time.perf_counter() - start
+    print(f"{len(data['close'])} {interval} candles in {elapsed:.2f}s")
+    for trade in result['trades']:
+        print(f"Bought {trade['buy']} Sold {trade['sell']} PnL {trade['pnl']:.2f}")
+    print(f"Trades: {len(result['trades'])} - Win rate: {result['win_rate']:.2%} - "
+          f"PnL: {result['pnl']:.2f} ({result['return']:.2%}) - "
+          f"Max drawdown: {result['max_drawdown']:.2%}")
+    if args.verify:
+        mismatches = verify(data)
+        print(f"Decisions differing from the live loop: {mismatches}")
+        if mismatches:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import numpy as np
+
+# Every function takes a (symbols x candles) float64 matrix, oldest candle
+# first, and returns matrices of the same shape. Rows with a shorter history
+# are padded with leading NaNs; each row gets the values TA-Lib and Stoch()
+# give for its own candles, NaN where the indicator is still warming up.
+# Windows are reduced a shift at a time over the whole matrix and the
+# recursions (RSI, EMA) step over the candles with every symbol at once, so
+# the Python overhead is paid per candle instead of per symbol and candle.
+
+
+def left_align(values):
+    '''
+    Shift every row left to its first value, returns the shifted rows and the shifts
+    '''
+    rows, length = values.shape
+    valid = ~np.isnan(values)
+    starts = np.where(valid.any(axis=1), valid.argmax(axis=1), length)
+    if not starts.any():
+        return values, starts
+    columns = np.arange(length) + starts[:, None]
+    aligned = np.take_along_axis(values, np.minimum(columns, length - 1), axis=1)
+    aligned[columns >= length] = np.nan
+    return aligned, starts
+
+
+def right_align(values, starts):
+    '''
+    Undo left_align()
+    '''
+    if not starts.any():
+        return values
+    columns = np.arange(values.shape[1]) - starts[:, None]
+    aligned = np.take_along_axis(values, np.maximum(columns, 0), axis=1)
+    aligned[columns < 0] = np.nan
+    return aligned
+
+
+def _rsi(close, period):
+    rows, length = close.shape
+    out = np.full((length, rows), np.nan)
+    if length <= period:
+        return out.T
+    # Candles first, so every step of the recursion reads contiguous memory
+    diff = np.diff(np.ascontiguousarray(close.T), axis=0)
+    moves = np.empty((length - 1, 2, rows))
+    np.maximum(diff, 0.0, out=moves[:, 0])
+    np.maximum(-diff, 0.0, out=moves[:, 1])
+    averages = np.empty((length - period, 2, rows))
+    average = np.zeros((2, rows))
+    for i in range(period):
+        average += moves[i]
+    average /= period
+    averages[0] = average
+    for i in range(1, length - period):
+        average = (average * (period - 1) + moves[period + i - 1]) / period
+        averages[i] = average
+    gain, loss = averages[:, 0], averages[:, 1]
+    total = gain + loss
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # TA-Lib reads totals within 1e-8 of zero as zero
+        out[period:] = np.where(np.abs(total) < 1e-8, 0.0, 100.0 * (gain / total))
+    return np.ascontiguousarray(out.T)
+
+
+def _ema(close, period):
+    rows, length = close.shape
+    out = np.full((length, rows), np.nan)
+    if length < period:
+        return out.T
+    values = np.ascontiguousarray(close.T)
+    k = 2.0 / (period + 1)
+    average = np.zeros(rows)
+    for i in range(period):
+        average += values[i]
+    average /= period
+    out[period - 1] = average
+    for i in range(period, length):
+        average = (values[i] - average) * k + average
+        out[i] = average
+    return np.ascontiguousarray(out.T)
+
+
+def rolling(values, window, combine):
+    '''
+    Rolling reduction of every row by np.minimum, np.maximum or np.add, oldest value first
+
+    NaN until the window is full or while it holds a NaN, like pandas.
+    '''
+    rows, length = values.shape
+    out = np.full((rows, length), np.nan)
+    if length >= window:
+        count = length - window + 1
+        result = values[:, :count].copy()
+        for shift in range(1, window):
+            combine(result, values[:, shift:shift + count], out=result)
+        out[:, window - 1:] = result
+    return out
+
+
+def _wma(close, period):
+    rows, length = close.shape
+    out = np.full((rows, length), np.nan)
+    if length >= period:
+        count = length - period + 1
+        # Weighted 1 for the oldest candle of the window up to period for the newest
+        weighted = close[:, :count].copy()
+        for shift in range(1, period):
+            weighted += close[:, shift:shift + count] * (shift + 1)
+        out[:, period - 1:] = weighted / (period * (period + 1) / 2)
+    return out
+
+
+def _stoch(rsi, smoothk, smoothd, n):
+    lowestlow = rolling(rsi, n, np.minimum)
+    highesthigh = rolling(rsi, n, np.maximum)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        raw = 100 * ((rsi - lowestlow) / (highesthigh - lowestlow))
+    raw[~np.isfinite(raw)] = np.nan
+    K = rolling(raw, smoothk, np.add) / smoothk
+    D = rolling(K, smoothd, np.add) / smoothd
+    return K, D
+
+
+def rsi(close, period):
+    '''
+    Wilder RSI of every row, like talib.RSI
+    '''
+    aligned, starts = left_align(close)
+    return right_align(_rsi(aligned, period), starts)
+
+
+def ema(close, period):
+    '''
+    EMA of every row, like talib.EMA
+    '''
+    aligned, starts = left_align(close)
+    return right_align(_ema(aligned, period), starts)
+
+
+def wma(close, period):
+    '''
+    WMA of every row, like talib.WMA
+    '''
+    aligned, starts = left_align(close)
+    return right_align(_wma(aligned, period), starts)
+
+
+def stochrsi(close, rsi_period, stoch_period, smoothk, smoothd):
+    '''
+    RSI, %K and %D of every row, like Stoch(rsi, rsi, rsi, smoothk, smoothd, stoch_period)
+    '''
+    aligned, starts = left_align(close)
+    rsiValues = _rsi(aligned, rsi_period)
+    K, D = _stoch(rsiValues, smoothk, smoothd, stoch_period)
+    return right_align(rsiValues, starts), right_align(K, starts), right_align(D, starts)
+
@@ -0,0 +1,699 @@
+#!python3
+import argparse
+import asyncio
+import contextlib
+import io
+import random
+import statistics
+import time
+import tracemalloc
+
+import settings
+from candles import INTERVAL_MS
+from replay_server import (ReplayClient, ReplayServer, synthetic_events,
+                           synthetic_klines)
+
+
+def report(name, samples, unit='ms', scale=1000):
+    '''
+    Print the distribution of a list of timings given in seconds
+    '''
+    samples = sorted(samples)
+    if not samples:
+        print(f"{name}: no samples")
+        return
+    p = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * scale
+    print(f"{name}: n={len(samples)} mean={statistics.mean(samples) * scale:.3f}{unit} "
+          f"p50={p(0.5):.3f}{unit} p95={p(0.95):.3f}{unit} p99={p(0.99):.3f}{unit} "
+          f"max={samples[-1] * scale:.3f}{unit}")
+
+
+def mock_exchange(args, symbols=None):
+    '''
+    Start a mock exchange with candles for the configured pair and timeframes
+    '''
+    from mock_exchange import MockExchange
+
+    exchange = MockExchange(latency=args.latency, fill_delay=args.fill_delay)
+    for symbol in symbols or [settings.trade_crypto + settings.trade_coin]:
+        exchange.add_symbol(symbol, settings.trade_time_frame)
+        exchange.add_symbol(symbol, settings.trade_upper_stoch_validator_value)
+    exchange.start()
+    settings.stream_url = exchange.stream_url
+    settings.user_data_stream = int(not args.poll)
+    return exchange
+
+
+def wait_for_user_stream(client, timeout=5):
+    from account import get_account_service
+    from orders import get_order_manager
+
+    service = get_account_service(client)
+    # Subscribed before the first order, as in bot.main(), or its reports are missed
+    get_order_manager(client)
+    if service.stream:
+        service.stream.connected.wait(timeout)
+
+
+def total_requests(exchange):
+    return sum(exchange.requests.values())
+
+
+def bench_loop(args):
+    '''
+    Per-tick time and request rate of the polling loop against the mock exchange
+    '''
+    from bot import TradeState, tick
+
+    from metrics import instrument, registry
+
+    exchange = mock_exchange(args)
+    symbol = settings.trade_crypto + settings.trade_coin
+    client = instrument(exchange.client())
+    state = TradeState()
+    rng = random.Random(0)
+    # The first tick seeds the candle stores
+    with contextlib.redirect_stdout(io.StringIO()):
+        tick(client, state)
+    wait_for_user_stream(client)
+
+    times, requests = [], []
+    weight = exchange.weight
+    stages = registry.stages()
+    for i in range(args.ticks):
+        close = exchange.price(symbol) * (1 + rng.gauss(0, 0.002))
+        exchange.push(symbol, settings.trade_time_frame, close, new=i % args.ticks_per_candle == 0)
+        exchange.push(symbol, settings.trade_upper_stoch_validator_value, close)
+        before = total_requests(exchange)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            tick(client, state)
+        times.append(time.perf_counter() - start)
+        requests.append(total_requests(exchange) - before)
+    exchange.stop()
+
+    report('tick', times)
+    per_tick = statistics.mean(requests)
+    cycle = args.period + statistics.mean(times)
+    print(f"requests per tick: {per_tick:.2f} ({per_tick * 60 / cycle:.1f}/min at a {args.period}s cadence)")
+    print(f"weight per tick: {(exchange.weight - weight) / args.ticks:.2f}")
+    print('requests:', ', '.join(f"{k}={v}" for k, v in exchange.requests.most_common()))
+    # Where the time of a tick goes
+    for stage, (count, total) in sorted(registry.stages().items()):
+        count -= stages.get(stage, (0, 0))[0]
+        total -= stages.get(stage, (0, 0))[1]
+        if count:
+            print(f"  {stage}: {total / args.ticks * 1000:.3f}ms per tick ({count} spans)")
+
+
+def bench_fetch(args):
+    '''
+    Tick time with the requests of a tick sent one after another or all at once
+    '''
+    from bot import TradeState, tick
+    from candles import get_upper_candles
+
+    exchange = mock_exchange(args)
+    symbol = settings.trade_crypto + settings.trade_coin
+    client = exchange.client()
+    settings.trade_upper_stoch_validator = 1
+    upper = settings.trade_upper_stoch_validator_value
+    # Fetch the upper candles on every base candle, as for intervals that do not divide
+    get_upper_candles(client, symbol, settings.trade_time_frame, upper).resample = False
+    wait_for_user_stream(client)
+    rng = random.Random(0)
+
+    for mode, name in ((0, 'sequential'), (1, 'concurrent')):
+        settings.async_fetch = mode
+        state = TradeState()
+        with contextlib.redirect_stdout(io.StringIO()):
+            tick(client, state)
+        times = []
+        before = total_requests(exchange)
+        for i in range(args.ticks):
+            close = exchange.price(symbol) * (1 + rng.gauss(0, 0.002))
+            exchange.push(symbol, settings.trade_time_frame, close, new=True)
+            exchange.push(symbol, upper, close, new=i % 4 == 0)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                tick(client, state)
+            times.append(time.perf_counter() - start)
+        report(f"{name} tick", times)
+        print(f"  requests per tick: {(total_requests(exchange) - before) / args.ticks:.2f}")
+    exchange.stop()
+
+
+def bench_book(args):
+    '''
+    Time to price an order from the book ticker request or the local order book
+    '''
+    from bot import request_book
+    from order_book import get_order_book
+
+    exchange = mock_exchange(args)
+    symbol = settings.trade_crypto + settings.trade_coin
+    client = exchange.client()
+    book = get_order_book(client, symbol)
+    rng = random.Random(0)
+
+    def move():
+        exchange.push(symbol, settings.trade_time_frame,
+                      exchange.price(symbol) * (1 + rng.gauss(0, 0.001)))
+
+    while not book.synced.wait(0.1):
+        move()
+    for mode, name in ((0, 'book ticker request'), (1, 'local order book')):
+        settings.order_book = mode
+        times = []
+        for i in range(args.lookups):
+            move()
+            start = time.perf_counter()
+            request_book(client, symbol).result()
+            times.append(time.perf_counter() - start)
+        report(name, times)
+
+    # Lose two updates: the next event shows the gap and the book is rebuilt
+    exchange.drop_depth_updates(symbol, 2)
+    move()
+    start = time.perf_counter()
+    while not book.synced.wait(0.01) or book.bids != {
+            float(p): float(q) for p, q in exchange.depth(symbol)['bids'].items()}:
+        move()
+    print(f"resynced after a gap in {(time.perf_counter() - start) * 1000:.1f}ms, "
+          f"{exchange.requests['GET depth']} snapshots")
+    exchange.stop()
+
+
+def bench_order(args):
+    '''
+    Signal-to-order and signal-to-fill latency of trade() against the mock exchange
+    '''
+    from bot import TradeState, trade
+
+    exchange = mock_exchange(args)
+    client = exchange.client()
+    settings.notification_only = 0
+    settings.trade_market = int(args.market)
+    wait_for_user_stream(client)
+    readings = {'rsi': 50.0, 'K': 50.0, 'D': 50.0}
+    state = TradeState()
+
+    placed, filled = [], []
+    for i in range(args.orders):
+        state.validateBuy, state.validateSell = i % 2 == 0, i % 2 == 1
+        logged = len(exchange.requestLog)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = trade(client, state, readings)
+        filled.append(time.perf_counter() - start)
+        posted = [t for t, method, path in exchange.requestLog[logged:]
+                  if method == 'POST' and path == 'order']
+        if posted:
+            placed.append(posted[0] - start)
+        if result is None or result['status'] != 'FILLED':
+            print(f"Order {i} did not fill: {result}")
+    exchange.stop()
+
+    report('signal-to-order', placed)
+    report('signal-to-fill', filled)
+    print('requests:', ', '.join(f"{k}={v}" for k, v in exchange.requests.most_common()))
+
+
+def import_time(statement, runs):
+    '''
+    Seconds a fresh interpreter takes to run an import statement
+    '''
+    import os
+    import subprocess
+    import sys
+
+    code = f"import time; t = time.perf_counter(); {statement}; print(time.perf_counter() - t)"
+    return [float(subprocess.run([sys.executable, '-c', code], check=True, capture_output=True,
+                                 text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout)
+            for run in range(runs)]
+
+
+def first_decision(env, timeout=60):
+    '''
+    Start bot.py, returning the seconds to its first status line and its peak RSS in MB
+    '''
+    import os
+    import subprocess
+    import sys
+    import threading
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot.py')
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, script], env=env, text=True,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    watchdog = threading.Timer(timeout, process.kill)
+    watchdog.start()
+    try:
+        for line in process.stdout:
+            if line.startswith('Price:'):
+                elapsed = time.perf_counter() - start
+                peak = None
+                with contextlib.suppress(OSError), open(f"/proc/{process.pid}/status") as f:
+                    # High water mark of the resident set, Linux only
+                    peak = next(int(l.split()[1]) / 1024 for l in f if l.startswith('VmHWM'))
+                return elapsed, peak
+        raise RuntimeError('bot.py exited before its first decision')
+    finally:
+        watchdog.cancel()
+        process.kill()
+        process.wait()
+
+
+def bench_startup(args):
+    '''
+    Import time, time to first decision and peak memory of bot.py, cold and with a warm kline store
+    '''
+    import os
+    import tempfile
+
+    report('import bot', import_time('import bot', args.runs))
+    report('  + python-binance, imported by main()', import_time('import bot, binance.client', args.runs))
+
+    from mock_exchange import MockExchange
+
+    exchange = MockExchange(latency=args.latency)
+    symbol = settings.trade_crypto + settings.trade_coin
+    for interval in (settings.trade_time_frame, settings.trade_upper_stoch_validator_value):
+        # History up to the candle open now, where the kline store starts from
+        step = INTERVAL_MS[interval]
+        exchange.add_symbol(symbol, interval, start=(int(time.time() * 1000) // step - 999) * step)
+    exchange.start()
+    env = dict(os.environ, API_URL=exchange.api_url, STREAM_URL=exchange.stream_url,
+               BINANCE_APIKEY='mock', BINANCE_SECRET_KEY='mock', PYTHONUNBUFFERED='1',
+               USER_DATA_STREAM=str(int(not args.poll)), TRADE_STREAMING='0', TRADE_PAIRS='[]',
+               KLINE_CACHE_DIR='', STATE_DIR='', RECORD_DIR='', METRICS_PORT='0')
+    with tempfile.TemporaryDirectory() as cache:
+        # The first run fills the kline store, the next ones start from it
+        for name, overrides in (('cold start', {}), ('warm kline store', {'KLINE_CACHE_DIR': cache})):
+            times, peaks = [], []
+            for run in range(args.runs + bool(overrides)):
+                elapsed, peak = first_decision(dict(env, **overrides))
+                if overrides and not run:
+                    continue
+                times.append(elapsed)
+                peaks.append(peak)
+            report(f"{name}: start to first decision", times)
+            if None not in peaks:
+                print(f"  peak RSS: {max(peaks):.1f}MB")
+    print('requests:', ', '.join(f"{k}={v}" for k, v in exchange.requests.most_common()))
+    exchange.stop()
+
+
+def bench_memory(args):
+    '''
+    Memory held per symbol once candles and indicators are loaded
+    '''
+    from bot import TradeState, tick
+
+    pairs = [{'TRADE_CRYPTO': f"C{i}"} for i in range(args.symbols)]
+    exchange = mock_exchange(args, [f"C{i}{settings.trade_coin}" for i in range(args.symbols)])
+    client = exchange.client()
+    confs = [settings.pair_settings(pair) for pair in pairs]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        # Import-time and first-use allocations are not per symbol
+        tick(client, TradeState(), confs[0])
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for conf in confs[1:]:
+            tick(client, TradeState(), conf)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    exchange.stop()
+
+    # Leave out what the exchange itself allocates in this process
+    server = [tracemalloc.Filter(False, '*aiohttp*'), tracemalloc.Filter(False, '*mock_exchange.py')]
+    stats = after.filter_traces(server).compare_to(before.filter_traces(server), 'filename')
+    total = sum(stat.size_diff for stat in stats)
+    print(f"memory per symbol: {total / max(1, len(confs) - 1) / 1024:.1f} KiB")
+    for stat in stats[:args.top]:
+        print(f"  {stat.traceback[0].filename}: {stat.size_diff / max(1, len(confs) - 1) / 1024:.1f} KiB")
+
+
+def dataframe_readings(candles):
+    '''
+    The per-tick parsing of compute_readings before KlineArrays, kept for comparison
+    '''
+    import datetime
+
+    import numpy as np
+    import pandas as pd
+    import talib
+    from bot import Stoch
+
+    df = pd.DataFrame(list(candles))
+    df.columns = ['timestart', 'open', 'high', 'low',
+                  'close', '?', 'timeend', '?', '?', '?', '?', '?']
+    df.timestart = [datetime.datetime.fromtimestamp(i / 1000) for i in df.timestart.values]
+    df.timeend = [datetime.datetime.fromtimestamp(i / 1000) for i in df.timeend.values]
+    df['rsi'] = talib.RSI(np.array([float(x) for x in df.close.values]), settings.trade_rsi_ifr)
+    df['K'], df['D'] = Stoch(df.rsi, df.rsi, df.rsi, settings.trade_rsi_k,
+                             settings.trade_rsi_d, settings.trade_rsi_stochastic)
+    return {'timeend': df.timeend.iloc[-1],
+            'rsi': round(float(df.rsi.astype(str).iloc[-1]), 8),
+            'K': round(float(df.K.astype(str).iloc[-1]), 8),
+            'D': round(float(df.D.astype(str).iloc[-1]), 8)}
+
+
+def bench_parse(args):
+    '''
+    Per-tick kline parsing and indicator readback: DataFrame of strings vs typed arrays
+    '''
+    from collections import deque
+
+    from bot import compute_readings
+    from candles import KlineArrays
+
+    settings.trade_wma_cross = settings.trade_ema_cross = settings.trade_ema_base_candle = 0
+    settings.trade_upper_stoch_validator = 0
+    klines = synthetic_klines(settings.trade_time_frame, args.history + args.ticks)
+    rows = deque(klines[:args.history], maxlen=args.history)
+    arrays = KlineArrays(args.history)
+    arrays.extend(klines[:args.history])
+
+    results = {}
+    for name, window, readings in (('dataframe', rows, dataframe_readings),
+                                   ('arrays', arrays, compute_readings)):
+        times, peaks = [], []
+        tracemalloc.start()
+        for kline in klines[args.history:]:
+            tracemalloc.reset_peak()
+            start = time.perf_counter()
+            window.append(kline)
+            results.setdefault(name, []).append(readings(window))
+            times.append(time.perf_counter() - start)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        report(f"{name} tick", times)
+        print(f"{name} peak allocation per tick: {statistics.mean(peaks) / 1024:.1f} KiB")
+
+    worst = max(abs(a[k] - b[k]) for a, b in zip(results['dataframe'], results['arrays'])
+                for k in ('rsi', 'K', 'D') if a[k] == a[k])
+    print(f"max abs difference: {worst:.2e}")
+
+
+def bench_schedule(args):
+    '''
+    Wake-up precision of the candle scheduler on the mock exchange clock, and evaluations per candle
+    '''
+    from scheduler import CandleScheduler
+
+    exchange = mock_exchange(args)
+    scheduler = CandleScheduler(exchange.client(), [settings.trade_time_frame], args.every, grace=0)
+    lateness = []
+    for i in range(args.wakes):
+        scheduler.wait()
+        now = scheduler.now()
+        # Closes fall on multiples of the cadence too, the same wake up
+        lateness.append(now % args.every)
+    exchange.stop()
+
+    report('wake-up lateness', lateness)
+    step = INTERVAL_MS[settings.trade_time_frame] / 1000
+    every = settings.trade_evaluate_interval
+    print(f"evaluations per {settings.trade_time_frame} candle: {step / every if every else 1:g} "
+          f"with TRADE_EVALUATE_INTERVAL={every:g}, {step / 5:g} with a fixed 5s sleep")
+
+
+def bench_stream(args):
+    '''
+    Event-to-decision latency of the streaming mode against a local replay server
+    '''
+    from bot import TradeState
+    from stream import StreamRunner
+
+    interval = settings.trade_time_frame
+    klines = synthetic_klines(interval, 500 + args.candles)
+    history, live = klines[:500], klines[500:]
+    messages = synthetic_events(settings.trade_crypto + settings.trade_coin,
+                                interval, live, args.ticks)
+    upper = settings.trade_upper_stoch_validator_value
+    client = ReplayClient({interval: history, upper: synthetic_klines(upper, 500)})
+    # ReplayClient has no user data stream, nor an HTTP endpoint
+    settings.user_data_stream = 0
+    settings.async_fetch = 0
+
+    latencies = []
+
+    class Runner(StreamRunner):
+        received = 0
+
+        def handle(self, message):
+            self.received += 1
+            return super().handle(message)
+
+    async def run():
+        async with ReplayServer(messages, delay=args.delay) as server:
+            def on_decision(state, readings):
+                latencies.append(time.perf_counter() - server.sent[runner.received - 1])
+
+            runner = Runner(client, TradeState(), url=server.url, on_decision=on_decision)
+            await runner.run(reconnect=False)
+
+    asyncio.run(run())
+    report('stream event-to-decision', latencies)
+
+
+def synthetic_recording(path, interval, count, history=500):
+    '''
+    Write what the polling loop records on count candle closes of synthetic klines
+    '''
+    import clock
+    from recorder import Recorder
+
+    conf = settings.pair_settings({'TRADE_TIME_FRAME': interval})
+    symbol = conf.trade_crypto + conf.trade_coin
+    klines = synthetic_klines(interval, history + count + 1)
+    opening = lambda k: [k[0], k[1], k[1], k[1], k[1], 0, k[6]]
+    clock.use(clock.VirtualClock(klines[history][0] / 1000 + 0.3))
+    recorder = Recorder(path, conf)
+    # The history window on start, then the closed and the new candle on every close
+    recorder.klines(symbol, interval, klines[:history] + [opening(klines[history])])
+    for i in range(history, history + count):
+        clock.sleep(klines[i + 1][0] / 1000 + 0.3 - clock.time())
+        recorder.klines(symbol, interval, [klines[i], opening(klines[i + 1])])
+    recorder.close()
+    clock.use(clock.RealClock())
+
+
+def bench_replay(args):
+    '''
+    Replay time of recorded polling, checked to give the same fills every run
+    '''
+    import os
+    import subprocess
+    import sys
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as path:
+        synthetic_recording(path, args.interval, args.candles)
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'replay.py')
+        outputs = []
+        for run in range(args.runs):
+            start = time.perf_counter()
+            output = subprocess.run([sys.executable, script, path, '--quiet'], check=True,
+                                    capture_output=True, text=True).stdout
+            elapsed = time.perf_counter() - start
+            outputs.append([line for line in output.splitlines() if not line.startswith('Replayed')])
+            span = args.candles * INTERVAL_MS[args.interval] / 1000
+            print(f"run {run + 1}: {args.candles} {args.interval} candles in {elapsed:.2f}s "
+                  f"({span / elapsed:.0f}x real time), {len(outputs[-1]) - 1} fills")
+        print(f"identical fills in every run: {all(o == outputs[0] for o in outputs)}")
+        print(outputs[0][-1])
+
+
+def bench_batch(args):
+    '''
+    Indicators of many symbols at once on a 2D matrix vs one symbol at a time
+    '''
+    import numpy as np
+    import pandas as pd
+    import talib
+
+    from batch_indicators import ema, stochrsi, wma
+    from bot import Stoch
+    from indicators import stochrsi_params
+
+    n, s, k, d = stochrsi_params(settings)
+    emaPeriod, wmaPeriod = settings.trade_ema_high, settings.trade_wma_middle
+    rng = np.random.default_rng(0)
+    errors = {}
+    mismatches = 0
+    for count in [int(c) for c in args.symbols.split(',')]:
+        close = 30000 * np.exp(np.cumsum(rng.normal(0, 0.002, (count, args.candles)), axis=1))
+        # Every third symbol was listed later and has a shorter history
+        close[::3, :args.candles // 4] = np.nan
+
+        start = time.perf_counter()
+        expected = []
+        for row in close:
+            row = row[~np.isnan(row)]
+            rsi = talib.RSI(row, n)
+            rsiSeries = pd.Series(rsi)
+            K, D = Stoch(rsiSeries, rsiSeries, rsiSeries, k, d, s)
+            expected.append((rsi, K.to_numpy(), D.to_numpy(),
+                             talib.EMA(row, emaPeriod), talib.WMA(row, wmaPeriod)))
+        single = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batched = stochrsi(close, n, s, k, d) + (ema(close, emaPeriod), wma(close, wmaPeriod))
+        batch = time.perf_counter() - start
+
+        for i, values in enumerate(expected):
+            for name, want, got in zip(('rsi', 'K', 'D', 'ema', 'wma'), values, batched):
+                got = got[i][-len(want):]
+                mismatches += int((np.isnan(want) != np.isnan(got)).sum())
+                both = ~np.isnan(want) & ~np.isnan(got)
+                if both.any():
+                    # Relative to the value, prices and oscillators have different scales
+                    error = np.abs(want - got)[both] / np.maximum(1.0, np.abs(want[both]))
+                    errors[name] = max(errors.get(name, 0.0), float(error.max()))
+        print(f"{count} symbols: {single / count * 1e6:.1f}us per symbol one at a time, "
+              f"{batch / count * 1e6:.1f}us batched ({single / batch:.1f}x)")
+
+    for name, error in sorted(errors.items()):
+        print(f"{name}: max relative error {error:.2e}")
+    if mismatches or max(errors.values()) > args.tolerance:
+        raise SystemExit(f"Batched indicators differ: {mismatches} NaN mismatches, "
+                         f"max error {max(errors.values()):.2e}")
+
+
+def bench_indicators(args):
+    '''
+    Check the incremental engine against Stoch()/TA-Lib and time both paths
+    '''
+    from bot import compute_readings
+    from indicators import IndicatorEngine
+
+    # Compare every indicator the strategies can use
+    settings.trade_wma_cross = settings.trade_ema_cross = settings.trade_ema_base_candle = 1
+    settings.trade_upper_stoch_validator = 0
+    interval = settings.trade_time_frame
+    klines = synthetic_klines(interval, args.candles)
+    engine = IndicatorEngine(settings)
+
+    errors = {}
+    engine_times = []
+    full_times = []
+    for i, kline in enumerate(klines):
+        # Revise the open candle a few times before it closes, like the live feed
+        for tick in range(1, args.ticks + 1):
+            partial = list(kline)
+            partial[4] = f"{float(kline[1]) + (float(kline[4]) - float(kline[1])) * tick / args.ticks:.8f}"
+            start = time.perf_counter()
+            readings = engine.update(partial)
+            engine_times.append(time.perf_counter() - start)
+        if i < 100 or i % args.every:
+            continue
+        start = time.perf_counter()
+        expected = compute_readings(klines[:i + 1])
+        full_times.append(time.perf_counter() - start)
+        for name, value in expected.items():
+            if name == 'timeend' or value != value:
+                continue
+            errors[name] = max(errors.get(name, 0.0), abs(value - readings[name]))
+
+    for name, error in sorted(errors.items()):
+        print(f"{name}: max abs error {error:.2e}")
+    report('incremental update', engine_times, 'us', 1e6)
+    report('full recompute', full_times, 'us', 1e6)
+    worst = max(errors.values())
+    if worst > args.tolerance:
+        raise SystemExit(f"Engine drifted from Stoch()/TA-Lib by {worst:.2e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Trading loop benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    stream = commands.add_parser('stream', help=bench_stream.__doc__.strip())
+    stream.add_argument('--candles', type=int, default=200)
+    stream.add_argument('--ticks', type=int, default=4, help='kline updates per candle')
+    stream.add_argument('--delay', type=float, default=0.02,
+                        help='seconds between messages, keeps queueing out of the latency')
+    stream.set_defaults(func=bench_stream)
+
+    indicators = commands.add_parser('indicators', help=bench_indicators.__doc__.strip())
+    indicators.add_argument('--candles', type=int, default=3000)
+    indicators.add_argument('--ticks', type=int, default=3, help='revisions per candle')
+    indicators.add_argument('--every', type=int, default=25, help='compare every n candles')
+    indicators.add_argument('--tolerance', type=float, default=1e-6)
+    indicators.set_defaults(func=bench_indicators)
+
+    replay = commands.add_parser('replay', help=bench_replay.__doc__.strip())
+    replay.add_argument('--interval', default='1m')
+    replay.add_argument('--candles', type=int, default=7 * 24 * 60, help='a week of 1m by default')
+    replay.add_argument('--runs', type=int, default=2)
+    replay.set_defaults(func=bench_replay)
+
+    batch = commands.add_parser('batch', help=bench_batch.__doc__.strip())
+    batch.add_argument('--symbols', default='1,10,100,1000', help='universe sizes to time')
+    batch.add_argument('--candles', type=int, default=500)
+    batch.add_argument('--tolerance', type=float, default=1e-9)
+    batch.set_defaults(func=bench_batch)
+
+    schedule = commands.add_parser('schedule', help=bench_schedule.__doc__.strip())
+    schedule.add_argument('--every', type=float, default=0.5, help='cadence to time the wake ups on, seconds')
+    schedule.add_argument('--wakes', type=int, default=10)
+    schedule.set_defaults(func=bench_schedule)
+
+    parse = commands.add_parser('parse', help=bench_parse.__doc__.strip())
+    parse.add_argument('--history', type=int, default=500, help='candles per tick')
+    parse.add_argument('--ticks', type=int, default=300)
+    parse.set_defaults(func=bench_parse)
+
+    def exchange_options(command):
+        command.add_argument('--latency', type=float, default=0.0,
+                             help='seconds added to every mock REST response')
+        command.add_argument('--fill-delay', type=float, default=0.0,
+                             help='seconds before a mock limit order fills')
+        command.add_argument('--poll', action='store_true',
+                             help='poll REST instead of using the user data stream')
+
+    loop = commands.add_parser('loop', help=bench_loop.__doc__.strip())
+    loop.add_argument('--ticks', type=int, default=100)
+    loop.add_argument('--ticks-per-candle', type=int, default=5)
+    loop.add_argument('--period', type=float, default=5, help='seconds between ticks in main()')
+    exchange_options(loop)
+    exchange_options(schedule)
+    loop.set_defaults(func=bench_loop)
+
+    fetch = commands.add_parser('fetch', help=bench_fetch.__doc__.strip())
+    fetch.add_argument('--ticks', type=int, default=50)
+    exchange_options(fetch)
+    fetch.set_defaults(func=bench_fetch)
+
+    book = commands.add_parser('book', help=bench_book.__doc__.strip())
+    book.add_argument('--lookups', type=int, default=100)
+    exchange_options(book)
+    book.set_defaults(func=bench_book)
+
+    order = commands.add_parser('order', help=bench_order.__doc__.strip())
+    order.add_argument('--orders', type=int, default=20, help='alternating buys and sells')
+    order.add_argument('--market', action='store_true', help='market instead of limit orders')
+    exchange_options(order)
+    order.set_defaults(func=bench_order)
+
+    startup = commands.add_parser('startup', help=bench_startup.__doc__.strip())
+    startup.add_argument('--runs', type=int, default=5)
+    exchange_options(startup)
+    startup.set_defaults(func=bench_startup)
+
+    memory = commands.add_parser('memory', help=bench_memory.__doc__.strip())
+    memory.add_argument('--symbols', type=int, default=20)
+    memory.add_argument('--top', type=int, default=5, help='largest allocating files to list')
+    exchange_options(memory)
+    memory.set_defaults(func=bench_memory)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,54 @@
 #!python3
-import configparser
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
 import datetime
-import json
-import math
-import os
-import queue
 import random
-import time
 import traceback
 import sys
+import uuid
+from typing import TYPE_CHECKING
 
-import pandas as pd
-import talib
-import numpy as np  # computing multi dimension la arrays
-import urllib3
-
-import requests
-from binance.client import Client
-from binance.exceptions import BinanceAPIException
-
+import clock
 import settings
+from account import get_account_service
+from candles import as_arrays, get_candle_store, get_upper_candles
+from orders import get_order_manager
 from colors import bcolors
+from exchange_info import get_exchange_info
+from indicators import WMA, get_engine
+from metrics import inc, instrument, serve, span
+from ratelimit import limit
+from state_store import get_state_store
+from strategy import get_pipeline
+from recorder import get_recorder
+
+if TYPE_CHECKING:
+    from binance.client import Client
 
+# pandas, TA-Lib, python-binance, aiohttp and requests take most of the start-up
+# time, so they are imported where first needed: the live loop never uses
+# pandas or TA-Lib, and replays and backtests need no exchange client.
 
-def telegram_bot_send_text(bot_message):
-    if settings.telegram_token:
-        bot_token = settings.telegram_token
-        bot_chatID = settings.telegram_chat_id
-        send_text = 'https://api.telegram.org/bot' + bot_token + \
-            '/sendMessage?chat_id=' + bot_chatID + '&parse_mode=Markdown&text=' + bot_message
-        response = requests.get(send_text)
-        return response.json()
+# How long a restart waits for an order it left open to be settled
+SETTLE_TIMEOUT = 60
+
+
+def telegram_bot_send_text(bot_message, key=None):
+    '''
+    Queue a Telegram message, repeats of the same key within a window are coalesced
+    '''
+    from notifier import get_notifier
+
+    notifier = get_notifier()
+    if notifier:
+        return notifier.send(bot_message, key)
 
 
 def Stoch(close, high, low, smoothk, smoothd, n):
+    import pandas as pd
+
     lowestlow = pd.Series.rolling(low, window=n, center=False).min()
     highesthigh = pd.Series.rolling(high, window=n, center=False).max()
     K = pd.Series.rolling(
@@ -42,19 +57,25 @@ def Stoch(close, high, low, smoothk, smoothd, n):
     return K, D
 
 
-def retry(howmany):
+def retry(howmany, backoff=1, backoff_max=30):
+    '''
+    Call again on failure, up to howmany attempts, waiting longer each time
+
+    Rate limits are handled by the client itself, see ratelimit.limit().
+    Returns None once every attempt failed.
+    '''
     def tryIt(func):
         def f(*args, **kwargs):
-            time.sleep(1)
-            attempts = 0
-            while attempts < howmany:
+            for attempt in range(howmany):
                 try:
                     return func(*args, **kwargs)
                 except Exception as e:
                     print("Failed to Buy/Sell. Trying Again.")
-                    if attempts == 0:
-                        print(e)
-                        attempts += 1
+                    print(e)
+                    inc('bot_retries_total', function=func.__name__)
+                    if attempt + 1 < howmany:
+                        # Full jitter keeps several bots from retrying in step
+                        clock.sleep(random.uniform(0, min(backoff_max, backoff * 2 ** attempt)))
 
         return f
 
@@ -65,158 +86,466 @@ def get_market_ticker_price(client, ticker_symbol):
     '''
     Get ticker price of a specific coin
     '''
-    for ticker in client.get_symbol_ticker():
-        if ticker[u'symbol'] == ticker_symbol:
-            return float(ticker[u'price'])
-    return None
+    return float(client.get_symbol_ticker(symbol=ticker_symbol)[u'price'])
+
+
+def local_book(symbol, conf=settings):
+    '''
+    The local order book of a symbol when ORDER_BOOK is on and it is in sync, else None
+    '''
+    if not conf.order_book:
+        return None
+    from order_book import local_order_book
+    return local_order_book(symbol)
+
+
+def request_book(client: Client, symbol, conf=settings):
+    '''
+    Start fetching the book ticker of a symbol, returns a future of it
+
+    Read from the local order book when one is kept and in sync.
+    '''
+    local = local_book(symbol, conf)
+    ticker = local and local.ticker()
+    if ticker:
+        future = concurrent.futures.Future()
+        future.set_result(ticker)
+    elif conf.async_fetch:
+        from market_data import get_market_data
+        market = get_market_data(client)
+        future = market.submit(market.orderbook_ticker(symbol))
+    else:
+        future = concurrent.futures.Future()
+        future.set_result(client.get_orderbook_ticker(symbol=symbol))
+    recorder = get_recorder()
+    if recorder:
+        future.add_done_callback(lambda f: f.exception() or recorder.book(symbol, f.result()))
+    return future
+
+
+def expected_fill(symbol, side, quantity, price, conf=settings):
+    '''
+    Print the average price a market order would fill at from the local order book
+    '''
+    local = local_book(symbol, conf)
+    if local is None or not int(conf.trade_market) or not quantity:
+        return
+    fill = local.fill_price(side, quantity)
+    if fill is None:
+        print(f"The {symbol} order book is too thin to fill {quantity}")
+        return
+    slippage = abs(fill / price - 1) * 10000
+    print(f"Expected fill: {round(fill, 8)} ({slippage:.1f} bps from {price})")
 
 
 def get_currency_balance(client: Client, currency_symbol: str):
     '''
     Get balance of a specific coin
     '''
-    for currency_balance in client.get_account()[u'balances']:
-        if currency_balance[u'asset'] == currency_symbol:
-            return float(currency_balance[u'free'])
-    return None
+    return get_account_service(client).balance(currency_symbol)
 
 
-def get_enhanced_error_message(error_code):
+def wait_for_order(client: Client, order, conf=settings):
     '''
-    Get an enhanced error message based on the API error code
+    Wait for an order to be final, journaled as open meanwhile so a restart can settle it
     '''
-    enhanced_error_messages = dict([(
-        -2013, 'Order has not been filled yet.'
-    )])
-    try:
-        return enhanced_error_messages[error_code]
-    except:
-        return ''
+    store = get_state_store()
+    if store:
+        store.order_opened(order)
+    with span('fill_wait'):
+        stat = get_order_manager(client).wait(order, conf.order_stale_timeout)
+    if store:
+        store.order_closed(stat)
+    return stat
 
 
-@retry(20)
-def buy_alt(client: Client, alt, crypto, price, order_quantity):
+def place_order(client: Client, side, symbol, order_quantity, price, conf=settings):
     '''
-    Buy
+    Send a buy or sell order, the only step retried: once it is placed it is waited for, never sent again
+
+    The order carries a client order id made once per call. An order the
+    exchange rejected is simply sent again, but after a timeout or a dropped
+    connection it may have been accepted all the same, so it is looked up by
+    that id first and only sent again when the exchange does not know it.
     '''
+    from binance.exceptions import BinanceAPIException
 
-    # Try to buy until successful
-    order = None
-    while order is None:
+    buy = side == 'BUY'
+    # At most 36 characters are allowed
+    clientOrderId = f"bot{uuid.uuid4().hex}"
+    unknown = False
+
+    @retry(20)
+    def send_order():
+        nonlocal unknown
         try:
-            if int(settings.trade_market) == 1:
-                order = client.order_market_buy(
-                    symbol=crypto + alt,
-                    quantity=order_quantity
-                )
-            else:
-                order = client.order_limit_buy(
-                    symbol=crypto + alt,
-                    quantity=order_quantity,
-                    price=price
-                )
+            with span('order'):
+                if unknown:
+                    try:
+                        return client.get_order(symbol=symbol, origClientOrderId=clientOrderId)
+                    except BinanceAPIException as e:
+                        if e.code != -2013:
+                            raise
+                    # Order does not exist: the previous attempt never reached the book
+                    unknown = False
+                if int(conf.trade_market) == 1:
+                    send = client.order_market_buy if buy else client.order_market_sell
+                    return send(symbol=symbol, quantity=order_quantity, newClientOrderId=clientOrderId)
+                send = client.order_limit_buy if buy else client.order_limit_sell
+                return send(symbol=symbol, quantity=order_quantity, price=price,
+                            newClientOrderId=clientOrderId)
         except BinanceAPIException as e:
-            print(e)
-            time.sleep(1)
+            inc('bot_exceptions_total', where='order', type=type(e).__name__)
+            raise
         except Exception as e:
-            print("Unexpected Error: {0}".format(e))
+            inc('bot_exceptions_total', where='order', type=type(e).__name__)
+            unknown = True
+            raise
+
+    return send_order()
+
+
+def buy_alt(client: Client, alt, crypto, price, order_quantity, conf=settings):
+    '''
+    Buy
+    '''
+
+    bal = get_currency_balance(client, crypto) or 0.0
+    # Try to buy until successful
+    order = place_order(client, 'BUY', crypto + alt, order_quantity, price, conf)
+    if order is None:
+        return None
 
     print("Waiting for Binance")
-    order_recorded = False
-    while not order_recorded:
-        try:
-            time.sleep(3)
-            stat = client.get_order(
-                symbol=crypto + alt, orderId=order[u'orderId'])
-            order_recorded = True
-        except BinanceAPIException as e:
-            print(e)
-            time.sleep(10)
-        except Exception as e:
-            print("Unexpected Error: {0}".format(e))
-    while stat[u'status'] != 'FILLED':
-        try:
-            stat = client.get_order(
-                symbol=crypto + alt, orderId=order[u'orderId'])
-            time.sleep(1)
-        except BinanceAPIException as e:
-            print(e)
-            enhanced_error_message = get_enhanced_error_message(e.code)
-            if enhanced_error_message:
-                print(enhanced_error_message)
-            time.sleep(2)
-        except Exception as e:
-            print("Unexpected Error: {0}".format(e))
+    stat = wait_for_order(client, order, conf)
 
-    msg = 'Bought {0} of {1}'.format(order_quantity, crypto)
+    if float(stat[u'executedQty']) > 0:
+        # A sell right after must see what was bought
+        get_account_service(client).wait_for_balance(crypto, lambda newbal: newbal > bal)
+
+    if stat[u'status'] == 'FILLED':
+        msg = 'Bought {0} of {1}'.format(order_quantity, crypto)
+    else:
+        msg = 'Buy order {0}: bought {1} of {2} of {3}'.format(
+            stat[u'status'], stat[u'executedQty'], order_quantity, crypto)
     telegram_bot_send_text(msg)
     print(msg)
 
-    return order
+    return stat
 
 
-@retry(20)
-def sell_alt(client: Client, alt, crypto, price, order_quantity):
+def sell_alt(client: Client, alt, crypto, price, order_quantity, conf=settings):
     '''
     Sell
     '''
 
     bal = get_currency_balance(client, crypto)
     print('Balance is {0}'.format(bal))
-    order = None
-    while order is None:
-        if int(settings.trade_market) == 1:
-            order = client.order_market_sell(
-                symbol=crypto + alt,
-                quantity=(order_quantity)
-            )
-        else:
-            order = client.order_limit_sell(
-                symbol=crypto + alt,
-                quantity=(order_quantity),
-                price=price
-            )
+    order = place_order(client, 'SELL', crypto + alt, order_quantity, price, conf)
+    if order is None:
+        return None
 
-    # Binance server can take some time to save the order
     print("Waiting for Binance")
-    time.sleep(3)
-    order_recorded = False
-    stat = None
-    while not order_recorded:
-        try:
-            time.sleep(3)
-            stat = client.get_order(
-                symbol=crypto + alt, orderId=order[u'orderId'])
-            order_recorded = True
-        except BinanceAPIException as e:
-            print(e)
-            time.sleep(10)
-        except Exception as e:
-            print("Unexpected Error: {0}".format(e))
-
-    while stat[u'status'] != 'FILLED':
-        try:
-            stat = client.get_order(
-                symbol=crypto + alt, orderId=order[u'orderId'])
-            time.sleep(1)
-        except BinanceAPIException as e:
-            print(e)
-            enhanced_error_message = get_enhanced_error_message(e.code)
-            if enhanced_error_message:
-                print(enhanced_error_message)
-            time.sleep(2)
-        except Exception as e:
-            print("Unexpected Error: {0}".format(e))
+    stat = wait_for_order(client, order, conf)
 
-    newbal = get_currency_balance(client, crypto)
-    while (newbal >= bal):
-        newbal = get_currency_balance(client, crypto)
+    if float(stat[u'executedQty']) > 0:
+        get_account_service(client).wait_for_balance(crypto, lambda newbal: newbal < bal)
 
-    msg = 'Sold {0} of {1}'.format(order_quantity, crypto)
+    if stat[u'status'] == 'FILLED':
+        msg = 'Sold {0} of {1}'.format(order_quantity, crypto)
+    else:
+        msg = 'Sell order {0}: sold {1} of {2} of {3}'.format(
+            stat[u'status'], stat[u'executedQty'], order_quantity, crypto)
     telegram_bot_send_text(msg)
     print(msg)
 
-    return order
+    return stat
+
+
+class TradeState:
+    '''
+    Decision state carried from one tick to the next
+    '''
+
+    def __init__(self):
+        self.lastStatus = 0
+        self.lastCloseTrade = None
+        self.lastCloseTradeUp = None
+        self.lastCloseTradeDown = None
+        self.lastCloseUpSUM = 0
+        self.lastCloseDownSUM = 0
+        self.validateBuy = False
+        self.validateSell = False
+
+    def to_dict(self):
+        return {name: value.isoformat() if isinstance(value, datetime.datetime) else value
+                for name, value in vars(self).items()}
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls()
+        for name, value in data.items():
+            if name.startswith('lastCloseTrade') and isinstance(value, str):
+                value = datetime.datetime.fromisoformat(value)
+            if hasattr(state, name):
+                setattr(state, name, value)
+        return state
+
+
+def state_key(conf=settings):
+    return f"{conf.trade_crypto}{conf.trade_coin}:{conf.trade_time_frame}"
+
+
+def save_state(state: TradeState, conf=settings):
+    store = get_state_store()
+    if store:
+        store.save_state(state_key(conf), state.to_dict())
+
+
+def restore_state(client: Client, conf=settings):
+    '''
+    Reload the decision state saved before a restart, checked against the exchange
+
+    Orders left open are cancelled and settled, a buy or sell that executed
+    nothing is forgotten, and a position the balances contradict is reset.
+    '''
+    store = get_state_store()
+    if store is None:
+        return TradeState()
+    saved = store.state(state_key(conf))
+    state = TradeState.from_dict(saved) if saved else TradeState()
+    symbol = f"{conf.trade_crypto}{conf.trade_coin}"
+
+    manager = get_order_manager(client)
+    for order in store.open_orders(symbol):
+        tracked = manager.track(order)
+        manager.poll(tracked)
+        if not tracked.future.done():
+            print(f"Cancelling order {tracked.orderId} left open before the restart")
+            manager.cancel(tracked)
+        final = manager.wait(tracked, timeout=SETTLE_TIMEOUT)
+        store.order_closed(final or order)
+        if final is None:
+            # Most likely never placed, or placed on another account
+            print(f"Order {tracked.orderId} could not be settled, forgetting it")
+            continue
+        side = 1 if final['side'] == 'BUY' else 2
+        if float(final['executedQty']) == 0 and state.lastStatus == side:
+            state.lastStatus = 0
+
+    if state.lastStatus and int(conf.notification_only) == 0:
+        filters = get_exchange_info(client).get(symbol)
+        holding = filters.floor_quantity(get_currency_balance(client, conf.trade_crypto)) > 0
+        # Bought means holding the crypto, sold means not
+        if (state.lastStatus == 1) != holding:
+            print(f"Balances contradict the saved position of {symbol}, starting flat")
+            state.lastStatus = 0
+    save_state(state, conf)
+    return state
+
+
+def compute_readings(candles, candlesUpper=None):
+    '''
+    Compute the indicator values of the newest candle
+    '''
+    import pandas as pd
+    import talib
+
+    candles = as_arrays(candles)
+    close = candles.close
+
+    # Compute RSI, then StochRSI using RSI values in Stochastic function
+    rsi = talib.RSI(close, settings.trade_rsi_ifr)
+    rsiSeries = pd.Series(rsi)
+    K, D = Stoch(rsiSeries, rsiSeries, rsiSeries, settings.trade_rsi_k,
+                 settings.trade_rsi_d, settings.trade_rsi_stochastic)
+
+    readings = {
+        'timeend': datetime.datetime.fromtimestamp(candles.close_time[-1] / 1000),
+        'close': round(float(close[-1]), 8),  # gets last close
+        'rsi': round(float(rsi[-1]), 8),  # gets last rsi
+        'K': round(float(K.iloc[-1]), 8),
+        'D': round(float(D.iloc[-1]), 8),
+    }
+
+    if settings.trade_upper_stoch_validator:
+        rsiUpper = pd.Series(talib.RSI(as_arrays(candlesUpper).close, settings.trade_rsi_ifr))
+        KUpper, DUpper = Stoch(rsiUpper, rsiUpper, rsiUpper, settings.trade_rsi_k,
+                               settings.trade_rsi_d, settings.trade_rsi_stochastic)
+        readings['K_upper'] = round(float(KUpper.iloc[-1]), 8)
+        readings['D_upper'] = round(float(DUpper.iloc[-1]), 8)
+
+    # Only the moving averages the enabled rules read
+    for name, kind, period in get_pipeline(settings).averages:
+        average = talib.WMA if kind is WMA else talib.EMA
+        readings[name] = round(float(average(close, timeperiod=period)[-1]), 8)
+
+    return readings
+
+
+def read_indicators(symbol, candles, candlesUpper=None, conf=settings, closed=False):
+    '''
+    Incremental readings of the newest candle, matching compute_readings
+
+    With closed, of the newest closed candle instead, as backtest.py reads
+    them: candles opened since, base or upper, are left out.
+    '''
+    stop = stopUpper = None
+    if closed:
+        now = clock.time() * 1000
+        stop = len(candles)
+        while stop > 1 and candles[stop - 1][6] >= now:
+            stop -= 1
+        if candlesUpper is not None:
+            last = candles[stop - 1][0]
+            stopUpper = len(candlesUpper)
+            while stopUpper > 1 and candlesUpper[stopUpper - 1][0] > last:
+                stopUpper -= 1
+    with span('indicators'):
+        readings = dict(get_engine(symbol, conf.trade_time_frame, conf=conf).sync(candles, stop))
+    if conf.trade_upper_stoch_validator:
+        with span('indicators_upper'):
+            readings.update(get_engine(
+                symbol, conf.trade_upper_stoch_validator_value, upper=True, conf=conf).sync(candlesUpper, stopUpper))
+    return readings
+
+
+def notify_extremes(readings, symbol=''):
+    '''
+    Alert when StochRSI or RSI reach overbought/oversold levels
+    '''
+    newest_candle_rsi = readings['rsi']
+    newest_candle_K = readings['K']
+    newest_candle_D = readings['D']
+
+    if (newest_candle_K <= 20 and newest_candle_D <= 20) or (newest_candle_K >= 80 and newest_candle_D >= 80):
+        if int(newest_candle_K) == int(newest_candle_D):
+            telegram_bot_send_text(f"StochrsiK={newest_candle_K} StochrsiD={newest_candle_D}", f"{symbol} stochrsi")
+
+    if newest_candle_rsi <= 30 or newest_candle_rsi >= 70:
+        telegram_bot_send_text(f"RSI={newest_candle_rsi}", f"{symbol} rsi")
+
+
+def evaluate(state: TradeState, readings, conf=settings):
+    '''
+    Update the trade validators from the newest readings and get the status line
+    '''
+    return get_pipeline(conf).evaluate(state, readings)
+
+
+def trade(client: Client, state: TradeState, readings, book=None, conf=settings):
+    '''
+    Place an order when a validator fired, pricing it from book if given
+    '''
+    alt = conf.trade_coin
+    crypto = conf.trade_crypto
+    symbol = f"{crypto}{alt}"
+    newest_candle_rsi = readings['rsi']
+    newest_candle_K = readings['K']
+    newest_candle_D = readings['D']
+
+    result = None
+    if state.validateBuy:
+        telegram_bot_send_text(f"Signal Buy: RSI={newest_candle_rsi} StochrsiK={newest_candle_K} StochrsiD={newest_candle_D}", f"{symbol} signal buy")
+        if state.lastStatus != 1:
+            state.lastStatus = 1
+            # The book is on its way while the balance is read
+            pendingBook = request_book(client, symbol, conf) if book is None else None
+            filters = get_exchange_info(client).get(symbol)
+            if conf.trade_limit_coin_balance:
+                balance = float(conf.trade_limit_coin_balance)
+            else:
+                balance = get_currency_balance(client, alt)
+            if pendingBook:
+                with span('orderbook'):
+                    book = pendingBook.result()
+            asks_lowest = round(float(book['askPrice']), 8)
+            msg = f"{bcolors.OKGREEN}BUY - Price Book: {asks_lowest}{bcolors.ENDC}"
+            print(msg)
+            local = local_book(symbol, conf)
+            if local and int(conf.trade_market) == 1:
+                # A market buy walks up the asks, size it on the depth it will take
+                order_quantity = filters.floor_quantity(local.quantity_for(balance) or 0)
+            else:
+                order_quantity = filters.floor_quantity(balance / float(asks_lowest))
+            expected_fill(symbol, 'BUY', order_quantity, asks_lowest, conf)
+            if order_quantity > 0 or int(conf.notification_only) == 1:
+                if int(conf.notification_only) == 1:
+                    msg = f"Notification: Buy {order_quantity} of {crypto} at {asks_lowest} {alt}"
+                    telegram_bot_send_text(msg)
+                    print(msg)
+                else:
+                    msg = f"Purchasing {order_quantity} of {crypto} at {asks_lowest} {alt}"
+                    telegram_bot_send_text(msg)
+                    print(msg)
+                    result = buy_alt(
+                        client, alt, crypto, asks_lowest, order_quantity, conf)
+                    if result is None or float(result[u'executedQty']) == 0:
+                        # Nothing bought, let the next signal try again
+                        state.lastStatus = 0
+    elif state.validateSell:
+        telegram_bot_send_text(f"Signal Sell: RSI={newest_candle_rsi} StochrsiK={newest_candle_K} StochrsiD={newest_candle_D}", f"{symbol} signal sell")
+        if state.lastStatus != 2:
+            state.lastStatus = 2
+            pendingBook = request_book(client, symbol, conf) if book is None else None
+            filters = get_exchange_info(client).get(symbol)
+            order_quantity = filters.floor_quantity(get_currency_balance(client, crypto))
+            if pendingBook:
+                with span('orderbook'):
+                    book = pendingBook.result()
+            bids_highest = round(float(book['bidPrice']), 8)
+            msg = f"{bcolors.ALERT}SELL - Price Book: {bids_highest}{bcolors.ENDC}"
+            print(msg)
+            expected_fill(symbol, 'SELL', order_quantity, bids_highest, conf)
+            if order_quantity > 0 or int(conf.notification_only) == 1:
+                if int(conf.notification_only) == 1:
+                    msg = f"Notification: Sell {order_quantity} of {crypto} at {bids_highest} {alt}"
+                    telegram_bot_send_text(msg)
+                    print(msg)
+                else:
+                    msg = f"Selling {order_quantity} of {crypto} at {bids_highest} {alt}"
+                    telegram_bot_send_text(msg)
+                    print(msg)
+                    result = sell_alt(
+                        client, alt, crypto, bids_highest, order_quantity, conf)
+                    if result is None or float(result[u'executedQty']) == 0:
+                        # Nothing sold, let the next signal try again
+                        state.lastStatus = 0
+    return result
+
+
+def tick(client: Client, state: TradeState, conf=settings, prefix='', closed=()):
+    '''
+    Poll the candles once, evaluate the signal and trade on it
+
+    closed holds the intervals whose candle just closed, the signal is then
+    evaluated on the closed candle rather than on the one just opened.
+    '''
+    symbol = f"{conf.trade_crypto}{conf.trade_coin}"
+
+    with span('tick'):
+        if conf.async_fetch:
+            from market_data import fetch_candles
+            with span('klines'):
+                candles, candlesUpper = fetch_candles(client, symbol, conf)
+        else:
+            with span('klines'):
+                candles = get_candle_store(
+                    client, symbol, conf.trade_time_frame).update()
+            candlesUpper = None
+            if conf.trade_upper_stoch_validator:
+                with span('klines_upper'):
+                    candlesUpper = get_upper_candles(
+                        client, symbol, conf.trade_time_frame,
+                        conf.trade_upper_stoch_validator_value).update(candles)
+
+        readings = read_indicators(symbol, candles, candlesUpper, conf,
+                                   closed=conf.trade_time_frame in closed)
+        notify_extremes(readings, symbol)
+        statusMsg = evaluate(state, readings, conf)
+        print(prefix + statusMsg)
+        trade(client, state, readings, conf=conf)
+        save_state(state, conf)
 
 
 def main():
@@ -228,328 +557,48 @@ def main():
     api_secret_key = settings.api_secret
     tld = settings.tld
 
-    client = Client(api_key, api_secret_key, tld=tld)
-
-    lastStatus = 0
-    lastCloseTrade = None
-    lastCloseTradeUp = None
-    lastCloseTradeDown = None
-    lastCloseUpSUM = 0
-    lastCloseDownSUM = 0
-    validateBuy = False
-    validateSell = False
-
+    from binance.client import Client
+    # No ping: the first request opens the connection just as well
+    client = Client(api_key, api_secret_key, tld=tld, ping=False,
+                    requests_params={'timeout': settings.request_timeout})
+    if settings.api_url:
+        client.API_URL = settings.api_url
+    instrument(client)
+    limit(client)
+    if settings.metrics_port:
+        serve(settings.metrics_port, settings.profile_interval)
+    # Start loading the symbol filters, orders then need no metadata request
+    get_exchange_info(client)
+    get_account_service(client)
+    get_order_manager(client)
+
+    if settings.trade_pairs:
+        from portfolio import PortfolioRunner
+        PortfolioRunner(client, settings.trade_pairs).run()
+        return
+
+    state = restore_state(client)
+
+    if settings.order_book:
+        from order_book import get_order_book
+        get_order_book(client, f"{settings.trade_crypto}{settings.trade_coin}")
+
+    if settings.trade_streaming:
+        from stream import StreamRunner
+        asyncio.run(StreamRunner(client, state).run())
+        return
+
+    from scheduler import CandleScheduler, conf_intervals
+    scheduler = CandleScheduler(client, conf_intervals(settings), settings.trade_evaluate_interval)
+    # Without evaluations in between, even the first one is of a closed candle
+    closed = set() if settings.trade_evaluate_interval else set(conf_intervals(settings))
     while True:
         try:
-            alt = settings.trade_coin
-            crypto = settings.trade_crypto
-
-            symbol = f"{crypto}{alt}"
-
-            # Get Binance Data into dataframe
-            KLINE_INTERVAL = settings.trade_time_frame
-            candles = client.get_klines(
-                symbol=symbol, interval=KLINE_INTERVAL)
-            df = pd.DataFrame(candles)
-            df.columns = ['timestart', 'open', 'high', 'low',
-                          'close', '?', 'timeend', '?', '?', '?', '?', '?']
-            df.timestart = [datetime.datetime.fromtimestamp(
-                i/1000) for i in df.timestart.values]
-            df.timeend = [datetime.datetime.fromtimestamp(
-                i/1000) for i in df.timeend.values]
-
-            # Compute RSI after fixing data
-            float_data = [float(x) for x in df.close.values]
-            np_float_data = np.array(float_data)
-            rsi = talib.RSI(np_float_data, settings.trade_rsi_ifr)
-            df['rsi'] = rsi
-
-            # Compute StochRSI using RSI values in Stochastic function
-            mystochrsi = Stoch(df.rsi, df.rsi, df.rsi, settings.trade_rsi_k,
-                               settings.trade_rsi_d, settings.trade_rsi_stochastic)
-            df['MyStochrsiK'], df['MyStochrsiD'] = mystochrsi
-
-            newest_candle_start = df.timestart.astype(
-                str).iloc[-1]  # gets last time
-            newest_candle_end = df.timeend.astype(
-                str).iloc[-1]  # gets current time?
-            newestcandleclose = round(
-                float(df.close.iloc[-1]), 8)  # gets last close
-            newest_candle_rsi = round(
-                float(df.rsi.astype(str).iloc[-1]), 8)  # gets last rsi
-            newest_candle_K = round(float(df.MyStochrsiK.astype(
-                str).iloc[-1]), 8)  # gets last rsi
-            newest_candle_D = round(float(df.MyStochrsiD.astype(
-                str).iloc[-1]), 8)  # gets last rsi
-
-            if (newest_candle_K <= 20 and newest_candle_D <= 20) or (newest_candle_K >= 80 and newest_candle_D >= 80):
-                if int(newest_candle_K) == int(newest_candle_D):
-                    telegram_bot_send_text(f"StochrsiK={newest_candle_K} StochrsiD={newest_candle_D}")
-
-            if newest_candle_rsi <= 30 or newest_candle_rsi >= 70:
-                telegram_bot_send_text(f"RSI={newest_candle_rsi}")
-
-            if settings.trade_upper_stoch_validator:
-                # Get Binance Data into dataframe
-                KLINE_INTERVAL_UPPER = settings.trade_upper_stoch_validator_value
-                candlesUpper = client.get_klines(
-                    symbol=symbol, interval=KLINE_INTERVAL_UPPER)
-                dfUpper = pd.DataFrame(candlesUpper)
-                dfUpper.columns = ['timestart', 'open', 'high', 'low',
-                            'close', '?', 'timeend', '?', '?', '?', '?', '?']
-                dfUpper.timestart = [datetime.datetime.fromtimestamp(
-                    i/1000) for i in dfUpper.timestart.values]
-                dfUpper.timeend = [datetime.datetime.fromtimestamp(
-                    i/1000) for i in dfUpper.timeend.values]
-
-                # Compute RSI after fixing data
-                float_data_upper = [float(x) for x in dfUpper.close.values]
-                np_float_data_upper = np.array(float_data_upper)
-                rsiUpper = talib.RSI(np_float_data_upper, settings.trade_rsi_ifr)
-                dfUpper['rsi'] = rsiUpper
-
-                # Compute StochRSI using RSI values in Stochastic function
-                mystochrsiUpper = Stoch(dfUpper.rsi, dfUpper.rsi, dfUpper.rsi, settings.trade_rsi_k,
-                                settings.trade_rsi_d, settings.trade_rsi_stochastic)
-                dfUpper['MyStochrsiK'], dfUpper['MyStochrsiD'] = mystochrsiUpper
-
-                newest_candle_K_upper = round(float(dfUpper.MyStochrsiK.astype(
-                    str).iloc[-1]), 8)  # gets last rsi
-                newest_candle_D_upper = round(float(dfUpper.MyStochrsiD.astype(
-                    str).iloc[-1]), 8)  # gets last rsi
-
-            if settings.trade_wma_cross:
-                # Compute WMAs
-                wmaLow = round(
-                    float((talib.WMA(df['close'], timeperiod=settings.trade_wma_low)).iloc[-1]), 8)
-                wmaMiddle = round(
-                    float((talib.WMA(df['close'], timeperiod=settings.trade_wma_middle)).iloc[-1]), 8)
-                wmaHigh = round(
-                    float((talib.WMA(df['close'], timeperiod=settings.trade_wma_high)).iloc[-1]), 8)
-                # Trade Validator
-                if float(wmaLow) > float(wmaMiddle):
-                    lastClose = df.timeend.iloc[-1]
-                    if lastClose != lastCloseTradeUp:
-                        lastCloseTradeUp = lastClose
-                        lastCloseUpSUM += 1
-                    if lastCloseUpSUM == settings.trade_wma_cross_candle_qtd:
-                        if settings.trade_upper_stoch_validator:
-                            validateBuy = (float(newest_candle_K) > float(newest_candle_D)) and (float(newest_candle_K_upper) > float(newest_candle_D_upper))
-                        else:
-                            validateBuy = float(newest_candle_K) > float(newest_candle_D)
-                        validateSell = False
-                        lastCloseUpSUM = 0
-                        lastCloseTradeUp = None
-                else:
-                    validateBuy = False
-                    lastCloseUpSUM = 0
-                    lastCloseTradeUp = None
-                if float(wmaLow) < float(wmaHigh):
-                    lastClose = df.timeend.iloc[-1]
-                    if lastClose != lastCloseTradeDown:
-                        lastCloseTrade = lastClose
-                        lastCloseDownSUM += 1
-                    if lastCloseDownSUM == settings.trade_wma_cross_candle_qtd:
-                        if settings.trade_upper_stoch_validator:
-                            validateSell = (float(newest_candle_K) < float(newest_candle_D)) 
-                        else:
-                            validateSell = float(newest_candle_K) < float(newest_candle_D)
-                        validateBuy = False
-                        lastCloseDownSUM = 0
-                        lastCloseTradeDown = None
-                else:
-                    lastCloseDownSUM = 0
-                    validateSell = False
-                    lastCloseTradeDown = None
-                statusMsg = f"Price: {newestcandleclose} - RSI: {newest_candle_rsi} - K%: {newest_candle_K} - D%: {newest_candle_D} - WMA {settings.trade_wma_low}: {wmaLow} - WMA {settings.trade_wma_middle}: {wmaMiddle} - WMA {settings.trade_wma_high}: {wmaHigh}"
-
-            if settings.trade_ema_cross:
-                # Compute EMAs
-                emaLow = round(
-                    float((talib.EMA(df['close'], timeperiod=settings.trade_ema_low)).iloc[-1]), 8)
-                emaHigh = round(
-                    float((talib.EMA(df['close'], timeperiod=settings.trade_ema_high)).iloc[-1]), 8)
-                # Trade Validator
-                if settings.trade_upper_stoch_validator:
-                    validateBuy = (float(newest_candle_K) > float(newest_candle_D)) and (
-                        emaLow > emaHigh) and (float(newest_candle_K_upper) > float(newest_candle_D_upper)) 
-                    validateSell = (float(newest_candle_K) < float(newest_candle_D)) and (
-                        emaLow < emaHigh) 
-                else:
-                    validateBuy = (float(newest_candle_K) > float(newest_candle_D)) and (
-                        emaLow > emaHigh)
-                    validateSell = (newest_candle_K < newest_candle_D) and (
-                        emaLow < emaHigh)
-                statusMsg = f"Price: {newestcandleclose} - RSI: {newest_candle_rsi} - K%: {newest_candle_K} - D%: {newest_candle_D} - EMA {settings.trade_ema_low}: {emaLow} - EMA {settings.trade_ema_high}: {emaHigh}"
-
-            if settings.trade_ema_base_candle:
-                # Compute EMA
-                emaBaseClosed = round(
-                    float((talib.EMA(df['close'], timeperiod=settings.trade_ema_base_candle_value)).iloc[-1]), 8)
-                # Trade Validator
-                lastClose = df.timeend.iloc[-1]
-                if lastClose != lastCloseTrade:
-                    lastCloseTrade = lastClose
-                    if newestcandleclose > emaBaseClosed:
-                        lastCloseUpSUM = lastCloseUpSUM + 1
-                    else:
-                        lastCloseUpSUM = 0
-                    if newestcandleclose < emaBaseClosed:
-                        lastCloseDownSUM = lastCloseDownSUM + 1
-                    else:
-                        lastCloseDownSUM = 0
-                if lastCloseUpSUM == settings.trade_ema_base_candle_qtd:
-                    if settings.trade_upper_stoch_validator:
-                        validateBuy = (float(newest_candle_K) > float(newest_candle_D)) and (float(newest_candle_K_upper) > float(newest_candle_D_upper))
-                    else:
-                        validateBuy = (float(newest_candle_K) > float(newest_candle_D))
-                    validateSell = False
-                    lastCloseUpSUM = 0
-                    lastCloseTrade = None
-                if lastCloseDownSUM == settings.trade_ema_base_candle_qtd:
-                    if settings.trade_upper_stoch_validator:
-                        validateSell = float(newest_candle_K) < float(newest_candle_D)
-                    else:
-                        validateSell = float(newest_candle_K) < float(newest_candle_D)
-                    validateBuy = False
-                    lastCloseDownSUM = 0
-                    lastCloseTrade = None
-                statusMsg = f"Price: {newestcandleclose} - RSI: {newest_candle_rsi} - K%: {newest_candle_K} - D%: {newest_candle_D} - EMA {settings.trade_ema_low}: {emaLow} - EMA {settings.trade_ema_high}: {emaHigh} - EMA {settings.trade_ema_base_candle_value}: {emaBaseClosed}"
-
-            if not settings.trade_ema_base_candle and not settings.trade_ema_cross and not settings.trade_wma_cross:
-                if settings.trade_upper_stoch_validator:
-                    if (float(newest_candle_K) > float(newest_candle_D)) and (float(newest_candle_K_upper) > float(newest_candle_D_upper)):
-                        lastClose = df.timeend.iloc[-1]
-                        if lastClose != lastCloseTradeUp:
-                            lastCloseTradeUp = lastClose
-                            lastCloseUpSUM += 1
-                        if lastCloseUpSUM == settings.trade_stochrsi_base_candle_qtd:
-                            validateBuy = True
-                            validateSell = False
-                            lastCloseUpSUM = 0
-                            lastCloseTradeUp = None
-                    else:
-                        validateBuy = False
-                        lastCloseUpSUM = 0
-                        lastCloseTradeUp = None
-                    if (float(newest_candle_K) < float(newest_candle_D)):
-                        lastClose = df.timeend.iloc[-1]
-                        if lastClose != lastCloseTradeDown:
-                            lastCloseTradeDown = lastClose
-                            lastCloseDownSUM += 1
-                        if lastCloseDownSUM == settings.trade_stochrsi_base_candle_qtd:
-                            validateSell = True
-                            validateBuy = False
-                            lastCloseDownSUM = 0
-                            lastCloseTradeDown = None
-                    else:
-                        validateSell = False
-                        lastCloseDownSUM = 0
-                        lastCloseTradeDown = None
-                    statusMsg = f"Price: {newestcandleclose} - RSI: {newest_candle_rsi} - K%: {newest_candle_K} - D%: {newest_candle_D} - Upper K%: {newest_candle_K_upper} - Upper D%: {newest_candle_D_upper}"
-                else:
-                    if (float(newest_candle_K) > float(newest_candle_D)):
-                        lastClose = df.timeend.iloc[-1]
-                        if lastClose != lastCloseTradeUp:
-                            lastCloseTradeUp = lastClose
-                            lastCloseUpSUM += 1
-                        if lastCloseUpSUM == settings.trade_stochrsi_base_candle_qtd:
-                            validateBuy = True
-                            validateSell = False
-                            lastCloseUpSUM = 0
-                            lastCloseTradeUp = None
-                    else:
-                        validateBuy = False
-                        lastCloseUpSUM = 0
-                        lastCloseTradeUp = None
-                    if (float(newest_candle_K) < float(newest_candle_D)):
-                        lastClose = df.timeend.iloc[-1]
-                        if lastClose != lastCloseTradeDown:
-                            lastCloseTradeDown = lastClose
-                            lastCloseDownSUM += 1
-                        if lastCloseDownSUM == settings.trade_stochrsi_base_candle_qtd:
-                            validateSell = True
-                            validateBuy = False
-                            lastCloseDownSUM = 0
-                            lastCloseTradeDown = None
-                    else:
-                        validateSell = False
-                        lastCloseDownSUM = 0
-                        lastCloseTradeDown = None
-                    statusMsg = f"Price: {newestcandleclose} - RSI: {newest_candle_rsi} - K%: {newest_candle_K} - D%: {newest_candle_D}"
-
-            print(statusMsg)
-
-            result = None
-            if validateBuy:
-                telegram_bot_send_text(f"Signal Buy: RSI={newest_candle_rsi} StochrsiK={newest_candle_K} StochrsiD={newest_candle_D}")
-                if lastStatus != 1:
-                    lastStatus = 1
-                    asks_lowest = round(
-                        float(client.get_orderbook_ticker(symbol=symbol)['askPrice']), 8)
-                    msg = f"{bcolors.OKGREEN}BUY - Price Book: {asks_lowest}{bcolors.ENDC}"
-                    print(msg)
-                    ticks = {}
-                    for filt in client.get_symbol_info(crypto + alt)['filters']:
-                        if filt['filterType'] == 'LOT_SIZE':
-                            if filt['stepSize'].find('1') == 0:
-                                ticks[alt] = 1 - filt['stepSize'].find('.')
-                            else:
-                                ticks[alt] = filt['stepSize'].find('1') - 1
-                            break
-                    if settings.trade_limit_coin_balance:
-                        balance = float(settings.trade_limit_coin_balance)
-                    else:
-                        balance = get_currency_balance(client, alt)
-                    order_quantity = ((math.floor(
-                        balance * 10 ** ticks[alt] / float(asks_lowest)) / float(10 ** ticks[alt])))
-                    if order_quantity > 0 or int(settings.notification_only) == 1:
-                        if int(settings.notification_only) == 1:
-                            msg = f"Notification: Buy {order_quantity} of {crypto} at {asks_lowest} {alt}"
-                            telegram_bot_send_text(msg)
-                            print(msg)
-                        else:
-                            msg = f"Purchasing {order_quantity} of {crypto} at {asks_lowest} {alt}"
-                            telegram_bot_send_text(msg)
-                            print(msg)
-                            while result is None:
-                                result = buy_alt(
-                                    client, alt, crypto, asks_lowest, order_quantity)
-            elif validateSell:
-                telegram_bot_send_text(f"Signal Sell: RSI={newest_candle_rsi} StochrsiK={newest_candle_K} StochrsiD={newest_candle_D}")
-                if lastStatus != 2:
-                    lastStatus = 2
-                    bids_highest = round(
-                        float(client.get_orderbook_ticker(symbol=symbol)['bidPrice']), 8)
-                    msg = f"{bcolors.ALERT}SELL - Price Book: {bids_highest}{bcolors.ENDC}"
-                    print(msg)
-                    ticks = {}
-                    for filt in client.get_symbol_info(crypto + alt)['filters']:
-                        if filt['filterType'] == 'LOT_SIZE':
-                            if filt['stepSize'].find('1') == 0:
-                                ticks[alt] = 1 - \
-                                    filt['stepSize'].find('.')
-                            else:
-                                ticks[alt] = filt['stepSize'].find(
-                                    '1') - 1
-                            break
-                    order_quantity = get_currency_balance(client, crypto)
-                    if order_quantity > 0 or int(settings.notification_only) == 1:
-                        if int(settings.notification_only) == 1:
-                            msg = f"Notification: Sell {order_quantity} of {crypto} at {bids_highest} {alt}"
-                            telegram_bot_send_text(msg)
-                            print(msg)
-                        else:
-                            msg = f"Selling {order_quantity} of {crypto} at {bids_highest} {alt}"
-                            telegram_bot_send_text(msg)
-                            print(msg)
-                            while result is None:
-                                result = sell_alt(
-                                    client, alt, crypto, bids_highest, order_quantity)
-
-            time.sleep(5)
+            tick(client, state, closed=closed)
+            closed = scheduler.wait()
 
         except Exception as e:
+            inc('bot_exceptions_total', where='loop', type=type(e).__name__)
             print('Error while trading...\n{}\n'.format(traceback.format_exc()))
 
 
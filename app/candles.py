@@ -0,0 +1,371 @@
+import asyncio
+import datetime
+import threading
+
+import numpy as np
+
+import clock
+import settings
+from recorder import get_recorder
+
+# get_klines returns 500 candles by default, keep the same history window
+KLINE_LIMIT = 500
+# Candles requested per incremental update; a longer gap triggers a reseed
+KLINE_UPDATE_LIMIT = 100
+
+# Length of every fixed-length kline interval
+INTERVAL_MS = {
+    '1m': 60000, '3m': 180000, '5m': 300000, '15m': 900000, '30m': 1800000,
+    '1h': 3600000, '2h': 7200000, '4h': 14400000, '6h': 21600000,
+    '8h': 28800000, '12h': 43200000, '1d': 86400000, '3d': 259200000,
+    '1w': 604800000,
+}
+# Weekly candles open on Monday, the epoch was a Thursday
+BUCKET_OFFSET = {'1w': 4 * INTERVAL_MS['1d']}
+# Monthly candles open on the 1st of every calendar month, so they have no fixed length
+MONTH = '1M'
+# Leading get_klines row fields kept in memory, by row index
+FIELDS = [('open_time', np.int64), ('open', np.float64), ('high', np.float64),
+          ('low', np.float64), ('close', np.float64), ('volume', np.float64),
+          ('close_time', np.int64)]
+
+def next_open(interval, time):
+    '''
+    Open time (ms) of the first candle opening after time (ms)
+    '''
+    if interval != MONTH:
+        step = INTERVAL_MS[interval]
+        offset = BUCKET_OFFSET.get(interval, 0)
+        return (time - offset) // step * step + step + offset
+    day = datetime.datetime.fromtimestamp(time / 1000, datetime.timezone.utc)
+    # Months since year 0 of the month after
+    month = day.year * 12 + day.month
+    return int(datetime.datetime(month // 12, month % 12 + 1, 1,
+                                 tzinfo=datetime.timezone.utc).timestamp() * 1000)
+
+
+_stores = {}
+_storesLock = threading.Lock()
+_upper = {}
+_upperLock = threading.Lock()
+
+
+class KlineArrays:
+    '''
+    The newest maxlen klines as typed columns, allocated once
+
+    Rows are parsed straight into the column arrays, which have room for twice
+    maxlen candles: appending writes after the last one and only once the end
+    is reached are the newest candles copied back to the front. Indexing gives
+    a row tuple in get_klines field order, so code reading kline[0] or
+    kline[4] works on either.
+    '''
+
+    def __init__(self, maxlen):
+        self.maxlen = maxlen
+        self.buffers = {name: np.empty(2 * maxlen, dtype) for name, dtype in FIELDS}
+        self.columns = list(self.buffers.values())
+        self.start = 0
+        self.end = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        i += self.start
+        return tuple(column[i].item() for column in self.columns)
+
+    def __setitem__(self, i, kline):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        for field, column in enumerate(self.columns):
+            column[self.start + i] = kline[field]
+
+    def column(self, name):
+        '''
+        View of one field over the stored candles, oldest first
+        '''
+        return self.buffers[name][self.start:self.end]
+
+    @property
+    def open_time(self):
+        return self.column('open_time')
+
+    @property
+    def close(self):
+        return self.column('close')
+
+    @property
+    def close_time(self):
+        return self.column('close_time')
+
+    def clear(self):
+        self.start = self.end = 0
+
+    def _reserve(self, count):
+        '''
+        Make room for count more candles, dropping the oldest beyond maxlen
+        '''
+        keep = min(len(self), self.maxlen - count)
+        if self.end + count > len(self.columns[0]):
+            for column in self.columns:
+                column[:keep] = column[self.end - keep:self.end]
+            self.start, self.end = 0, keep
+        else:
+            self.start = self.end - keep
+
+    def append(self, kline):
+        self._reserve(1)
+        for field, column in enumerate(self.columns):
+            column[self.end] = kline[field]
+        self.end += 1
+
+    def extend(self, klines):
+        '''
+        Append get_klines rows, parsing every field column by column
+        '''
+        klines = klines[-self.maxlen:]
+        count = len(klines)
+        self._reserve(count)
+        for field, column in enumerate(self.columns):
+            column[self.end:self.end + count] = [kline[field] for kline in klines]
+        self.end += count
+
+    def extend_columns(self, data):
+        '''
+        Append candles given as arrays by field name, e.g. from the kline store
+        '''
+        count = min(len(data['open_time']), self.maxlen)
+        self._reserve(count)
+        for name, column in self.buffers.items():
+            column[self.end:self.end + count] = data[name][-count:] if count else []
+        self.end += count
+
+
+def as_arrays(candles):
+    '''
+    The candles as KlineArrays, parsing get_klines rows if needed
+    '''
+    if isinstance(candles, KlineArrays):
+        return candles
+    arrays = KlineArrays(max(1, len(candles)))
+    arrays.extend(list(candles))
+    return arrays
+
+
+class CandleStore:
+    '''
+    In-memory window of klines for one symbol/interval
+    '''
+
+    def __init__(self, client, symbol, interval, limit=KLINE_LIMIT):
+        self.client = client
+        self.symbol = symbol
+        self.interval = interval
+        self.candles = KlineArrays(limit)
+        # Pairs trading the same symbol update the store from several workers
+        self.lock = threading.Lock()
+
+    def seed(self):
+        '''
+        Download the full history window once, or what the kline store misses of it
+        '''
+        if settings.kline_cache_dir:
+            self._seed_from_store()
+        else:
+            klines = self.client.get_klines(
+                symbol=self.symbol, interval=self.interval, limit=self.candles.maxlen)
+            self.candles.clear()
+            self.candles.extend(klines)
+        self._record(self.candles)
+        return self.candles
+
+    def _seed_from_store(self):
+        from kline_store import get_kline_store
+
+        store = get_kline_store(self.symbol, self.interval)
+        # Months are 28 to 31 days, starting too early only downloads a few more
+        step = INTERVAL_MS.get(self.interval, 31 * INTERVAL_MS['1d'])
+        start = int(clock.time() * 1000) - step * self.candles.maxlen
+        open_klines = store.backfill(self.client, start)
+        last = store.last_open_time()
+        if not open_klines or last is None or next_open(self.interval, last) != int(open_klines[0][0]):
+            # The store does not reach the open candle, the window would have a hole
+            klines = self.client.get_klines(
+                symbol=self.symbol, interval=self.interval, limit=self.candles.maxlen)
+            self.candles.clear()
+            self.candles.extend(klines)
+            return
+        self.candles.clear()
+        self.candles.extend_columns(store.read(-self.candles.maxlen))
+        self.merge(open_klines)
+
+    def update(self):
+        '''
+        Fetch only the open candle and the ones after it
+        '''
+        with self.lock:
+            return self._update()
+
+    def _update(self):
+        if not self.candles:
+            return self.seed()
+        klines = self.client.get_klines(
+            symbol=self.symbol, interval=self.interval,
+            startTime=self.candles[-1][0], limit=KLINE_UPDATE_LIMIT)
+        if len(klines) >= KLINE_UPDATE_LIMIT:
+            # Too far behind to patch the buffer, start over
+            return self.seed()
+        self.merge(klines)
+        return self.candles
+
+    async def fetch(self, market):
+        '''
+        update() over the async market data session (see market_data.py)
+        '''
+        if not self.candles:
+            return await asyncio.to_thread(self.update)
+        klines = await market.klines(
+            symbol=self.symbol, interval=self.interval,
+            startTime=self.candles[-1][0], limit=KLINE_UPDATE_LIMIT)
+        if len(klines) >= KLINE_UPDATE_LIMIT:
+            return await asyncio.to_thread(self.reseed)
+        with self.lock:
+            return self.merge(klines)
+
+    def reseed(self):
+        with self.lock:
+            return self.seed()
+
+    def merge(self, klines):
+        '''
+        Replace the open candle in place and append newer ones
+
+        With KLINE_CACHE_DIR the candles that closed are also appended to the
+        kline store, so a restart finds the history on disk and only
+        downloads what it missed.
+        '''
+        self._record(klines)
+        for kline in klines:
+            if not self.candles or kline[0] > self.candles[-1][0]:
+                self.candles.append(kline)
+            elif kline[0] == self.candles[-1][0]:
+                self.candles[-1] = kline
+        if settings.kline_cache_dir and klines:
+            from kline_store import get_kline_store
+            get_kline_store(self.symbol, self.interval).append(klines)
+        return self.candles
+
+    def _record(self, klines):
+        recorder = get_recorder()
+        if recorder:
+            recorder.klines(self.symbol, self.interval, klines)
+
+
+def get_candle_store(client, symbol, interval):
+    '''
+    Get the shared store of a symbol/interval, creating it on first use
+    '''
+    key = (symbol, interval)
+    with _storesLock:
+        if key not in _stores:
+            _stores[key] = CandleStore(client, symbol, interval)
+        return _stores[key]
+
+
+class UpperCandles:
+    '''
+    Candles of a higher timeframe kept up to date from the base candles
+
+    The history is downloaded once. When the upper interval is a multiple of
+    the base one the open upper candle, and the ones after it, are then built
+    from the base candles already held: close is the newest base close, high
+    and low the extremes seen. Otherwise the upper candles are fetched again,
+    but only once per base candle instead of on every tick.
+    '''
+
+    def __init__(self, client, symbol, interval, upper):
+        self.store = CandleStore(client, symbol, upper)
+        self.interval = interval
+        self.upperStep = INTERVAL_MS.get(upper)
+        self.offset = BUCKET_OFFSET.get(upper, 0)
+        self.resample = (bool(self.upperStep) and interval in INTERVAL_MS
+                         and self.upperStep % INTERVAL_MS[interval] == 0)
+        self.lastBaseOpen = None
+        self.lock = threading.Lock()
+
+    def bucket(self, openTime):
+        return (openTime - self.offset) // self.upperStep * self.upperStep + self.offset
+
+    def due(self, now):
+        '''
+        Whether the next update() fetches the upper candles, for a base candle opened by now (ms)
+
+        Lets the caller request them together with the base candles.
+        '''
+        return (not self.resample and bool(self.store.candles)
+                and (self.lastBaseOpen is None or now >= next_open(self.interval, self.lastBaseOpen)))
+
+    def update(self, base, fetched=False):
+        '''
+        Bring the upper candles up to the newest base candle and return them
+
+        fetched tells the upper candles were just updated by the caller.
+        '''
+        with self.lock:
+            candles = self.store.candles
+            baseOpen = base[-1][0]
+            if not candles:
+                self.store.seed()
+            elif not self.resample:
+                if baseOpen != self.lastBaseOpen and not fetched:
+                    self.store._update()
+            elif baseOpen - candles[-1][0] >= self.upperStep * KLINE_UPDATE_LIMIT:
+                # Too far behind to patch, start over
+                self.store.seed()
+            else:
+                self._resample(base)
+            self.lastBaseOpen = baseOpen
+            return self.store.candles
+
+    def _resample(self, base):
+        candles = self.store.candles
+        openTime = base.open_time
+        first = int(np.searchsorted(openTime, candles[-1][0]))
+        while first < len(openTime):
+            bucket = self.bucket(int(openTime[first]))
+            last = int(np.searchsorted(openTime, bucket + self.upperStep))
+            high = float(base.column('high')[first:last].max())
+            low = float(base.column('low')[first:last].min())
+            close = float(base.close[last - 1])
+            volume = float(base.column('volume')[first:last].sum())
+            if bucket == candles[-1][0]:
+                # Part of this candle may predate the base window, keep what was fetched
+                row = candles[-1]
+                if int(openTime[first]) == bucket:
+                    candles[-1] = (bucket, float(base.column('open')[first]), high, low, close,
+                                   volume, bucket + self.upperStep - 1)
+                else:
+                    candles[-1] = (bucket, row[1], max(row[2], high), min(row[3], low), close,
+                                   row[5], row[6])
+            elif bucket > candles[-1][0]:
+                candles.append((bucket, float(base.column('open')[first]), high, low, close,
+                                volume, bucket + self.upperStep - 1))
+            first = last
+
+
+def get_upper_candles(client, symbol, interval, upper):
+    '''
+    Get the shared upper timeframe candles of a symbol, built on its interval candles
+    '''
+    key = (symbol, interval, upper)
+    with _upperLock:
+        if key not in _upper:
+            _upper[key] = UpperCandles(client, symbol, interval, upper)
+        return _upper[key]
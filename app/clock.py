@@ -0,0 +1,67 @@
+import threading
+import time as _time
+
+
+class RealClock:
+    '''
+    The system clock
+    '''
+
+    def time(self):
+        return _time.time()
+
+    def monotonic(self):
+        return _time.monotonic()
+
+    def sleep(self, seconds):
+        _time.sleep(seconds)
+
+
+class VirtualClock:
+    '''
+    A clock that only moves when slept on, for replays
+
+    Sleeping advances it at once, or after seconds / speed of real time when
+    speed is set, so a replay runs at that many times real time.
+    '''
+
+    def __init__(self, start, speed=0):
+        self.now = start
+        self.speed = speed
+        self.lock = threading.Lock()
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        seconds = max(0.0, seconds)
+        if self.speed:
+            _time.sleep(seconds / self.speed)
+        with self.lock:
+            self.now += seconds
+
+
+_clock = RealClock()
+
+
+def use(clock):
+    '''
+    Make clock the one every time(), monotonic() and sleep() reads
+    '''
+    global _clock
+    _clock = clock
+
+
+def time():
+    return _clock.time()
+
+
+def monotonic():
+    return _clock.monotonic()
+
+
+def sleep(seconds):
+    _clock.sleep(seconds)
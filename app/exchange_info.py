@@ -0,0 +1,128 @@
+import math
+import threading
+import time
+import traceback
+from decimal import Decimal
+
+import settings
+from recorder import get_recorder
+
+
+def step_decimals(step):
+    '''
+    Decimals allowed by a LOT_SIZE stepSize or PRICE_FILTER tickSize string
+    '''
+    if step.find('1') == 0:
+        return 1 - step.find('.')
+    return step.find('1') - 1
+
+
+class SymbolFilters:
+    '''
+    Trading rules of one symbol with precomputed rounding
+    '''
+
+    def __init__(self, info):
+        self.symbol = info['symbol']
+        self.filters = {filt['filterType']: filt for filt in info['filters']}
+        lot = self.filters.get('LOT_SIZE', {})
+        price = self.filters.get('PRICE_FILTER', {})
+        notional = self.filters.get('NOTIONAL') or self.filters.get('MIN_NOTIONAL') or {}
+        self.stepSize = lot.get('stepSize', '0.00000001')
+        self.minQty = float(lot.get('minQty', 0))
+        self.tickSize = price.get('tickSize', '0.00000001')
+        self.minNotional = float(notional.get('minNotional', 0))
+        self.quantityDecimals = step_decimals(self.stepSize)
+        self.priceDecimals = step_decimals(self.tickSize)
+        self._quantityScale = 10 ** self.quantityDecimals
+        self._tick = Decimal(self.tickSize.rstrip('0') or '0')
+
+    def floor_quantity(self, quantity):
+        '''
+        Round a quantity down to the LOT_SIZE step
+        '''
+        return math.floor(quantity * self._quantityScale) / float(self._quantityScale)
+
+    def round_price(self, price):
+        '''
+        Round a price to the PRICE_FILTER tick
+        '''
+        if not self._tick:
+            return price
+        return float((Decimal(str(price)) / self._tick).quantize(Decimal(1)) * self._tick)
+
+
+class ExchangeInfo:
+    '''
+    Symbol filters loaded from exchangeInfo in the background and refreshed every ttl
+
+    The full exchangeInfo is a large download that the first decision does
+    not need, only orders do: get() waits for the first load.
+    '''
+
+    def __init__(self, client, ttl=None):
+        self.client = client
+        self.ttl = ttl or settings.exchange_info_ttl
+        self.symbols = {}
+        self.loaded = 0
+        self.ready = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def load(self):
+        info = self.client.get_exchange_info()
+        symbols = {s['symbol']: SymbolFilters(s) for s in info.get('symbols', [])}
+        with self.lock:
+            self.symbols.update(symbols)
+            self.loaded = time.monotonic()
+        return self
+
+    def get(self, symbol):
+        '''
+        Filters of a symbol, fetched on its own only if exchangeInfo did not list it
+        '''
+        self.ready.wait()
+        filters = self.symbols.get(symbol)
+        if filters is None:
+            filters = SymbolFilters(self.client.get_symbol_info(symbol))
+            with self.lock:
+                self.symbols[symbol] = filters
+        recorder = get_recorder()
+        if recorder:
+            recorder.symbol(filters)
+        return filters
+
+    def _refresh(self):
+        while True:
+            try:
+                self.load()
+            except Exception:
+                print('Error while refreshing exchange info...\n{}\n'.format(
+                    traceback.format_exc()))
+            finally:
+                # A failed first load leaves get() to fetch symbols one by one
+                self.ready.set()
+            time.sleep(self.ttl)
+
+    def start(self):
+        '''
+        Load in the background and keep refreshing every ttl seconds
+        '''
+        self.thread = threading.Thread(target=self._refresh, daemon=True)
+        self.thread.start()
+        return self
+
+
+_exchange_info = None
+_exchange_info_lock = threading.Lock()
+
+
+def get_exchange_info(client):
+    '''
+    Get the process-wide metadata cache, starting to load it on first use
+    '''
+    global _exchange_info
+    with _exchange_info_lock:
+        if _exchange_info is None:
+            _exchange_info = ExchangeInfo(client).start()
+        return _exchange_info
@@ -0,0 +1,331 @@
+import datetime
+import threading
+from collections import deque
+
+import settings
+
+# Every indicator takes update(value, new): new=True starts a new candle and
+# commits the previous value, new=False revises the open candle.  The output
+# for the open candle is derived from the committed state without touching it,
+# so both paths are O(1).  None stands for a missing value (NaN in pandas).
+
+
+class RSI:
+    '''
+    Wilder RSI seeded with a simple average, like talib.RSI
+    '''
+
+    def __init__(self, period):
+        self.period = period
+        self.count = 0
+        self.prev = None
+        self.sumGain = 0.0
+        self.sumLoss = 0.0
+        self.avgGain = None
+        self.avgLoss = None
+        self.pending = None
+
+    def _averages(self, value):
+        if self.count == 0:
+            return None
+        diff = value - self.prev
+        gain = diff if diff > 0 else 0.0
+        loss = -diff if diff < 0 else 0.0
+        if self.avgGain is not None:
+            return ((self.avgGain * (self.period - 1) + gain) / self.period,
+                    (self.avgLoss * (self.period - 1) + loss) / self.period)
+        if self.count == self.period:
+            return ((self.sumGain + gain) / self.period,
+                    (self.sumLoss + loss) / self.period)
+        return gain, loss
+
+    def _commit(self):
+        averages = self._averages(self.pending)
+        if averages is not None:
+            if self.avgGain is not None or self.count == self.period:
+                self.avgGain, self.avgLoss = averages
+            else:
+                self.sumGain += averages[0]
+                self.sumLoss += averages[1]
+        self.prev = self.pending
+        self.count += 1
+
+    def update(self, value, new=True):
+        if new and self.pending is not None:
+            self._commit()
+        self.pending = value
+        if self.count < self.period:
+            return None
+        gain, loss = self._averages(value)
+        total = gain + loss
+        return 100 * gain / total if total else 0.0
+
+
+class RollingMinMax:
+    '''
+    Rolling minimum and maximum over a window using monotonic deques
+    '''
+
+    def __init__(self, window):
+        self.window = window
+        self.count = 0
+        self.lastMissing = None
+        self.mins = deque()
+        self.maxs = deque()
+        self.pending = None
+        self.hasPending = False
+
+    def _commit(self):
+        i, value = self.count, self.pending
+        self.count += 1
+        if value is None:
+            self.lastMissing = i
+            return
+        while self.mins and self.mins[-1][1] >= value:
+            self.mins.pop()
+        self.mins.append((i, value))
+        while self.maxs and self.maxs[-1][1] <= value:
+            self.maxs.pop()
+        self.maxs.append((i, value))
+
+    def update(self, value, new=True):
+        if new and self.hasPending:
+            self._commit()
+        self.pending = value
+        self.hasPending = True
+        if value is None or self.count + 1 < self.window:
+            return None
+        # The window is the open value plus the last window-1 committed ones
+        first = self.count - self.window + 1
+        if self.lastMissing is not None and self.lastMissing >= first:
+            return None
+        while self.mins and self.mins[0][0] < first:
+            self.mins.popleft()
+        while self.maxs and self.maxs[0][0] < first:
+            self.maxs.popleft()
+        low = min(self.mins[0][1], value) if self.mins else value
+        high = max(self.maxs[0][1], value) if self.maxs else value
+        return low, high
+
+
+class SMA:
+    '''
+    Simple moving average with a running sum, like pandas rolling().mean()
+    '''
+
+    def __init__(self, window):
+        self.window = window
+        self.values = deque()
+        self.sum = 0.0
+        self.missing = 0
+        self.pending = None
+        self.hasPending = False
+
+    def _commit(self):
+        if self.window == 1:
+            return
+        self.values.append(self.pending)
+        if self.pending is None:
+            self.missing += 1
+        else:
+            self.sum += self.pending
+        if len(self.values) == self.window:
+            old = self.values.popleft()
+            if old is None:
+                self.missing -= 1
+            else:
+                self.sum -= old
+
+    def update(self, value, new=True):
+        if new and self.hasPending:
+            self._commit()
+        self.pending = value
+        self.hasPending = True
+        if value is None or self.missing or len(self.values) < self.window - 1:
+            return None
+        return (self.sum + value) / self.window
+
+
+class EMA:
+    '''
+    Exponential moving average seeded with a simple average, like talib.EMA
+    '''
+
+    def __init__(self, period):
+        self.period = period
+        self.k = 2.0 / (period + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.ema = None
+        self.pending = None
+
+    def _value(self, value):
+        if self.ema is not None:
+            return self.ema + (value - self.ema) * self.k
+        if self.count + 1 == self.period:
+            return (self.sum + value) / self.period
+        return None
+
+    def _commit(self):
+        ema = self._value(self.pending)
+        if ema is None:
+            self.sum += self.pending
+        else:
+            self.ema = ema
+        self.count += 1
+
+    def update(self, value, new=True):
+        if new and self.pending is not None:
+            self._commit()
+        self.pending = value
+        return self._value(value)
+
+
+class WMA:
+    '''
+    Linearly weighted moving average with running sums, like talib.WMA
+    '''
+
+    def __init__(self, period):
+        self.period = period
+        self.divider = period * (period + 1) / 2
+        self.values = deque()
+        # Sum and weighted sum of the last period-1 committed values, oldest weighted 1
+        self.sum = 0.0
+        self.weighted = 0.0
+        self.pending = None
+
+    def _commit(self):
+        if self.period == 1:
+            return
+        value = self.pending
+        if len(self.values) < self.period - 1:
+            self.values.append(value)
+            self.weighted += len(self.values) * value
+            self.sum += value
+        else:
+            self.weighted += (self.period - 1) * value - self.sum
+            self.sum += value - self.values.popleft()
+            self.values.append(value)
+
+    def update(self, value, new=True):
+        if new and self.pending is not None:
+            self._commit()
+        self.pending = value
+        if len(self.values) < self.period - 1:
+            return None
+        return (self.weighted + self.period * value) / self.divider
+
+
+class StochRSI:
+    '''
+    StochRSI %K/%D chained the same way as Stoch(rsi, rsi, rsi, ...)
+    '''
+
+    def __init__(self, rsi_period, stoch_period, smoothk, smoothd):
+        self.rsi = RSI(rsi_period)
+        self.range = RollingMinMax(stoch_period)
+        self.k = SMA(smoothk)
+        self.d = SMA(smoothd)
+
+    def update(self, close, new=True):
+        rsi = self.rsi.update(close, new)
+        stoch = None
+        if rsi is not None:
+            bounds = self.range.update(rsi, new)
+            if bounds is not None and bounds[1] != bounds[0]:
+                stoch = 100 * (rsi - bounds[0]) / (bounds[1] - bounds[0])
+        else:
+            self.range.update(None, new)
+        K = self.k.update(stoch, new)
+        D = self.d.update(K, new)
+        return rsi, K, D
+
+
+def _round(value):
+    return float('nan') if value is None else round(value, 8)
+
+
+class IndicatorEngine:
+    '''
+    Incremental readings for one symbol/interval, fed from kline rows
+    '''
+
+    def __init__(self, conf=settings, upper=False):
+        self.upper = upper
+        self.lastOpen = None
+        self.lock = threading.Lock()
+        self.stochrsi = StochRSI(*stochrsi_params(conf))
+        self.averages = {name: kind(period)
+                         for name, kind, period in average_params(conf, upper)}
+        self.readings = None
+
+    def update(self, kline):
+        '''
+        Apply one kline row, either a revision of the open candle or a new one
+        '''
+        if self.lastOpen is not None and kline[0] < self.lastOpen:
+            return self.readings
+        new = kline[0] != self.lastOpen
+        self.lastOpen = kline[0]
+        close = float(kline[4])
+        rsi, K, D = self.stochrsi.update(close, new)
+        if self.upper:
+            self.readings = {'K_upper': _round(K), 'D_upper': _round(D)}
+            return self.readings
+        self.readings = {
+            'timeend': datetime.datetime.fromtimestamp(kline[6] / 1000),
+            'close': round(close, 8),
+            'rsi': _round(rsi),
+            'K': _round(K),
+            'D': _round(D),
+        }
+        for name, average in self.averages.items():
+            self.readings[name] = _round(average.update(close, new))
+        return self.readings
+
+    def sync(self, candles, stop=None):
+        '''
+        Feed the candles at or after the open one seen last, up to stop
+        '''
+        with self.lock:
+            return self._sync(candles, len(candles) if stop is None else stop)
+
+    def _sync(self, candles, stop):
+        start = stop
+        while start > 0 and (self.lastOpen is None or candles[start - 1][0] >= self.lastOpen):
+            start -= 1
+        for i in range(start, stop):
+            self.update(candles[i])
+        return self.readings
+
+
+def stochrsi_params(conf):
+    return (conf.trade_rsi_ifr, conf.trade_rsi_stochastic,
+            conf.trade_rsi_k, conf.trade_rsi_d)
+
+
+def average_params(conf, upper=False):
+    '''
+    Moving averages the enabled rules read, as (name, class, period)
+    '''
+    if upper:
+        return []
+    # strategy builds its rules from the indicator classes here
+    from strategy import get_pipeline
+    return get_pipeline(conf).averages
+
+
+_engines = {}
+_enginesLock = threading.Lock()
+
+
+def get_engine(symbol, interval, upper=False, conf=settings):
+    '''
+    Get the engine of a symbol/interval, shared by pairs with the same indicator settings
+    '''
+    key = (symbol, interval, upper, stochrsi_params(conf), tuple(average_params(conf, upper)))
+    with _enginesLock:
+        if key not in _engines:
+            _engines[key] = IndicatorEngine(conf, upper)
+        return _engines[key]
@@ -0,0 +1,172 @@
+#!python3
+import argparse
+import datetime
+import os
+import threading
+import time
+
+import numpy as np
+
+import clock
+import settings
+from candles import next_open
+
+INT = np.dtype('<i8')
+FLOAT = np.dtype('<f8')
+# get_klines row fields kept on disk, the trailing "ignore" field is dropped
+FIELDS = [
+    ('open_time', INT), ('open', FLOAT), ('high', FLOAT), ('low', FLOAT),
+    ('close', FLOAT), ('volume', FLOAT), ('close_time', INT), ('quote_volume', FLOAT),
+    ('trades', INT), ('taker_base_volume', FLOAT), ('taker_quote_volume', FLOAT),
+]
+# Candles per get_klines call when back-filling, the API maximum
+PAGE_LIMIT = 1000
+
+_stores = {}
+_storesLock = threading.Lock()
+
+
+class KlineStore:
+    '''
+    Closed klines of one symbol/interval on disk, one raw little-endian file per field
+
+    Files only ever grow, by appending candles newer than the last one stored,
+    and are read back through memory maps without copying or parsing.
+    '''
+
+    def __init__(self, root, symbol, interval):
+        self.symbol = symbol
+        self.interval = interval
+        self.path = os.path.join(root, symbol, interval)
+        # Re-entrant: backfill() appends, and the live candles of two pairs may too
+        self.lock = threading.RLock()
+        os.makedirs(self.path, exist_ok=True)
+        self.length = self._repair()
+
+    def _file(self, name):
+        return os.path.join(self.path, f"{name}.bin")
+
+    def _repair(self):
+        '''
+        Cut every file to the candles all of them hold, an append may have been interrupted
+        '''
+        length = min(os.path.getsize(self._file(name)) // dtype.itemsize
+                     if os.path.exists(self._file(name)) else 0
+                     for name, dtype in FIELDS)
+        for name, dtype in FIELDS:
+            with open(self._file(name), 'ab') as f:
+                f.truncate(length * dtype.itemsize)
+        return length
+
+    def __len__(self):
+        return self.length
+
+    def last_open_time(self):
+        if not self.length:
+            return None
+        return int(np.memmap(self._file('open_time'), INT, 'r', offset=(self.length - 1) * INT.itemsize)[0])
+
+    def read(self, start=0, stop=None):
+        '''
+        Memory-mapped arrays of the stored candles, by field
+        '''
+        start, stop, _ = slice(start, stop).indices(self.length)
+        if start >= stop:
+            return {name: np.empty(0, dtype) for name, dtype in FIELDS}
+        return {name: np.memmap(self._file(name), dtype, 'r', offset=start * dtype.itemsize,
+                                shape=(stop - start,))
+                for name, dtype in FIELDS}
+
+    def rows(self, count):
+        '''
+        The newest count candles as get_klines rows
+        '''
+        data = self.read(-count if count else self.length)
+        columns = [data[name].tolist() for name, dtype in FIELDS]
+        return [list(row) + ['0'] for row in zip(*columns)]
+
+    def append(self, klines, now=None, since=None):
+        '''
+        Store the closed klines newer than the last one stored, returns how many
+
+        Klines that do not follow on the last one stored are refused, unless
+        since (ms), the open time they were requested from, is no later than
+        the candle due next: the exchange then has nothing in between, as
+        after a maintenance window or a trading halt.
+        '''
+        now = now if now is not None else clock.time() * 1000
+        with self.lock:
+            last = self.last_open_time()
+            klines = [k for k in klines if int(k[6]) < now and (last is None or int(k[0]) > last)]
+            if not klines:
+                return 0
+            due = None if last is None else next_open(self.interval, last)
+            if due is not None and int(klines[0][0]) > due and (since is None or since > due):
+                # Candles are missing in between, the next backfill() downloads them
+                return 0
+            for i, (name, dtype) in enumerate(FIELDS):
+                values = np.array([k[i] for k in klines]).astype(dtype)
+                with open(self._file(name), 'ab') as f:
+                    f.write(values.tobytes())
+            self.length += len(klines)
+            return len(klines)
+
+    def backfill(self, client, start=None):
+        '''
+        Download every candle after the last one stored, or since start (ms)
+
+        Returns the klines received that are still open, so the caller gets
+        the current candle without another request.
+        '''
+        with self.lock:
+            last = self.last_open_time()
+            startTime = next_open(self.interval, last) if last is not None else start
+            open_klines = []
+            while True:
+                params = dict(symbol=self.symbol, interval=self.interval, limit=PAGE_LIMIT)
+                if startTime is not None:
+                    params['startTime'] = startTime
+                klines = client.get_klines(**params)
+                now = clock.time() * 1000
+                self.append(klines, now, startTime)
+                open_klines = [k for k in klines if int(k[6]) >= now]
+                if len(klines) < PAGE_LIMIT or open_klines:
+                    return open_klines
+                startTime = next_open(self.interval, int(klines[-1][0]))
+
+
+def get_kline_store(symbol, interval, root=None):
+    '''
+    Get the shared store of a symbol/interval, under KLINE_CACHE_DIR by default
+    '''
+    key = (root or settings.kline_cache_dir, symbol, interval)
+    with _storesLock:
+        if key not in _stores:
+            _stores[key] = KlineStore(*key)
+        return _stores[key]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Download klines into the local kline store')
+    parser.add_argument('symbol')
+    parser.add_argument('interval')
+    parser.add_argument('--since', help='first day to download, YYYY-MM-DD', default='2020-01-01')
+    parser.add_argument('--root', default=settings.kline_cache_dir or 'klines')
+    args = parser.parse_args()
+
+    from binance.client import Client
+    from ratelimit import limit
+    client = limit(Client(tld=settings.tld, ping=False))
+    if settings.api_url:
+        client.API_URL = settings.api_url
+    since = datetime.datetime.strptime(args.since, '%Y-%m-%d').replace(tzinfo=datetime.timezone.utc)
+    store = get_kline_store(args.symbol, args.interval, args.root)
+    before = len(store)
+    start = time.perf_counter()
+    store.backfill(client, int(since.timestamp() * 1000))
+    print(f"{len(store) - before} new candles, {len(store)} in {store.path} "
+          f"({time.perf_counter() - start:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
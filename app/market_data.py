@@ -0,0 +1,155 @@
+import asyncio
+import json
+import threading
+import time
+
+import aiohttp
+from binance.exceptions import BinanceAPIException
+
+import clock
+import settings
+from candles import get_candle_store, get_upper_candles
+from metrics import WEIGHT_HEADER, registry
+from ratelimit import MAX_ATTEMPTS, PRIORITIES, PRIORITY_METADATA, get_rate_limiter, request_weight
+
+# Connections kept open to the exchange, shared by every pair
+POOL_SIZE = 20
+# Seconds an idle connection is kept for the next request
+KEEPALIVE = 60
+
+
+class MarketData:
+    '''
+    Public market data endpoints over one pooled aiohttp session
+
+    The session runs on an event loop in a background thread and keeps its
+    connections alive between ticks. Callers in other threads submit the
+    requests of a tick together and wait for all of them, so a tick takes as
+    long as its slowest request rather than the sum. Every request has its own
+    timeout and goes through the process-wide rate limiter.
+    '''
+
+    def __init__(self, base_url, timeout=None, pool_size=POOL_SIZE, limiter=None):
+        self.base_url = base_url.rstrip('/') + '/v3/'
+        self.timeout = aiohttp.ClientTimeout(total=timeout or settings.request_timeout)
+        self.pool_size = pool_size
+        self.limiter = limiter or get_rate_limiter()
+        self.loop = None
+        self.session = None
+        self.thread = None
+
+    async def _start(self):
+        connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=KEEPALIVE)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+
+    def start(self):
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self._start())
+            ready.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        self.run(self.session.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def submit(self, coroutine):
+        '''
+        Start a coroutine on the session loop, returning a concurrent.futures.Future
+        '''
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def run(self, coroutine):
+        '''
+        Run a coroutine on the session loop and wait for its result
+        '''
+        return self.submit(coroutine).result()
+
+    async def get(self, endpoint, **params):
+        '''
+        GET a public endpoint, retrying 429/418 like ratelimit.limit()
+        '''
+        weight = request_weight('get', endpoint, params)
+        priority = PRIORITIES.get(endpoint, PRIORITY_METADATA)
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            # Usually returns at once, but may sleep out a ban
+            await asyncio.to_thread(self.limiter.acquire, weight, priority)
+            start = time.perf_counter()
+            async with self.session.get(self.base_url + endpoint, params=params) as response:
+                text = await response.text()
+            registry.inc('binance_requests_total', endpoint=endpoint, method='GET',
+                         status=response.status)
+            registry.observe('binance_request_seconds', time.perf_counter() - start,
+                             endpoint=endpoint)
+            used = response.headers.get(WEIGHT_HEADER)
+            if used is not None:
+                registry.set('binance_used_weight_1m', int(used))
+                self.limiter.update(int(used))
+            if response.status in (418, 429) and attempt < MAX_ATTEMPTS:
+                self.limiter.penalize(response.status, response.headers.get('Retry-After'))
+                registry.inc('bot_retries_total', function=endpoint)
+                continue
+            if not 200 <= response.status < 300:
+                error = BinanceAPIException(response, response.status, text)
+                if not error.code:
+                    # The exception reads response.text, a coroutine function on aiohttp
+                    error.message = f"Invalid JSON error message from Binance: {text}"
+                raise error
+            self.limiter.succeeded()
+            return json.loads(text)
+
+    async def klines(self, **params):
+        return await self.get('klines', **params)
+
+    async def orderbook_ticker(self, symbol):
+        return await self.get('ticker/bookTicker', symbol=symbol)
+
+
+def fetch_candles(client, symbol, conf=settings):
+    '''
+    Update the base and upper timeframe candles of a pair, requesting both at once
+    '''
+    market = get_market_data(client)
+    store = get_candle_store(client, symbol, conf.trade_time_frame)
+    upper = None
+    if conf.trade_upper_stoch_validator:
+        upper = get_upper_candles(client, symbol, conf.trade_time_frame,
+                                  conf.trade_upper_stoch_validator_value)
+    fetchUpper = upper is not None and upper.due(clock.time() * 1000)
+
+    async def fetch():
+        if fetchUpper:
+            candles, _ = await asyncio.gather(store.fetch(market), upper.store.fetch(market))
+            return candles
+        return await store.fetch(market)
+
+    candles = market.run(fetch())
+    candlesUpper = None
+    if upper:
+        # Resampled from the base candles, or merged from the request above
+        candlesUpper = upper.update(candles, fetched=fetchUpper)
+    return candles, candlesUpper
+
+
+_market = None
+_market_lock = threading.Lock()
+
+
+def get_market_data(client):
+    '''
+    Get the process-wide market data session, on the client's REST base URL
+    '''
+    global _market
+    with _market_lock:
+        if _market is None:
+            _market = MarketData(client.API_URL).start()
+        return _market
@@ -0,0 +1,215 @@
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+# Upper bounds in seconds of the latency histograms
+BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+WEIGHT_HEADER = 'X-MBX-USED-WEIGHT-1M'
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format(name, labels, value, extra=()):
+    pairs = list(labels) + list(extra)
+    if pairs:
+        name += '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+    return f"{name} {value:g}"
+
+
+class Registry:
+    '''
+    Counters, gauges and histograms rendered in the Prometheus text format
+    '''
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, _labels(labels))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                # Per-bucket counts, then sum and count
+                histogram = self.histograms[key] = [0] * (len(BUCKETS) + 2)
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+                    break
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def stages(self):
+        '''
+        Count and total seconds of every span, by stage
+        '''
+        with self.lock:
+            return {dict(labels)['stage']: (h[-1], h[-2]) for (name, labels), h in
+                    self.histograms.items() if name == 'bot_stage_seconds'}
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for kind, values in (('counter', self.counters), ('gauge', self.gauges)):
+                for name in sorted({name for name, labels in values}):
+                    lines.append(f"# TYPE {name} {kind}")
+                    lines += [_format(n, labels, value) for (n, labels), value
+                              in sorted(values.items()) if n == name]
+            for name in sorted({name for name, labels in self.histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (n, labels), histogram in sorted(self.histograms.items()):
+                    if n != name:
+                        continue
+                    total = 0
+                    for bound, count in zip(BUCKETS, histogram):
+                        total += count
+                        lines.append(_format(f"{name}_bucket", labels, total, [('le', bound)]))
+                    lines.append(_format(f"{name}_bucket", labels, histogram[-1], [('le', '+Inf')]))
+                    lines.append(_format(f"{name}_sum", labels, histogram[-2]))
+                    lines.append(_format(f"{name}_count", labels, histogram[-1]))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def inc(name, value=1, **labels):
+    registry.inc(name, value, **labels)
+
+
+@contextmanager
+def span(stage):
+    '''
+    Time a stage of the trading loop into bot_stage_seconds
+    '''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe('bot_stage_seconds', time.perf_counter() - start, stage=stage)
+
+
+def instrument(client, on_weight=None):
+    '''
+    Count and time every REST call of a python-binance client, by endpoint
+
+    on_weight is called with the request weight the exchange reports as used
+    this minute, read from each response in the thread that sent the request.
+    Instrumenting a client again only adds on_weight.
+    '''
+    listeners = getattr(client, 'weightListeners', None)
+    if listeners is None:
+        listeners = client.weightListeners = []
+
+        def on_response(response, *args, **kwargs):
+            path = urlparse(response.url).path
+            endpoint = path.split('/v3/', 1)[-1]
+            method = response.request.method
+            registry.inc('binance_requests_total', endpoint=endpoint, method=method,
+                         status=response.status_code)
+            registry.observe('binance_request_seconds', response.elapsed.total_seconds(),
+                             endpoint=endpoint)
+            weight = response.headers.get(WEIGHT_HEADER)
+            if weight is not None:
+                registry.set('binance_used_weight_1m', int(weight))
+                for listener in listeners:
+                    listener(int(weight))
+
+        client.session.hooks['response'].append(on_response)
+    if on_weight:
+        listeners.append(on_weight)
+    return client
+
+
+class Sampler:
+    '''
+    Sampling profiler: collects the stacks of every thread at a fixed interval
+
+    The profile is rendered in the collapsed format read by flamegraph.pl and
+    speedscope, one "frame;frame;frame count" line per distinct stack.
+    '''
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.stacks = Counter()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            samples = []
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+                    frame = frame.f_back
+                samples.append(';'.join(reversed(stack)))
+            with self.lock:
+                self.stacks.update(samples)
+
+    def render(self):
+        with self.lock:
+            return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+_sampler = None
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            body = registry.render()
+        elif self.path == '/profile' and _sampler:
+            body = _sampler.render()
+        else:
+            self.send_error(404)
+            return
+        body = body.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, profile_interval=0):
+    '''
+    Serve /metrics, and /profile when sampling, from a background thread
+    '''
+    global _sampler
+    if profile_interval:
+        _sampler = Sampler(profile_interval).start()
+    server = ThreadingHTTPServer(('', port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Metrics on http://localhost:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,477 @@
+#!python3
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter
+
+from aiohttp import web, WSMsgType
+
+from candles import INTERVAL_MS
+from replay_server import book_ticker_event, kline_event, synthetic_klines
+
+FILTERS = [
+    {'filterType': 'PRICE_FILTER', 'minPrice': '0.01000000',
+     'maxPrice': '1000000.00000000', 'tickSize': '0.01000000'},
+    {'filterType': 'LOT_SIZE', 'minQty': '0.00001000',
+     'maxQty': '9000.00000000', 'stepSize': '0.00001000'},
+    {'filterType': 'NOTIONAL', 'minNotional': '5.00000000'},
+]
+# Request weight of the endpoints the bot uses, reported in X-MBX-USED-WEIGHT-1M
+WEIGHTS = {'klines': 2, 'ticker/price': 2, 'ticker/bookTicker': 2, 'account': 20,
+           'exchangeInfo': 20, 'order': 1, 'openOrders': 6, 'time': 1, 'ping': 1,
+           'userDataStream': 2, 'depth': 50}
+# Order book levels per side around the price
+DEPTH_LEVELS = 20
+
+
+class MockExchange:
+    '''
+    Local stand-in for the Binance spot REST API and its WebSocket streams
+
+    Serves klines, book tickers, order books, balances and order fills from
+    memory, with an optional delay on every REST response.  Market orders fill
+    at once at the book price, limit orders after fill_delay seconds if they
+    cross the book.
+    '''
+
+    def __init__(self, klines=None, balances=None, latency=0.0, fill_delay=0.0,
+                 weight_limit=None, host='127.0.0.1', port=0):
+        self.klines = klines or {}
+        self.balances = dict(balances or {'BTC': 0.0, 'BUSD': 1000.0})
+        self.latency = latency
+        self.fill_delay = fill_delay
+        self.host = host
+        self.port = port
+        self.orders = {}
+        self.orderIds = itertools.count(1)
+        self.requests = Counter()
+        self.requestLog = []
+        self.weight = 0
+        # Weight used in the current minute, answered with 429 above weight_limit
+        self.weight_limit = weight_limit
+        self.minute = None
+        self.minuteWeight = 0
+        self.depths = {}
+        self.userSockets = set()
+        self.marketSockets = {}
+        self.loop = None
+        self.runner = None
+        self.thread = None
+
+    # Market data
+
+    def symbols(self):
+        return sorted({symbol for symbol, interval in self.klines})
+
+    def price(self, symbol):
+        for (s, interval), rows in self.klines.items():
+            if s == symbol:
+                return float(rows[-1][4])
+        raise KeyError(symbol)
+
+    def book(self, symbol):
+        price = self.price(symbol)
+        return {'symbol': symbol, 'bidPrice': f"{price * 0.9999:.8f}", 'bidQty': '1.00000000',
+                'askPrice': f"{price * 1.0001:.8f}", 'askQty': '1.00000000'}
+
+    def add_symbol(self, symbol, interval, count=1000, **kwargs):
+        self.klines[(symbol, interval)] = synthetic_klines(interval, count, **kwargs)
+
+    def push(self, symbol, interval, close, new=False):
+        '''
+        Move the market: revise the open candle, or open a new one, and stream it
+        '''
+        rows = self.klines[(symbol, interval)]
+        last = rows[-1]
+        if new:
+            step = INTERVAL_MS[interval]
+            last = [last[0] + step, last[4], last[4], last[4], last[4], '0',
+                    last[6] + step, '0', 0, '0', '0', '0']
+            rows.append(last)
+        last[4] = f"{close:.8f}"
+        last[2] = f"{max(float(last[2]), close):.8f}"
+        last[3] = f"{min(float(last[3]), close):.8f}"
+        messages = [kline_event(symbol, interval, last, False),
+                    book_ticker_event(symbol, close, len(rows)),
+                    json.dumps({'stream': f"{symbol.lower()}@depth@100ms",
+                                'data': self.depth_update(symbol)})]
+        self.call(self._broadcast_market(messages))
+
+    def _levels(self, symbol):
+        '''
+        Order book around the price, the best levels matching book()
+        '''
+        price = self.price(symbol)
+        bids = {f"{price * 0.9999 * (1 - 0.0001 * i):.8f}": f"{1 + i * 0.5:.8f}" for i in range(DEPTH_LEVELS)}
+        asks = {f"{price * 1.0001 * (1 + 0.0001 * i):.8f}": f"{1 + i * 0.5:.8f}" for i in range(DEPTH_LEVELS)}
+        return bids, asks
+
+    def depth(self, symbol):
+        if symbol not in self.depths:
+            bids, asks = self._levels(symbol)
+            self.depths[symbol] = {'lastUpdateId': 1000, 'bids': bids, 'asks': asks}
+        return self.depths[symbol]
+
+    def depth_update(self, symbol):
+        '''
+        Move the order book to the price, returning the diff depth event
+        '''
+        depth = self.depth(symbol)
+        first = depth['lastUpdateId'] + 1
+        changes = []
+        for side, target in zip(('bids', 'asks'), self._levels(symbol)):
+            levels = depth[side]
+            diff = [[p, '0.00000000'] for p in levels if p not in target]
+            diff += [[p, q] for p, q in target.items() if levels.get(p) != q]
+            depth[side] = target
+            changes.append(diff)
+        depth['lastUpdateId'] = first
+        return {'e': 'depthUpdate', 'E': int(time.time() * 1000), 's': symbol,
+                'U': first, 'u': first, 'b': changes[0], 'a': changes[1]}
+
+    def drop_depth_updates(self, symbol, count=1):
+        '''
+        Lose count depth events, as on a flaky connection
+        '''
+        for _ in range(count):
+            self.depth_update(symbol)
+
+    async def _broadcast_market(self, messages):
+        for message in messages:
+            stream = json.loads(message)['stream']
+            for ws, streams in list(self.marketSockets.items()):
+                if stream in streams:
+                    await ws.send_str(message)
+
+    # Account
+
+    async def _broadcast_user(self, event):
+        for ws in list(self.userSockets):
+            await ws.send_str(json.dumps(event))
+
+    async def _account_event(self, assets):
+        await self._broadcast_user({
+            'e': 'outboundAccountPosition', 'E': int(time.time() * 1000),
+            'B': [{'a': a, 'f': f"{self.balances.get(a, 0.0):.8f}", 'l': '0.00000000'}
+                  for a in assets]})
+
+    def _split(self, symbol):
+        for quote in ('BUSD', 'USDT', 'USDC', 'BTC', 'ETH', 'BNB'):
+            if symbol.endswith(quote) and symbol != quote:
+                return symbol[:-len(quote)], quote
+        return symbol[:-4], symbol[-4:]
+
+    async def _execution_report(self, order):
+        await self._broadcast_user({
+            'e': 'executionReport', 'E': int(time.time() * 1000), 's': order['symbol'],
+            'c': order['clientOrderId'], 'S': order['side'], 'o': order['type'],
+            'q': order['origQty'], 'p': order['price'], 'X': order['status'],
+            'x': 'TRADE' if order['status'] == 'FILLED' else order['status'],
+            'i': order['orderId'], 'l': order['executedQty'], 'z': order['executedQty'],
+            'L': order['price'], 'Z': order['cummulativeQuoteQty']})
+
+    async def _fill(self, order, price):
+        base, quote = self._split(order['symbol'])
+        quantity = float(order['origQty'])
+        if order['side'] == 'BUY':
+            self.balances[quote] = self.balances.get(quote, 0.0) - quantity * price
+            self.balances[base] = self.balances.get(base, 0.0) + quantity
+        else:
+            self.balances[base] = self.balances.get(base, 0.0) - quantity
+            self.balances[quote] = self.balances.get(quote, 0.0) + quantity * price
+        order.update(status='FILLED', executedQty=order['origQty'],
+                     cummulativeQuoteQty=f"{quantity * price:.8f}")
+        await self._execution_report(order)
+        await self._account_event([base, quote])
+
+    async def _fill_later(self, order):
+        await asyncio.sleep(self.fill_delay)
+        book = self.book(order['symbol'])
+        price = float(order['price'])
+        if order['status'] != 'NEW':
+            return
+        if (order['side'] == 'BUY' and price >= float(book['askPrice'])) or \
+                (order['side'] == 'SELL' and price <= float(book['bidPrice'])):
+            await self._fill(order, price)
+
+    # REST
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        path = request.path.split('/v3/', 1)[-1]
+        self.requests[f"{request.method} {path}"] += 1
+        self.requestLog.append((time.perf_counter(), request.method, path))
+        minute = int(time.time() // 60)
+        if minute != self.minute:
+            self.minute, self.minuteWeight = minute, 0
+        self.weight += WEIGHTS.get(path, 1)
+        self.minuteWeight += WEIGHTS.get(path, 1)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.weight_limit and self.minuteWeight > self.weight_limit:
+            self.requests['429'] += 1
+            response = web.json_response(
+                {'code': -1003, 'msg': 'Too much request weight used.'}, status=429,
+                headers={'Retry-After': str(60 - int(time.time()) % 60)})
+        else:
+            response = await handler(request)
+        response.headers['X-MBX-USED-WEIGHT-1M'] = str(self.minuteWeight)
+        return response
+
+    async def params(self, request):
+        params = dict(request.query)
+        if request.method != 'GET' and request.can_read_body:
+            params.update(await request.post())
+        return params
+
+    async def ping(self, request):
+        return web.json_response({})
+
+    async def server_time(self, request):
+        return web.json_response({'serverTime': int(time.time() * 1000)})
+
+    async def exchange_info(self, request):
+        return web.json_response({'symbols': [
+            {'symbol': s, 'status': 'TRADING', 'baseAsset': self._split(s)[0],
+             'quoteAsset': self._split(s)[1], 'filters': FILTERS} for s in self.symbols()]})
+
+    async def get_klines(self, request):
+        params = await self.params(request)
+        rows = self.klines[(params['symbol'], params['interval'])]
+        limit = int(params.get('limit', 500))
+        if 'startTime' in params:
+            start = int(params['startTime'])
+            return web.json_response([k for k in rows if k[0] >= start][:limit])
+        return web.json_response(rows[-limit:])
+
+    async def book_ticker(self, request):
+        params = await self.params(request)
+        return web.json_response(self.book(params['symbol']))
+
+    async def order_book(self, request):
+        params = await self.params(request)
+        depth = self.depth(params['symbol'])
+        limit = int(params.get('limit', 100))
+        bids = sorted(depth['bids'].items(), key=lambda level: -float(level[0]))[:limit]
+        asks = sorted(depth['asks'].items(), key=lambda level: float(level[0]))[:limit]
+        return web.json_response({'lastUpdateId': depth['lastUpdateId'],
+                                  'bids': [list(level) for level in bids],
+                                  'asks': [list(level) for level in asks]})
+
+    async def ticker_price(self, request):
+        params = await self.params(request)
+        if 'symbol' in params:
+            return web.json_response({'symbol': params['symbol'],
+                                      'price': f"{self.price(params['symbol']):.8f}"})
+        return web.json_response([{'symbol': s, 'price': f"{self.price(s):.8f}"}
+                                  for s in self.symbols()])
+
+    async def account(self, request):
+        return web.json_response({'balances': [
+            {'asset': a, 'free': f"{f:.8f}", 'locked': '0.00000000'}
+            for a, f in self.balances.items()]})
+
+    async def create_order(self, request):
+        params = await self.params(request)
+        orderId = next(self.orderIds)
+        order = {
+            'symbol': params['symbol'], 'orderId': orderId,
+            'clientOrderId': params.get('newClientOrderId', f"mock{orderId}"),
+            'transactTime': int(time.time() * 1000), 'side': params['side'],
+            'type': params['type'], 'price': params.get('price', '0.00000000'),
+            'origQty': params['quantity'], 'executedQty': '0.00000000',
+            'cummulativeQuoteQty': '0.00000000', 'status': 'NEW',
+        }
+        self.orders[orderId] = order
+        await self._execution_report(order)
+        if order['type'] == 'MARKET':
+            book = self.book(order['symbol'])
+            await self._fill(order, float(book['askPrice' if order['side'] == 'BUY' else 'bidPrice']))
+        else:
+            asyncio.ensure_future(self._fill_later(order))
+        return web.json_response(dict(order))
+
+    async def get_order(self, request):
+        params = await self.params(request)
+        if 'orderId' in params:
+            order = self.orders.get(int(params['orderId']))
+        else:
+            order = next((o for o in self.orders.values()
+                          if o['clientOrderId'] == params.get('origClientOrderId')), None)
+        if order is None:
+            return web.json_response({'code': -2013, 'msg': 'Order does not exist.'}, status=400)
+        return web.json_response(order)
+
+    async def cancel_order(self, request):
+        params = await self.params(request)
+        order = self.orders.get(int(params['orderId']))
+        if order is None or order['status'] != 'NEW':
+            return web.json_response({'code': -2011, 'msg': 'Unknown order sent.'}, status=400)
+        order['status'] = 'CANCELED'
+        await self._execution_report(order)
+        return web.json_response(order)
+
+    async def open_orders(self, request):
+        params = await self.params(request)
+        return web.json_response([o for o in self.orders.values() if o['status'] == 'NEW'
+                                  and o['symbol'] == params.get('symbol', o['symbol'])])
+
+    async def listen_key(self, request):
+        return web.json_response({'listenKey': 'mock-listen-key'})
+
+    # WebSocket
+
+    async def user_socket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.userSockets.add(ws)
+        try:
+            async for message in ws:
+                if message.type == WSMsgType.ERROR:
+                    break
+        finally:
+            self.userSockets.discard(ws)
+        return ws
+
+    async def market_socket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.marketSockets[ws] = set(request.query.get('streams', '').split('/'))
+        try:
+            async for message in ws:
+                if message.type == WSMsgType.ERROR:
+                    break
+        finally:
+            self.marketSockets.pop(ws, None)
+        return ws
+
+    def app(self):
+        app = web.Application(middlewares=[self.middleware])
+        app.router.add_get('/api/v3/ping', self.ping)
+        app.router.add_get('/api/v3/time', self.server_time)
+        app.router.add_get('/api/v3/exchangeInfo', self.exchange_info)
+        app.router.add_get('/api/v3/klines', self.get_klines)
+        app.router.add_get('/api/v3/ticker/bookTicker', self.book_ticker)
+        app.router.add_get('/api/v3/ticker/price', self.ticker_price)
+        app.router.add_get('/api/v3/depth', self.order_book)
+        app.router.add_get('/api/v3/account', self.account)
+        app.router.add_post('/api/v3/order', self.create_order)
+        app.router.add_get('/api/v3/order', self.get_order)
+        app.router.add_delete('/api/v3/order', self.cancel_order)
+        app.router.add_get('/api/v3/openOrders', self.open_orders)
+        app.router.add_post('/api/v3/userDataStream', self.listen_key)
+        app.router.add_put('/api/v3/userDataStream', self.ping)
+        app.router.add_delete('/api/v3/userDataStream', self.ping)
+        app.router.add_get('/ws/{listenKey}', self.user_socket)
+        app.router.add_get('/stream', self.market_socket)
+        return app
+
+    # Lifecycle
+
+    @property
+    def api_url(self):
+        return f"http://{self.host}:{self.port}/api"
+
+    @property
+    def stream_url(self):
+        return f"ws://{self.host}:{self.port}"
+
+    def client(self):
+        '''
+        A python-binance Client talking to this exchange
+        '''
+        from binance.client import Client
+
+        client = Client('mock-key', 'mock-secret', ping=False)
+        client.API_URL = self.api_url
+        return client
+
+    def call(self, coroutine):
+        '''
+        Run a coroutine on the exchange loop from another thread and wait for it
+        '''
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def _start(self):
+        self.runner = web.AppRunner(self.app())
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    def start(self):
+        '''
+        Serve from a background thread
+        '''
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self._start())
+            ready.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        ready.wait()
+        return self
+
+    async def _stop(self):
+        for ws in list(self.userSockets) + list(self.marketSockets):
+            await ws.close()
+        await self.runner.cleanup()
+
+    def stop(self):
+        self.call(self._stop())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a local mock Binance exchange')
+    parser.add_argument('--symbol', action='append', help='e.g. BTCBUSD, repeatable')
+    parser.add_argument('--interval', action='append', help='e.g. 15m, repeatable')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every REST response')
+    parser.add_argument('--fill-delay', type=float, default=0.0, help='seconds before a limit order fills')
+    parser.add_argument('--weight-limit', type=int, help='answer 429 above this weight per minute')
+    parser.add_argument('--tick', type=float, default=1.0, help='seconds between price moves')
+    parser.add_argument('--ticks-per-candle', type=int, default=10)
+    args = parser.parse_args()
+
+    exchange = MockExchange(latency=args.latency, fill_delay=args.fill_delay,
+                            weight_limit=args.weight_limit, port=args.port)
+    symbols = args.symbol or ['BTCBUSD']
+    intervals = args.interval or ['15m', '1h']
+    for seed, symbol in enumerate(symbols):
+        for interval in intervals:
+            exchange.add_symbol(symbol, interval, seed=seed)
+    exchange.start()
+    print(f"API_URL={exchange.api_url} STREAM_URL={exchange.stream_url}")
+
+    rng = random.Random(0)
+    ticks = 0
+    while True:
+        time.sleep(args.tick)
+        ticks += 1
+        for symbol in symbols:
+            close = exchange.price(symbol) * (1 + rng.gauss(0, 0.001))
+            for interval in intervals:
+                # Only the trading timeframe rolls over, upper candles keep growing
+                new = interval == intervals[0] and ticks % args.ticks_per_candle == 0
+                exchange.push(symbol, interval, close, new=new)
+
+
+if __name__ == "__main__":
+    main()
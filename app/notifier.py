@@ -0,0 +1,130 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+import requests
+
+import settings
+
+# Telegram allows about one message per second per chat and 20 per minute in groups
+MIN_INTERVAL = 1.0
+PER_MINUTE = 20
+MAX_MESSAGE_LENGTH = 4096
+TIMEOUT = 10
+
+
+class TelegramNotifier:
+    '''
+    Send Telegram messages from a background thread
+
+    Messages sharing a key are coalesced: one still queued is replaced by the
+    newer text, and one sent less than dedupe_window seconds ago is dropped.
+    Queued messages are batched into a single request within Telegram's limits.
+    '''
+
+    def __init__(self, token, chat_id, maxsize=100, dedupe_window=60):
+        self.url = f"https://api.telegram.org/bot{token}/sendMessage"
+        self.chat_id = chat_id
+        self.maxsize = maxsize
+        self.dedupe_window = dedupe_window
+        self.pending = OrderedDict()
+        self.sentAt = {}
+        self.history = deque(maxlen=PER_MINUTE)
+        self.dropped = 0
+        self.condition = threading.Condition()
+        self.session = requests.Session()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def send(self, text, key=None):
+        '''
+        Queue a message without blocking, returns False if it was dropped
+        '''
+        key = key or text
+        now = time.monotonic()
+        with self.condition:
+            if now - self.sentAt.get(key, -self.dedupe_window) < self.dedupe_window:
+                return False
+            if key not in self.pending and len(self.pending) >= self.maxsize:
+                self.dropped += 1
+                return False
+            self.pending[key] = text
+            self.condition.notify()
+        return True
+
+    def _batch(self):
+        batch, length = [], 0
+        for key, text in self.pending.items():
+            text = text[:MAX_MESSAGE_LENGTH]
+            if batch and length + len(text) + 1 > MAX_MESSAGE_LENGTH:
+                break
+            batch.append((key, text))
+            length += len(text) + 1
+        for key, text in batch:
+            del self.pending[key]
+        return batch
+
+    def _throttle(self):
+        now = time.monotonic()
+        wait = 0
+        if self.history:
+            wait = self.history[-1] + MIN_INTERVAL - now
+        if len(self.history) == PER_MINUTE:
+            wait = max(wait, self.history[0] + 60 - now)
+        if wait > 0:
+            time.sleep(wait)
+
+    def _post(self, text):
+        response = self.session.get(self.url, timeout=TIMEOUT, params={
+            'chat_id': self.chat_id, 'parse_mode': 'Markdown', 'text': text})
+        if response.status_code == 429:
+            retry = response.json().get('parameters', {}).get('retry_after', 1)
+            time.sleep(retry)
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending)
+            self._throttle()
+            with self.condition:
+                batch = self._batch()
+                now = time.monotonic()
+                for key, text in batch:
+                    self.sentAt[key] = now
+                # Forget keys outside the window
+                for key in [k for k, t in self.sentAt.items() if now - t >= self.dedupe_window]:
+                    del self.sentAt[key]
+            self.history.append(time.monotonic())
+            try:
+                sent = self._post('\n'.join(text for key, text in batch))
+            except requests.RequestException as e:
+                print(f"Telegram notification failed: {e}")
+                sent = True
+            if not sent:
+                # Rate limited, queue the batch again ahead of newer messages
+                with self.condition:
+                    for key, text in reversed(batch):
+                        self.sentAt.pop(key, None)
+                        if key not in self.pending:
+                            self.pending[key] = text
+                            self.pending.move_to_end(key, last=False)
+
+
+_notifier = None
+_notifier_lock = threading.Lock()
+
+
+def get_notifier():
+    '''
+    Get the process-wide notifier, None when Telegram is not configured
+    '''
+    global _notifier
+    if not settings.telegram_token:
+        return None
+    with _notifier_lock:
+        if _notifier is None:
+            _notifier = TelegramNotifier(settings.telegram_token, settings.telegram_chat_id,
+                                         dedupe_window=settings.telegram_dedupe_window)
+        return _notifier
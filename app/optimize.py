@@ -0,0 +1,124 @@
+#!python3
+import argparse
+import itertools
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import settings
+from backtest import COLUMNS, IndicatorCache, backtest, load_klines
+
+RANKINGS = {
+    'return': lambda r: r['return'],
+    'pnl': lambda r: r['pnl'],
+    'drawdown': lambda r: -r['max_drawdown'],
+    'win_rate': lambda r: r['win_rate'],
+    # Return per unit of drawdown
+    'calmar': lambda r: r['return'] / r['max_drawdown'] if r['max_drawdown'] else r['return'],
+}
+
+# Settings whose value decides which indicator arrays a combination needs,
+# sorting on them keeps combinations that share arrays in the same chunk
+INDICATOR_KEYS = ['TRADE_RSI_IFR', 'TRADE_RSI_STOCH', 'TRADE_RSI_K', 'TRADE_RSI_D',
+                  'TRADE_TIME_FRAME_UPPER_VALIDATOR_VALUE']
+
+_data = None
+_cache = None
+
+
+def parse_values(spec):
+    '''
+    "2,3,5" or an inclusive range "2:10" or "2:10:2"
+    '''
+    if ':' in spec:
+        bounds = [int(x) for x in spec.split(':')]
+        start, stop, step = bounds[0], bounds[1], bounds[2] if len(bounds) > 2 else 1
+        return [str(x) for x in range(start, stop + 1, step)]
+    return spec.split(',')
+
+
+def combinations(grid, samples=None, seed=1):
+    names = list(grid)
+    combos = [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+    if samples and samples < len(combos):
+        combos = random.Random(seed).sample(combos, samples)
+    return sorted(combos, key=lambda c: [str(c.get(name, '')) for name in INDICATOR_KEYS])
+
+
+def share(data, directory):
+    '''
+    Save the price arrays once so workers can memory map them read-only
+    '''
+    for name, values in data.items():
+        np.save(os.path.join(directory, f"{name}.npy"), values)
+
+
+def _init_worker(directory):
+    global _data, _cache
+    _data = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r')
+             for name in COLUMNS}
+    _cache = IndicatorCache(_data, maxsize=64)
+
+
+def _run(args):
+    overrides, cash, fee = args
+    result = backtest(_data, settings.pair_settings(overrides), cash, fee, _cache)
+    del result['equity']
+    result['trades'] = len(result['trades'])
+    return overrides, result
+
+
+def optimize(data, grid, samples=None, workers=None, cash=1000.0, fee=0.001, rank='return'):
+    '''
+    Backtest every combination of the grid on a process pool, best first
+    '''
+    combos = combinations(grid, samples)
+    workers = workers or os.cpu_count()
+    # Contiguous chunks keep combinations sharing indicators on one worker
+    chunksize = max(1, len(combos) // (workers * 4))
+    with tempfile.TemporaryDirectory() as directory:
+        share(data, directory)
+        with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                 initargs=(directory,)) as pool:
+            results = list(pool.map(_run, [(c, cash, fee) for c in combos],
+                                    chunksize=chunksize))
+    return sorted(results, key=lambda r: RANKINGS[rank](r[1]), reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Search strategy settings over historical klines')
+    parser.add_argument('path', help='CSV (Binance kline dump), Parquet file or kline store directory')
+    parser.add_argument('--grid', action='append', default=[], metavar='NAME=VALUES',
+                        help='setting and values to try, e.g. TRADE_RSI_K=2,3,4 or TRADE_EMA_LOW=2:10')
+    parser.add_argument('--samples', type=int, help='random search over this many combinations')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--rank', choices=sorted(RANKINGS), default='return')
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--cash', type=float, default=1000.0)
+    parser.add_argument('--fee', type=float, default=0.001)
+    args = parser.parse_args()
+
+    grid = {}
+    for spec in args.grid:
+        name, values = spec.split('=', 1)
+        grid[name] = parse_values(values)
+    if not grid:
+        parser.error('at least one --grid is required')
+
+    data = load_klines(args.path)
+    start = time.perf_counter()
+    results = optimize(data, grid, args.samples, args.workers, args.cash, args.fee, args.rank)
+    print(f"{len(results)} combinations in {time.perf_counter() - start:.2f}s")
+    for overrides, result in results[:args.top]:
+        params = ' '.join(f"{name}={value}" for name, value in overrides.items())
+        print(f"{params} - Trades: {result['trades']} - Return: {result['return']:.2%} - "
+              f"Max drawdown: {result['max_drawdown']:.2%} - Win rate: {result['win_rate']:.2%}")
+
+
+if __name__ == "__main__":
+    main()
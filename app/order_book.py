@@ -0,0 +1,214 @@
+import asyncio
+import json
+import threading
+from bisect import bisect_left, insort
+
+import websockets
+
+import settings
+from metrics import inc
+
+# Levels per side in the REST snapshot the book starts from
+DEPTH_LIMIT = 1000
+
+
+class OrderBook:
+    '''
+    L2 order book of one symbol, from a REST snapshot kept current by the diff depth stream
+
+    Follows Binance's procedure: events are buffered while the snapshot is
+    fetched, those it already contains are dropped, and every event applied
+    must continue the update ids of the previous one. A gap in the ids means
+    events were lost and the book is rebuilt from a new snapshot. Reads are
+    served from memory and return None until the book is in sync.
+    '''
+
+    def __init__(self, client, symbol, url=None, limit=DEPTH_LIMIT):
+        self.client = client
+        self.symbol = symbol
+        self.url = url or settings.stream_url
+        self.limit = limit
+        self.bids = {}
+        self.asks = {}
+        # Prices of each side, ascending: the best bid is last, the best ask first
+        self.bidPrices = []
+        self.askPrices = []
+        self.lastUpdateId = None
+        self.synced = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    # Reads
+
+    def ticker(self):
+        '''
+        Best prices in the shape of get_orderbook_ticker, None while out of sync
+        '''
+        with self.lock:
+            if not self.synced.is_set() or not self.bidPrices or not self.askPrices:
+                return None
+            bid, ask = self.bidPrices[-1], self.askPrices[0]
+            return {'symbol': self.symbol, 'bidPrice': bid, 'bidQty': self.bids[bid],
+                    'askPrice': ask, 'askQty': self.asks[ask]}
+
+    def best_bid(self):
+        ticker = self.ticker()
+        return ticker and ticker['bidPrice']
+
+    def best_ask(self):
+        ticker = self.ticker()
+        return ticker and ticker['askPrice']
+
+    def spread(self):
+        ticker = self.ticker()
+        return ticker and ticker['askPrice'] - ticker['bidPrice']
+
+    def _walk(self, side):
+        if side == 'BUY':
+            return ((price, self.asks[price]) for price in self.askPrices)
+        return ((price, self.bids[price]) for price in reversed(self.bidPrices))
+
+    def fill_price(self, side, quantity):
+        '''
+        Average price a market order of quantity would fill at, None if the book is too thin
+        '''
+        with self.lock:
+            if not self.synced.is_set():
+                return None
+            remaining, cost = quantity, 0.0
+            for price, available in self._walk(side):
+                taken = min(remaining, available)
+                cost += taken * price
+                remaining -= taken
+                if remaining <= 0:
+                    return cost / quantity
+        return None
+
+    def quantity_for(self, quote):
+        '''
+        Quantity a market buy spending quote would get, walking up the asks
+        '''
+        with self.lock:
+            if not self.synced.is_set():
+                return None
+            quantity = 0.0
+            for price, available in self._walk('BUY'):
+                if available * price >= quote:
+                    return quantity + quote / price
+                quantity += available
+                quote -= available * price
+        return quantity
+
+    # Updates
+
+    def _set(self, levels, prices, price, quantity):
+        if quantity == 0:
+            if levels.pop(price, None) is not None:
+                del prices[bisect_left(prices, price)]
+        else:
+            if price not in levels:
+                insort(prices, price)
+            levels[price] = quantity
+
+    def _load(self, snapshot):
+        with self.lock:
+            self.bids = {float(p): float(q) for p, q in snapshot['bids']}
+            self.asks = {float(p): float(q) for p, q in snapshot['asks']}
+            self.bidPrices = sorted(self.bids)
+            self.askPrices = sorted(self.asks)
+            self.lastUpdateId = snapshot['lastUpdateId']
+
+    def apply(self, event):
+        with self.lock:
+            for price, quantity in event['b']:
+                self._set(self.bids, self.bidPrices, float(price), float(quantity))
+            for price, quantity in event['a']:
+                self._set(self.asks, self.askPrices, float(price), float(quantity))
+            self.lastUpdateId = event['u']
+
+    async def _read(self, ws, events):
+        try:
+            async for message in ws:
+                events.put_nowait(json.loads(message)['data'])
+        finally:
+            # Wake up _follow() so it notices the closed connection
+            events.put_nowait(None)
+
+    async def _next(self, events):
+        event = await events.get()
+        if event is None:
+            raise ConnectionError('depth stream closed')
+        return event
+
+    async def _follow(self, events):
+        '''
+        Build the book and keep applying events, until a gap in the update ids
+        '''
+        first = await self._next(events)
+        snapshot = await asyncio.to_thread(self.client.get_order_book, symbol=self.symbol, limit=self.limit)
+        while snapshot['lastUpdateId'] < first['U']:
+            # Older than the buffered events, they would not connect to it
+            snapshot = await asyncio.to_thread(self.client.get_order_book, symbol=self.symbol, limit=self.limit)
+        self._load(snapshot)
+        self.synced.set()
+        event = first
+        while True:
+            # Events the book already holds are skipped, the others must follow on
+            if event['u'] > self.lastUpdateId:
+                if event['U'] > self.lastUpdateId + 1:
+                    return
+                self.apply(event)
+            event = await self._next(events)
+
+    async def run(self, reconnect=True):
+        url = f"{self.url}/stream?streams={self.symbol.lower()}@depth@100ms"
+        delay = 1
+        while True:
+            reader = None
+            try:
+                async with websockets.connect(url) as ws:
+                    delay = 1
+                    events = asyncio.Queue()
+                    reader = asyncio.create_task(self._read(ws, events))
+                    while True:
+                        await self._follow(events)
+                        self.synced.clear()
+                        inc('order_book_resyncs_total', symbol=self.symbol)
+                        print(f"{self.symbol} order book missed updates, resyncing")
+            except Exception as e:
+                print(f"{self.symbol} depth stream disconnected: {e}. Reconnecting in {delay}s")
+            finally:
+                self.synced.clear()
+                if reader:
+                    reader.cancel()
+            if not reconnect:
+                return
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+
+    def start(self):
+        self.thread = threading.Thread(target=lambda: asyncio.run(self.run()), daemon=True)
+        self.thread.start()
+        return self
+
+
+_books = {}
+_books_lock = threading.Lock()
+
+
+def get_order_book(client, symbol):
+    '''
+    Get the local order book of a symbol, starting it on first use
+    '''
+    with _books_lock:
+        if symbol not in _books:
+            _books[symbol] = OrderBook(client, symbol).start()
+        return _books[symbol]
+
+
+def local_order_book(symbol):
+    '''
+    The local order book of a symbol if it is kept and in sync, else None
+    '''
+    book = _books.get(symbol)
+    return book if book is not None and book.synced.is_set() else None
@@ -0,0 +1,189 @@
+import threading
+from concurrent.futures import Future, TimeoutError
+
+import clock
+import settings
+
+FINAL_STATUSES = {'FILLED', 'CANCELED', 'EXPIRED', 'EXPIRED_IN_MATCH', 'REJECTED'}
+# How often a wait on the stream wakes up to check the stream is still there
+STREAM_CHECK_INTERVAL = 5
+# REST polling backoff while the user data stream is down
+POLL_INTERVAL = 0.5
+POLL_INTERVAL_MAX = 16
+EARLY_REPORTS = 1000
+
+
+def report_to_order(event):
+    '''
+    Convert an executionReport event into the fields of a get_order response
+    '''
+    return {
+        'symbol': event['s'],
+        'orderId': event['i'],
+        'clientOrderId': event['c'],
+        'side': event['S'],
+        'type': event['o'],
+        'price': event['p'],
+        'origQty': event['q'],
+        'executedQty': event['z'],
+        'cummulativeQuoteQty': event['Z'],
+        'status': event['X'],
+    }
+
+
+class TrackedOrder:
+    '''
+    An order we placed, resolved once it reaches a final status
+    '''
+
+    def __init__(self, order, generation):
+        self.symbol = order['symbol']
+        self.orderId = order['orderId']
+        self.type = order.get('type', 'MARKET')
+        self.order = order
+        self.created = clock.monotonic()
+        # Stream generation the order was placed in, a reconnect may lose its events
+        self.generation = generation
+        self.future = Future()
+        if order.get('status') in FINAL_STATUSES:
+            self.future.set_result(order)
+
+    def update(self, order):
+        self.order = order
+        if order['status'] in FINAL_STATUSES and not self.future.done():
+            self.future.set_result(order)
+
+
+class OrderManager:
+    '''
+    Order lifecycle from executionReport events, with REST polling as a fallback
+    '''
+
+    def __init__(self, client, stream=None):
+        self.client = client
+        self.stream = stream
+        self.orders = {}
+        # Reports that arrived before the order placement call returned
+        self.early = {}
+        self.lock = threading.Lock()
+        if stream:
+            stream.subscribe(self.on_event)
+
+    def on_event(self, event):
+        if event.get('e') != 'executionReport':
+            return
+        key = (event['s'], event['i'])
+        order = report_to_order(event)
+        with self.lock:
+            tracked = self.orders.get(key)
+            if tracked is None:
+                self.early[key] = order
+                if len(self.early) > EARLY_REPORTS:
+                    # Mostly orders placed elsewhere on the account
+                    del self.early[next(iter(self.early))]
+                return
+        tracked.update(order)
+
+    def streaming(self, tracked):
+        return (self.stream is not None and self.stream.connected.is_set()
+                and self.stream.generation == tracked.generation)
+
+    def track(self, order):
+        '''
+        Start following an order returned by one of the order placement calls
+        '''
+        generation = self.stream.generation if self.stream else None
+        tracked = TrackedOrder(order, generation)
+        key = (tracked.symbol, tracked.orderId)
+        with self.lock:
+            self.orders[key] = tracked
+            early = self.early.pop(key, None)
+        if early:
+            tracked.update(early)
+        return tracked
+
+    def poll(self, tracked):
+        from binance.exceptions import BinanceAPIException
+
+        try:
+            tracked.update(self.client.get_order(
+                symbol=tracked.symbol, orderId=tracked.orderId))
+        except BinanceAPIException as e:
+            # -2013: the order is not visible yet
+            if e.code != -2013:
+                print(e)
+        except Exception as e:
+            # A timeout or dropped connection, the next poll tries again
+            print("Unexpected Error: {0}".format(e))
+
+    def cancel(self, tracked):
+        from binance.exceptions import BinanceAPIException
+
+        try:
+            self.client.cancel_order(symbol=tracked.symbol, orderId=tracked.orderId)
+        except BinanceAPIException as e:
+            # Filled or cancelled meanwhile, the final status will tell
+            print(e)
+        except Exception as e:
+            print("Unexpected Error: {0}".format(e))
+
+    def wait(self, order, stale_after=None, timeout=None):
+        '''
+        Block until the order is final and return it, or None after timeout seconds
+
+        Limit orders still open after stale_after seconds are cancelled, the
+        returned order then tells how much was executed.
+        '''
+        tracked = order if isinstance(order, TrackedOrder) else self.track(order)
+        deadline = None if timeout is None else clock.monotonic() + timeout
+        interval = POLL_INTERVAL
+        cancelled = False
+        try:
+            while not tracked.future.done():
+                remaining = None if deadline is None else deadline - clock.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                if (stale_after and not cancelled and tracked.type != 'MARKET'
+                        and clock.monotonic() - tracked.created > stale_after):
+                    print(f"Cancelling stale order {tracked.orderId}")
+                    self.cancel(tracked)
+                    cancelled = True
+                    interval = POLL_INTERVAL
+                if self.streaming(tracked):
+                    wait = STREAM_CHECK_INTERVAL
+                    if stale_after and not cancelled:
+                        wait = max(0, min(wait, tracked.created + stale_after - clock.monotonic()))
+                    if remaining is not None:
+                        wait = min(wait, remaining)
+                    try:
+                        tracked.future.result(timeout=wait)
+                    except TimeoutError:
+                        pass
+                else:
+                    self.poll(tracked)
+                    if not tracked.future.done():
+                        clock.sleep(interval if remaining is None else min(interval, remaining))
+                        interval = min(interval * 2, POLL_INTERVAL_MAX)
+            return tracked.future.result()
+        finally:
+            with self.lock:
+                self.orders.pop((tracked.symbol, tracked.orderId), None)
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_order_manager(client):
+    '''
+    Get the process-wide order manager, on the user data stream if enabled
+    '''
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            stream = None
+            if settings.user_data_stream:
+                from user_stream import get_user_stream
+                stream = get_user_stream(client)
+            _manager = OrderManager(client, stream)
+        return _manager
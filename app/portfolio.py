@@ -0,0 +1,64 @@
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from requests.adapters import HTTPAdapter
+
+import settings
+from bot import restore_state, tick
+from metrics import inc
+from scheduler import CandleScheduler, conf_intervals
+
+
+class Pair:
+    '''
+    One traded symbol with its own settings and decision state
+    '''
+
+    def __init__(self, client, conf):
+        self.conf = conf
+        self.state = restore_state(client, conf)
+        self.symbol = f"{conf.trade_crypto}{conf.trade_coin}"
+        if conf.order_book:
+            from order_book import get_order_book
+            get_order_book(client, self.symbol)
+
+
+class PortfolioRunner:
+    '''
+    Trade many pairs from one process over a shared client
+
+    The client's rate limiter (see ratelimit.limit()) spreads the request
+    weight over the pairs.
+    '''
+
+    def __init__(self, client, pairs, workers=None, every=None):
+        self.client = client
+        self.pairs = [Pair(client, settings.pair_settings(overrides)) for overrides in pairs]
+        self.workers = workers or settings.portfolio_workers
+        every = settings.trade_evaluate_interval if every is None else every
+        self.scheduler = CandleScheduler(
+            client, [i for pair in self.pairs for i in conf_intervals(pair.conf)], every)
+        # One keep-alive connection per worker instead of requests' default 10
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+        client.session.mount('https://', adapter)
+
+    def tick(self, pair, closed=()):
+        try:
+            tick(self.client, pair.state, pair.conf, prefix=f"{pair.symbol} - ", closed=closed)
+        except Exception as e:
+            inc('bot_exceptions_total', where='portfolio', type=type(e).__name__)
+            print('Error while trading {}...\n{}\n'.format(
+                pair.symbol, traceback.format_exc()))
+
+    def run(self):
+        print(f"Trading {len(self.pairs)} pairs with {self.workers} workers")
+        pairs = self.pairs
+        # Without evaluations in between, even the first one is of a closed candle
+        closed = set() if self.scheduler.every else self.scheduler.intervals
+        with ThreadPoolExecutor(self.workers) as pool:
+            while True:
+                wait([pool.submit(self.tick, pair, closed) for pair in pairs])
+                closed = self.scheduler.wait()
+                # Between closes every pair is evaluated, on a close only those it concerns
+                pairs = [pair for pair in self.pairs
+                         if not closed or closed & set(conf_intervals(pair.conf))]
@@ -0,0 +1,177 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import settings
+from metrics import inc, instrument
+
+# Lower runs first when weight is short
+PRIORITY_ORDER = 0
+PRIORITY_MARKET = 1
+PRIORITY_METADATA = 2
+
+# Weight of the spot endpoints the bot calls: (with symbol, without symbol)
+WEIGHTS = {
+    'klines': (2, 2),
+    'ticker/price': (2, 4),
+    'ticker/bookTicker': (2, 4),
+    'openOrders': (6, 80),
+    'account': (20, 20),
+    'exchangeInfo': (20, 20),
+    'userDataStream': (2, 2),
+}
+PRIORITIES = {
+    'order': PRIORITY_ORDER,
+    'openOrders': PRIORITY_ORDER,
+    'account': PRIORITY_ORDER,
+    'klines': PRIORITY_MARKET,
+    'ticker/price': PRIORITY_MARKET,
+    'ticker/bookTicker': PRIORITY_MARKET,
+    'depth': PRIORITY_MARKET,
+}
+
+# Backoff after 429 (rate limited) and 418 (IP banned) responses
+BACKOFF_BASE = 1
+BACKOFF_MAX = 300
+MAX_ATTEMPTS = 5
+
+
+def request_weight(method, endpoint, params):
+    if endpoint == 'order':
+        return 4 if method == 'get' else 1
+    if endpoint == 'depth':
+        limit = int(params.get('limit', 100)) if params else 100
+        return 5 if limit <= 100 else 25 if limit <= 500 else 50 if limit <= 1000 else 250
+    withSymbol, withoutSymbol = WEIGHTS.get(endpoint, (1, 1))
+    return withSymbol if params and 'symbol' in params else withoutSymbol
+
+
+class RateLimiter:
+    '''
+    Request weight budget shared by every caller in the process
+
+    A token bucket refilled at per_minute over a minute, lowered to what the
+    exchange reports as used in the response headers (other processes on the
+    same IP count too). Callers waiting for weight are served by priority.
+    '''
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+        self.blockedUntil = 0
+        self.bans = 0
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, weight, priority=PRIORITY_MARKET):
+        '''
+        Block until weight is available and no more urgent caller is waiting
+        '''
+        weight = min(weight, self.capacity)
+        entry = (priority, next(self.sequence))
+        with self.condition:
+            heapq.heappush(self.waiting, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self.waiting[0] != entry:
+                        self.condition.wait()
+                        continue
+                    wait = max(self.blockedUntil - now, (weight - self.tokens) / self.rate)
+                    if wait <= 0:
+                        self.tokens -= weight
+                        return
+                    self.condition.wait(wait)
+            finally:
+                self.waiting.remove(entry)
+                heapq.heapify(self.waiting)
+                self.condition.notify_all()
+
+    def update(self, used):
+        '''
+        Account for the weight the exchange reports as used this minute
+        '''
+        with self.condition:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, self.capacity - used)
+
+    def succeeded(self):
+        '''
+        A request went through, the next 429/418 starts the backoff over
+        '''
+        with self.condition:
+            self.bans = 0
+
+    def penalize(self, status, retry_after=None):
+        '''
+        Stop every caller after a 429/418, for Retry-After or an exponential backoff
+        '''
+        with self.condition:
+            self.bans += 1
+            backoff = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (self.bans - 1))
+            delay = max(float(retry_after or 0), backoff * random.uniform(0.5, 1.5))
+            self.blockedUntil = max(self.blockedUntil, time.monotonic() + delay)
+            self.tokens = min(self.tokens, 0)
+            self.condition.notify_all()
+        inc('binance_rate_limited_total', status=status)
+        print(f"Rate limited by Binance ({status}), pausing requests for {delay:.1f}s")
+        return delay
+
+
+def limit(client, limiter=None):
+    '''
+    Route every REST call of a python-binance client through the rate limiter
+    '''
+    from binance.exceptions import BinanceAPIException
+
+    limiter = limiter or get_rate_limiter()
+    # The used weight comes from each response, client.response is shared by every thread
+    instrument(client, limiter.update)
+    request = client._request
+
+    def _request(method, uri, signed, force_params=False, **kwargs):
+        endpoint = urlparse(uri).path.split('/v3/', 1)[-1]
+        weight = request_weight(method, endpoint, kwargs.get('data'))
+        priority = PRIORITIES.get(endpoint, PRIORITY_METADATA)
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            limiter.acquire(weight, priority)
+            try:
+                result = request(method, uri, signed, force_params, **kwargs)
+            except BinanceAPIException as e:
+                # The request was rejected, not executed, so it is safe to send again
+                if e.status_code not in (418, 429) or attempt == MAX_ATTEMPTS:
+                    raise
+                limiter.penalize(e.status_code, e.response.headers.get('Retry-After'))
+                inc('bot_retries_total', function=endpoint)
+                continue
+            limiter.succeeded()
+            return result
+
+    client._request = _request
+    return client
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    '''
+    Get the process-wide rate limiter
+    '''
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter(settings.request_weight_limit)
+        return _limiter
@@ -0,0 +1,137 @@
+import datetime
+import gzip
+import json
+import os
+import threading
+import zlib
+
+import clock
+import settings
+
+# Newest kline rows remembered per series, to write only the ones that changed
+SEEN_KLINES = 200
+
+
+def trade_settings(conf=settings):
+    '''
+    The settings that drive the decisions, recorded so a replay makes the same ones
+    '''
+    return {name: value for name, value in vars(conf).items()
+            if name.startswith('trade_') or name == 'notification_only'}
+
+
+class Recorder:
+    '''
+    Append what the bot reads from the exchange to compressed files, for replay.py
+
+    Each run and each UTC day gets its own DIR/YYYYMMDD-HHMMSS.jsonl.gz, one
+    JSON array per line starting with the time in ms and a kind:
+
+    - ['s', settings]: the trade settings, first in every file
+    - ['k', symbol, interval, row]: a kline, the first 7 get_klines fields
+    - ['b', symbol, bidPrice, bidQty, askPrice, askQty]: a book ticker
+    - ['B', balances]: the free balances read over REST
+    - ['a', event]: a user data stream event
+    - ['i', symbol, filters]: the trading rules of a symbol
+
+    A kline is only written when it differs from the last row seen for its
+    open time. Lines are flushed as they are written, so a crash loses at most
+    the line being written.
+    '''
+
+    def __init__(self, path, conf=settings):
+        self.path = path
+        self.conf = conf
+        self.file = None
+        self.day = None
+        self.seen = {}
+        self.symbols = set()
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def _write(self, *record):
+        now = int(clock.time() * 1000)
+        opened = datetime.datetime.fromtimestamp(now / 1000, datetime.timezone.utc)
+        if opened.date() != self.day:
+            if self.file:
+                self.file.close()
+            name = opened.strftime('%Y%m%d-%H%M%S') + '.jsonl.gz'
+            self.file = gzip.open(os.path.join(self.path, name), 'wt')
+            self.day = opened.date()
+            self.file.write(json.dumps([now, 's', trade_settings(self.conf)]) + '\n')
+        self.file.write(json.dumps([now, *record], separators=(',', ':')) + '\n')
+        self.file.flush()
+
+    def klines(self, symbol, interval, rows):
+        with self.lock:
+            seen = self.seen.setdefault((symbol, interval), {})
+            for row in rows:
+                row = [int(row[0]), *(float(v) for v in row[1:6]), int(row[6])]
+                if seen.get(row[0]) != row:
+                    seen[row[0]] = row
+                    self._write('k', symbol, interval, row)
+            while len(seen) > SEEN_KLINES:
+                del seen[next(iter(seen))]
+
+    def book(self, symbol, book):
+        quantity = lambda name: float(book[name]) if book.get(name) is not None else None
+        with self.lock:
+            self._write('b', symbol, float(book['bidPrice']), quantity('bidQty'),
+                        float(book['askPrice']), quantity('askQty'))
+
+    def balances(self, balances):
+        with self.lock:
+            self._write('B', balances)
+
+    def account(self, event):
+        with self.lock:
+            self._write('a', event)
+
+    def symbol(self, filters):
+        with self.lock:
+            if filters.symbol not in self.symbols:
+                self.symbols.add(filters.symbol)
+                self._write('i', filters.symbol, list(filters.filters.values()))
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+
+def read(path):
+    '''
+    The records of a recording directory in time order
+
+    A file cut short by a crash is read up to its last complete line.
+    '''
+    for name in sorted(os.listdir(path)):
+        if not name.endswith('.jsonl.gz'):
+            continue
+        with gzip.open(os.path.join(path, name), 'rt') as f:
+            try:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        break
+            except (EOFError, zlib.error):
+                print(f"{name} ends early, the recorder did not close it")
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_recorder():
+    '''
+    Get the process-wide recorder, None when RECORD_DIR is not set
+    '''
+    global _recorder
+    if not settings.record_dir:
+        return None
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = Recorder(settings.record_dir)
+        return _recorder
@@ -0,0 +1,318 @@
+#!python3
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import random
+import time
+import traceback
+from bisect import bisect_left, insort
+
+import clock
+import settings
+from recorder import read
+
+# Records up to this many seconds after a request are taken as its response: the
+# live bot sent it a little after the wake-up the replay requests at
+RESPONSE_WINDOW = 1.0
+# Trading fee of the simulated fills, as in backtest.py
+FEE = 0.001
+# Quote balance to start from when the recording has none
+CASH = 1000.0
+# Trading rules of symbols the recording has none for
+DEFAULT_FILTERS = [{'filterType': 'LOT_SIZE', 'minQty': '0.00001000',
+                    'maxQty': '9000.00000000', 'stepSize': '0.00001000'}]
+
+
+class Recording:
+    '''
+    The market data of a recording as it was known at a point in time
+
+    advance() applies the records up to a time; the getters then answer like
+    the exchange did then.
+    '''
+
+    def __init__(self, records):
+        self.records = records
+        self.position = 0
+        self.settings = next((r[2] for r in records if r[1] == 's'), {})
+        self.rows = {}
+        self.openTimes = {}
+        self.books = {}
+        self.closes = {}
+        self.balances = next((r[2] for r in records if r[1] == 'B'), None)
+        self.filters = {r[2]: r[3] for r in records if r[1] == 'i'}
+
+    @property
+    def start(self):
+        return self.records[0][0]
+
+    @property
+    def end(self):
+        return self.records[-1][0]
+
+    def advance(self, now):
+        '''
+        Apply the records up to now (ms), returning the klines among them
+        '''
+        klines = []
+        while self.position < len(self.records) and self.records[self.position][0] <= now:
+            record = self.records[self.position]
+            self.position += 1
+            if record[1] == 'k':
+                t, kind, symbol, interval, row = record
+                key = (symbol, interval)
+                rows = self.rows.setdefault(key, {})
+                if row[0] not in rows:
+                    insort(self.openTimes.setdefault(key, []), row[0])
+                rows[row[0]] = row
+                self.closes[symbol] = (t, row[4])
+                klines.append((symbol, row))
+            elif record[1] == 'b':
+                self.books[record[2]] = (record[0], record[3], record[5])
+        return klines
+
+    def klines(self, symbol, interval, limit=500, startTime=None):
+        key = (symbol, interval)
+        times = self.openTimes.get(key, [])
+        first = bisect_left(times, startTime) if startTime is not None else max(0, len(times) - limit)
+        return [self.rows[key][t] for t in times[first:first + limit]]
+
+    def prices(self, symbol):
+        '''
+        Bid and ask: the book ticker when recorded after the newest kline, else the last close
+        '''
+        book = self.books.get(symbol)
+        close = self.closes.get(symbol)
+        if book and (close is None or book[0] >= close[0]):
+            return book[1], book[2]
+        if close is None:
+            raise ValueError(f"No prices of {symbol} recorded yet")
+        return close[1], close[1]
+
+
+def api_error(code, message):
+    from binance.exceptions import BinanceAPIException
+
+    return BinanceAPIException(None, 400, json.dumps({'code': code, 'msg': message}))
+
+
+class PaperExchange:
+    '''
+    Stand-in for the python-binance client over a recording, with simulated fills
+
+    Requests see the recording as of the virtual clock. Market orders fill at
+    once at the recorded bid or ask, limit orders at their price once a kline
+    recorded after them trades through it. Balances start from the first
+    recorded ones and only move with these fills, less fee.
+    '''
+
+    def __init__(self, recording, base, quote, balances=None, fee=FEE):
+        self.recording = recording
+        self.base = base
+        self.quote = quote
+        self.fee = fee
+        self.balances = dict(balances or recording.balances or {quote: CASH})
+        self.orders = {}
+        # Limit orders waiting for the price
+        self.open = []
+        self.fills = []
+        self.orderIds = 0
+
+    def _now(self):
+        now = int(clock.time() * 1000)
+        for symbol, row in self.recording.advance(now + RESPONSE_WINDOW * 1000):
+            for order in list(self.open):
+                price = float(order['price'])
+                if order['symbol'] == symbol and (
+                        (order['side'] == 'BUY' and row[3] <= price) or
+                        (order['side'] == 'SELL' and row[2] >= price)):
+                    self._fill(order, price)
+        return now
+
+    def _fill(self, order, price):
+        quantity = float(order['origQty'])
+        if order['side'] == 'BUY':
+            self.balances[self.quote] = self.balances.get(self.quote, 0.0) - quantity * price
+            self.balances[self.base] = self.balances.get(self.base, 0.0) + quantity * (1 - self.fee)
+        else:
+            self.balances[self.base] = self.balances.get(self.base, 0.0) - quantity
+            self.balances[self.quote] = self.balances.get(self.quote, 0.0) + quantity * price * (1 - self.fee)
+        order.update(status='FILLED', executedQty=order['origQty'],
+                     cummulativeQuoteQty=f"{quantity * price:.8f}")
+        if order in self.open:
+            self.open.remove(order)
+        self.fills.append((int(clock.time() * 1000), order['side'], quantity, price))
+
+    def _order(self, symbol, side, type, quantity, price=None, newClientOrderId=None):
+        now = self._now()
+        quantity = float(quantity)
+        bid, ask = self.recording.prices(symbol)
+        cost = quantity * float(price or ask)
+        if (side == 'BUY' and cost > self.balances.get(self.quote, 0.0) + 1e-8) or \
+                (side == 'SELL' and quantity > self.balances.get(self.base, 0.0) + 1e-8):
+            raise api_error(-2010, 'Account has insufficient balance for requested action.')
+        self.orderIds += 1
+        order = {
+            'symbol': symbol, 'orderId': self.orderIds, 'clientOrderId': newClientOrderId or f"paper{self.orderIds}",
+            'transactTime': now, 'side': side, 'type': type,
+            'price': f"{float(price or 0):.8f}", 'origQty': f"{quantity:.8f}",
+            'executedQty': '0.00000000', 'cummulativeQuoteQty': '0.00000000', 'status': 'NEW',
+        }
+        self.orders[order['orderId']] = order
+        if type == 'MARKET':
+            self._fill(order, ask if side == 'BUY' else bid)
+        elif (side == 'BUY' and float(price) >= ask) or (side == 'SELL' and float(price) <= bid):
+            # Marketable, takes the book at once
+            self._fill(order, float(price))
+        else:
+            self.open.append(order)
+        return dict(order)
+
+    # The python-binance calls the bot makes
+
+    def get_server_time(self):
+        return {'serverTime': self._now()}
+
+    def get_klines(self, symbol, interval, limit=500, startTime=None, **params):
+        self._now()
+        return self.recording.klines(symbol, interval, limit, startTime)
+
+    def get_orderbook_ticker(self, symbol):
+        self._now()
+        bid, ask = self.recording.prices(symbol)
+        return {'symbol': symbol, 'bidPrice': f"{bid:.8f}", 'askPrice': f"{ask:.8f}"}
+
+    def get_symbol_ticker(self, symbol):
+        bid, ask = self.recording.prices(symbol)
+        return {'symbol': symbol, 'price': f"{ask:.8f}"}
+
+    def get_exchange_info(self):
+        return {'symbols': [{'symbol': symbol, 'filters': filters}
+                            for symbol, filters in self.recording.filters.items()]}
+
+    def get_symbol_info(self, symbol):
+        return {'symbol': symbol, 'filters': self.recording.filters.get(symbol, DEFAULT_FILTERS)}
+
+    def get_account(self):
+        self._now()
+        return {'balances': [{'asset': asset, 'free': f"{free:.8f}", 'locked': '0.00000000'}
+                             for asset, free in self.balances.items()]}
+
+    def order_market_buy(self, symbol, quantity, **params):
+        return self._order(symbol, 'BUY', 'MARKET', quantity, **params)
+
+    def order_market_sell(self, symbol, quantity, **params):
+        return self._order(symbol, 'SELL', 'MARKET', quantity, **params)
+
+    def order_limit_buy(self, symbol, quantity, price, **params):
+        return self._order(symbol, 'BUY', 'LIMIT', quantity, price, **params)
+
+    def order_limit_sell(self, symbol, quantity, price, **params):
+        return self._order(symbol, 'SELL', 'LIMIT', quantity, price, **params)
+
+    def get_order(self, symbol, orderId=None, origClientOrderId=None, **params):
+        self._now()
+        if orderId is None:
+            orderId = next((o['orderId'] for o in self.orders.values()
+                            if o['clientOrderId'] == origClientOrderId), None)
+        if orderId not in self.orders:
+            raise api_error(-2013, 'Order does not exist.')
+        return dict(self.orders[orderId])
+
+    def cancel_order(self, symbol, orderId, **params):
+        self._now()
+        order = self.orders.get(orderId)
+        if order is None or order['status'] != 'NEW':
+            raise api_error(-2011, 'Unknown order sent.')
+        order['status'] = 'CANCELED'
+        self.open.remove(order)
+        return dict(order)
+
+    def value(self):
+        '''
+        Balances valued in the quote asset at the last bid
+        '''
+        bid, ask = self.recording.prices(self.base + self.quote)
+        return self.balances.get(self.quote, 0.0) + self.balances.get(self.base, 0.0) * bid
+
+
+def paper_settings(recorded, conf=settings):
+    '''
+    Apply the recorded trade settings and turn off everything that needs the exchange
+    '''
+    for name, value in recorded.items():
+        setattr(conf, name, value)
+    # Orders go to the fill engine
+    conf.notification_only = 0
+    conf.telegram_token = ''
+    conf.async_fetch = 0
+    conf.order_book = 0
+    conf.user_data_stream = 0
+    conf.kline_cache_dir = ''
+    conf.state_dir = ''
+    conf.record_dir = ''
+
+
+def replay(records, speed=0, cash=None, fee=FEE, use_env=False, conf=settings):
+    '''
+    Run the polling loop over recorded market data on a virtual clock, returning the paper exchange
+    '''
+    from bot import TradeState, tick
+    from scheduler import CandleScheduler, conf_intervals
+
+    recording = Recording(records)
+    paper_settings({} if use_env else recording.settings, conf)
+    # The order retries sleep a random while
+    random.seed(0)
+    virtual = clock.VirtualClock(recording.start / 1000, speed)
+    clock.use(virtual)
+    balances = None if cash is None else {conf.trade_coin: cash}
+    exchange = PaperExchange(recording, conf.trade_crypto, conf.trade_coin, balances, fee)
+    state = TradeState()
+    scheduler = CandleScheduler(exchange, conf_intervals(conf), conf.trade_evaluate_interval)
+    closed = set() if conf.trade_evaluate_interval else set(conf_intervals(conf))
+    while virtual.time() * 1000 <= recording.end:
+        try:
+            tick(exchange, state, conf, closed=closed)
+        except Exception:
+            print('Error while trading...\n{}\n'.format(traceback.format_exc()))
+        closed = scheduler.wait()
+    return exchange
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Paper trade the bot over market data recorded with RECORD_DIR')
+    parser.add_argument('path', help='recording directory')
+    parser.add_argument('--speed', type=float, default=0,
+                        help='times real time, e.g. 1000; 0 (default) replays as fast as possible')
+    parser.add_argument('--cash', type=float, help='start with this quote balance instead of the recorded ones')
+    parser.add_argument('--fee', type=float, default=FEE)
+    parser.add_argument('--env', action='store_true',
+                        help='trade with the settings of the environment instead of the recorded ones')
+    parser.add_argument('--quiet', action='store_true', help='only print the fills and the result')
+    args = parser.parse_args()
+
+    records = list(read(args.path))
+    if not records:
+        raise SystemExit(f"Nothing recorded in {args.path}")
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()) if args.quiet else contextlib.nullcontext():
+        exchange = replay(records, args.speed, args.cash, args.fee, args.env)
+    elapsed = time.perf_counter() - start
+
+    for t, side, quantity, price in exchange.fills:
+        when = datetime.datetime.fromtimestamp(t / 1000, datetime.timezone.utc)
+        print(f"{when:%Y-%m-%d %H:%M:%S} {side} {quantity} at {price}")
+    span = (exchange.recording.end - exchange.recording.start) / 1000
+    print(f"Replayed {span / 3600:.1f}h of {len(records)} records in {elapsed:.2f}s "
+          f"({span / max(elapsed, 1e-9):.0f}x real time)")
+    print(f"Fills: {len(exchange.fills)} - Balances: "
+          + ', '.join(f"{asset} {free:.8f}" for asset, free in exchange.balances.items())
+          + f" - Value: {exchange.value():.2f} {settings.trade_coin}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import asyncio
+import json
+import random
+import time
+
+import websockets
+
+from candles import INTERVAL_MS
+
+
+def synthetic_klines(interval, count, start=1600000000000, price=30000.0, seed=1):
+    '''
+    Random walk klines in get_klines row format
+    '''
+    rng = random.Random(seed)
+    step = INTERVAL_MS[interval]
+    klines = []
+    for i in range(count):
+        o = price
+        c = max(o * (1 + rng.gauss(0, 0.002)), 0.01)
+        h = max(o, c) * (1 + abs(rng.gauss(0, 0.001)))
+        l = min(o, c) * (1 - abs(rng.gauss(0, 0.001)))
+        t = start + i * step
+        klines.append([t, f"{o:.8f}", f"{h:.8f}", f"{l:.8f}", f"{c:.8f}", "1.00000000",
+                       t + step - 1, "0", 1, "0", "0", "0"])
+        price = c
+    return klines
+
+
+def kline_event(symbol, interval, kline, closed):
+    '''
+    Wrap a get_klines row as a combined kline stream message
+    '''
+    return json.dumps({'stream': f"{symbol.lower()}@kline_{interval}", 'data': {
+        'e': 'kline', 'E': kline[6], 's': symbol, 'k': {
+            't': kline[0], 'T': kline[6], 's': symbol, 'i': interval,
+            'o': kline[1], 'c': kline[4], 'h': kline[2], 'l': kline[3],
+            'v': kline[5], 'n': kline[8], 'x': closed, 'q': kline[7],
+            'V': kline[9], 'Q': kline[10], 'B': kline[11]}}})
+
+
+def book_ticker_event(symbol, price, update_id):
+    return json.dumps({'stream': f"{symbol.lower()}@bookTicker", 'data': {
+        'u': update_id, 's': symbol,
+        'b': f"{price * 0.9999:.8f}", 'B': "1.00000000",
+        'a': f"{price * 1.0001:.8f}", 'A': "1.00000000"}})
+
+
+def synthetic_events(symbol, interval, klines, ticks_per_candle=4):
+    '''
+    Replay klines as intra-candle updates interleaved with book tickers
+    '''
+    messages = []
+    for kline in klines:
+        o, c = float(kline[1]), float(kline[4])
+        for tick in range(1, ticks_per_candle + 1):
+            price = o + (c - o) * tick / ticks_per_candle
+            partial = list(kline)
+            partial[4] = f"{price:.8f}"
+            messages.append(book_ticker_event(symbol, price, len(messages)))
+            messages.append(kline_event(
+                symbol, interval, partial, tick == ticks_per_candle))
+    return messages
+
+
+def load_messages(path):
+    '''
+    Load recorded combined stream messages, one JSON document per line
+    '''
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+class ReplayServer:
+    '''
+    Local WebSocket server that sends recorded messages to each client
+    '''
+
+    def __init__(self, messages, host='127.0.0.1', port=0, delay=0):
+        self.messages = messages
+        self.host = host
+        self.port = port
+        self.delay = delay
+        self.sent = []
+        self.server = None
+
+    async def handler(self, connection):
+        for message in self.messages:
+            self.sent.append(time.perf_counter())
+            await connection.send(message)
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            else:
+                # Let the consumer drain the message before the next one
+                await asyncio.sleep(0)
+
+    @property
+    def url(self):
+        return f"ws://{self.host}:{self.port}"
+
+    async def __aenter__(self):
+        self.server = await websockets.serve(self.handler, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+class ReplayClient:
+    '''
+    Offline stand-in for the REST calls the stream mode needs to seed candles
+    '''
+
+    def __init__(self, klines):
+        self.klines = klines
+
+    def get_klines(self, symbol, interval, limit=500, startTime=None):
+        klines = self.klines[interval]
+        if startTime is not None:
+            return [k for k in klines if k[0] >= startTime][:limit]
+        return klines[-limit:]
+
+    def get_orderbook_ticker(self, symbol):
+        price = float(self.klines[next(iter(self.klines))][-1][4])
+        return {'askPrice': f"{price:.8f}", 'bidPrice': f"{price:.8f}"}
+
+    def get_exchange_info(self):
+        return {'symbols': []}
+
+    def get_symbol_info(self, symbol):
+        return {'symbol': symbol, 'filters': [
+            {'filterType': 'LOT_SIZE', 'minQty': '0.00001000',
+             'maxQty': '9000.00000000', 'stepSize': '0.00001000'}]}
+
+    def get_account(self):
+        return {'balances': [{'asset': 'BTC', 'free': '1.00000000', 'locked': '0.00000000'},
+                             {'asset': 'BUSD', 'free': '1000.00000000', 'locked': '0.00000000'}]}
@@ -0,0 +1,72 @@
+import clock
+from candles import next_open
+
+# Seconds after a boundary before polling, so the exchange has opened the new candle
+CLOSE_GRACE = 0.25
+# How often the offset to the exchange clock is measured again
+CLOCK_SYNC_INTERVAL = 3600
+
+
+def conf_intervals(conf):
+    '''
+    Intervals whose closes the settings' strategy reacts to
+    '''
+    intervals = [conf.trade_time_frame]
+    if conf.trade_upper_stoch_validator:
+        intervals.append(conf.trade_upper_stoch_validator_value)
+    return intervals
+
+
+class CandleScheduler:
+    '''
+    Sleep until the next candle closes on any of the intervals, on the exchange clock
+
+    With every > 0 it also wakes every that many seconds in between, for
+    strategies that evaluate the open candle.
+    '''
+
+    def __init__(self, client, intervals, every=0, grace=CLOSE_GRACE):
+        self.client = client
+        self.intervals = set(intervals)
+        self.every = every
+        self.grace = grace
+        self.offset = 0.0
+        self.synced = None
+
+    def sync(self):
+        '''
+        Measure how far the exchange clock is ahead of ours
+        '''
+        before = clock.time()
+        serverTime = self.client.get_server_time()['serverTime'] / 1000
+        after = clock.time()
+        # The server read its clock about halfway through the round trip
+        self.offset = serverTime - (before + after) / 2
+        self.synced = after
+
+    def now(self):
+        return clock.time() + self.offset
+
+    def boundary(self, interval, now):
+        '''
+        Exchange time at which the candle open at now closes
+        '''
+        return next_open(interval, now * 1000) / 1000
+
+    def wait(self):
+        '''
+        Sleep until the next wake up, returning the intervals whose candle just
+        closed, empty when woken in between closes
+        '''
+        if self.synced is None or clock.time() - self.synced > CLOCK_SYNC_INTERVAL:
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"Could not read the exchange clock: {e}")
+        now = self.now()
+        closes = {interval: self.boundary(interval, now) for interval in self.intervals}
+        wake = min(closes.values()) + self.grace
+        if self.every:
+            wake = min(wake, (now // self.every + 1) * self.every)
+        clock.sleep(max(0.0, wake - self.now()))
+        return {interval for interval, close in closes.items() if close + self.grace <= wake}
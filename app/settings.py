@@ -1,39 +1,95 @@
-from os import mkfifo, getenv
+import json
+from os import environ
+from types import SimpleNamespace
 
-api_key = getenv('BINANCE_APIKEY', '')
-api_secret = getenv('BINANCE_SECRET_KEY', '')
-tld = "com"
 
-telegram_token = getenv('TELEGRAM_TOKEN', '')
-telegram_chat_id = getenv('TELEGRAM_CHAT_ID', '')
+def load(env=environ):
+    '''
+    Read the settings from an environment mapping
+    '''
+    getenv = env.get
+    conf = SimpleNamespace()
 
-trade_coin = getenv('TRADE_COIN', 'BUSD')
-trade_limit_coin_balance = getenv('TRADE_COIN_LIMIT_BALANCE')
-trade_crypto = getenv('TRADE_CRYPTO', 'BTC')
-trade_time_frame = getenv('TRADE_TIME_FRAME', "15m")
-trade_market = getenv('TRADE_MARKET', 0)
+    conf.api_key = getenv('BINANCE_APIKEY', '')
+    conf.api_secret = getenv('BINANCE_SECRET_KEY', '')
+    conf.tld = "com"
 
-trade_rsi_ifr = int(getenv('TRADE_RSI_IFR', 14))
-trade_rsi_stochastic = int(getenv('TRADE_RSI_STOCH', 14))
-trade_rsi_k = int(getenv('TRADE_RSI_K', 3))
-trade_rsi_d = int(getenv('TRADE_RSI_D', 3))
-trade_stochrsi_base_candle_qtd = int(getenv('TRADE_STOCHRSI_CROSS_CANDLE_QTD', 2))
+    conf.telegram_token = getenv('TELEGRAM_TOKEN', '')
+    conf.telegram_chat_id = getenv('TELEGRAM_CHAT_ID', '')
+    conf.telegram_dedupe_window = int(getenv('TELEGRAM_DEDUPE_WINDOW', 60))
 
-trade_ema_cross = int(getenv('TRADE_EMA_CROSS', 0))
-trade_ema_low = int(getenv('TRADE_EMA_LOW', 2))
-trade_ema_high = int(getenv('TRADE_EMA_HIGH', 4))
+    conf.trade_coin = getenv('TRADE_COIN', 'BUSD')
+    conf.trade_limit_coin_balance = getenv('TRADE_COIN_LIMIT_BALANCE')
+    conf.trade_crypto = getenv('TRADE_CRYPTO', 'BTC')
+    conf.trade_time_frame = getenv('TRADE_TIME_FRAME', "15m")
+    conf.trade_market = getenv('TRADE_MARKET', 0)
 
-trade_ema_base_candle = int(getenv('TRADE_EMA_BASE_CANDLE', 0))
-trade_ema_base_candle_value = int(getenv('TRADE_EMA_BASE_CANDLE_VALUE', 8))
-trade_ema_base_candle_qtd = int(getenv('TRADE_EMA_BASE_CANDLE_QTD', 2))
+    conf.trade_rsi_ifr = int(getenv('TRADE_RSI_IFR', 14))
+    conf.trade_rsi_stochastic = int(getenv('TRADE_RSI_STOCH', 14))
+    conf.trade_rsi_k = int(getenv('TRADE_RSI_K', 3))
+    conf.trade_rsi_d = int(getenv('TRADE_RSI_D', 3))
+    conf.trade_stochrsi_base_candle_qtd = int(getenv('TRADE_STOCHRSI_CROSS_CANDLE_QTD', 2))
 
-trade_wma_cross = int(getenv('TRADE_WMA_CROSS', 0))
-trade_wma_low = int(getenv('TRADE_WMA_LOW', 2))
-trade_wma_middle = int(getenv('TRADE_WMA_MIDDLE', 10))
-trade_wma_high = int(getenv('TRADE_WMA_HIGH', 11))
-trade_wma_cross_candle_qtd = int(getenv('TRADE_WMA_CROSS_CANDLE_QTD', 2))
+    conf.trade_ema_cross = int(getenv('TRADE_EMA_CROSS', 0))
+    conf.trade_ema_low = int(getenv('TRADE_EMA_LOW', 2))
+    conf.trade_ema_high = int(getenv('TRADE_EMA_HIGH', 4))
 
-trade_upper_stoch_validator = int(getenv('TRADE_TIME_FRAME_UPPER_VALIDATOR', 0))
-trade_upper_stoch_validator_value = getenv('TRADE_TIME_FRAME_UPPER_VALIDATOR_VALUE', "1h")
+    conf.trade_ema_base_candle = int(getenv('TRADE_EMA_BASE_CANDLE', 0))
+    conf.trade_ema_base_candle_value = int(getenv('TRADE_EMA_BASE_CANDLE_VALUE', 8))
+    conf.trade_ema_base_candle_qtd = int(getenv('TRADE_EMA_BASE_CANDLE_QTD', 2))
 
-notification_only = getenv('NOTIFICATION_ONLY', 1)
+    conf.trade_wma_cross = int(getenv('TRADE_WMA_CROSS', 0))
+    conf.trade_wma_low = int(getenv('TRADE_WMA_LOW', 2))
+    conf.trade_wma_middle = int(getenv('TRADE_WMA_MIDDLE', 10))
+    conf.trade_wma_high = int(getenv('TRADE_WMA_HIGH', 11))
+    conf.trade_wma_cross_candle_qtd = int(getenv('TRADE_WMA_CROSS_CANDLE_QTD', 2))
+
+    conf.trade_upper_stoch_validator = int(getenv('TRADE_TIME_FRAME_UPPER_VALIDATOR', 0))
+    conf.trade_upper_stoch_validator_value = getenv('TRADE_TIME_FRAME_UPPER_VALIDATOR_VALUE', "1h")
+
+    conf.notification_only = getenv('NOTIFICATION_ONLY', 1)
+
+    # Seconds between evaluations of the open candle, 0 to only evaluate when a candle closes
+    conf.trade_evaluate_interval = float(getenv('TRADE_EVALUATE_INTERVAL', 0))
+
+    conf.trade_streaming = int(getenv('TRADE_STREAMING', 0))
+    conf.stream_url = getenv('STREAM_URL', f"wss://stream.binance.{conf.tld}:9443")
+    # REST base URL override, e.g. a local mock_exchange.py
+    conf.api_url = getenv('API_URL', '')
+
+    # Port of the /metrics endpoint, 0 to disable; sampling the stacks adds /profile
+    conf.metrics_port = int(getenv('METRICS_PORT', 0))
+    conf.profile_interval = float(getenv('PROFILE_INTERVAL', 0))
+
+    # JSON list of per-pair TRADE_* overrides, e.g. [{"TRADE_CRYPTO": "ETH"}]
+    conf.trade_pairs = json.loads(getenv('TRADE_PAIRS', '[]'))
+    conf.portfolio_workers = int(getenv('PORTFOLIO_WORKERS', 8))
+    conf.request_weight_limit = int(getenv('REQUEST_WEIGHT_LIMIT', 5000))
+    # Fetch the independent requests of a tick at once over a pooled aiohttp session
+    conf.async_fetch = int(getenv('ASYNC_FETCH', 1))
+    # Seconds before a REST request is abandoned
+    conf.request_timeout = float(getenv('REQUEST_TIMEOUT', 10))
+    # Directory of the on-disk kline store, empty to download the history on every start
+    conf.kline_cache_dir = getenv('KLINE_CACHE_DIR', '')
+    # Directory where the decision state and open orders are kept across restarts, empty to start fresh
+    conf.state_dir = getenv('STATE_DIR', '')
+    # Directory where the market data and account events the bot reads are recorded for replay.py, empty to not record
+    conf.record_dir = getenv('RECORD_DIR', '')
+    # Keep a local order book of every traded symbol from the depth stream, for pricing without a request
+    conf.order_book = int(getenv('ORDER_BOOK', 0))
+    conf.exchange_info_ttl = int(getenv('EXCHANGE_INFO_TTL', 3600))
+    conf.user_data_stream = int(getenv('USER_DATA_STREAM', 1))
+    # Seconds before an unfilled limit order is cancelled, 0 waits forever
+    conf.order_stale_timeout = int(getenv('ORDER_STALE_TIMEOUT', 60))
+
+    return conf
+
+
+def pair_settings(overrides):
+    '''
+    Settings of one portfolio pair: the environment with its overrides applied
+    '''
+    return load({**environ, **{name: str(value) for name, value in overrides.items()}})
+
+
+globals().update(vars(load()))
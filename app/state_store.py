@@ -0,0 +1,118 @@
+import json
+import os
+import threading
+
+import settings
+
+# Journal entries written before the journal is folded into a new snapshot
+SNAPSHOT_EVERY = 1000
+
+
+class StateStore:
+    '''
+    Decision state and open orders that survive a restart
+
+    Every change is appended to a journal and flushed to disk before the call
+    returns; now and then the whole state is written to a snapshot (atomically,
+    through a rename) and the journal starts over. Loading reads the snapshot
+    and replays the journal, skipping a last line cut short by a crash.
+    '''
+
+    def __init__(self, path, snapshot_every=SNAPSHOT_EVERY):
+        self.path = path
+        self.snapshotPath = os.path.join(path, 'snapshot.json')
+        self.journalPath = os.path.join(path, 'journal.jsonl')
+        self.snapshot_every = snapshot_every
+        self.states = {}
+        self.orders = {}
+        self.entries = 0
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self.load()
+        self.journal = open(self.journalPath, 'a')
+
+    def load(self):
+        if os.path.exists(self.snapshotPath):
+            with open(self.snapshotPath) as f:
+                snapshot = json.load(f)
+            self.states = snapshot['states']
+            self.orders = snapshot['orders']
+        if os.path.exists(self.journalPath):
+            with open(self.journalPath, 'rb+') as f:
+                offset = 0
+                for line in f:
+                    try:
+                        self._apply(json.loads(line))
+                    except json.JSONDecodeError:
+                        print(f"Ignoring a torn state journal entry: {line!r}")
+                        # Drop it so new entries do not land on the same line
+                        f.truncate(offset)
+                        break
+                    offset += len(line)
+                    self.entries += 1
+
+    def _apply(self, entry):
+        if 'state' in entry:
+            self.states[entry['key']] = entry['state']
+        elif 'open' in entry:
+            self.orders[entry['open']] = entry['order']
+        elif 'closed' in entry:
+            self.orders.pop(entry['closed'], None)
+
+    def _append(self, entry):
+        with self.lock:
+            self._apply(entry)
+            self.journal.write(json.dumps(entry) + '\n')
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+            self.entries += 1
+            if self.entries >= self.snapshot_every:
+                self._snapshot()
+
+    def _snapshot(self):
+        temporary = self.snapshotPath + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump({'states': self.states, 'orders': self.orders}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.snapshotPath)
+        # The snapshot holds everything journaled so far
+        self.journal.close()
+        self.journal = open(self.journalPath, 'w')
+        self.entries = 0
+
+    def state(self, key):
+        return self.states.get(key)
+
+    def save_state(self, key, state):
+        '''
+        Record the state of key if it changed since it was last saved
+        '''
+        if self.states.get(key) != state:
+            self._append({'key': key, 'state': state})
+
+    def order_opened(self, order):
+        self._append({'open': f"{order['symbol']}:{order['orderId']}", 'order': order})
+
+    def order_closed(self, order):
+        self._append({'closed': f"{order['symbol']}:{order['orderId']}"})
+
+    def open_orders(self, symbol):
+        return [order for order in self.orders.values() if order['symbol'] == symbol]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_state_store():
+    '''
+    Get the process-wide state store, None when STATE_DIR is not set
+    '''
+    global _store
+    if not settings.state_dir:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = StateStore(settings.state_dir)
+        return _store
@@ -0,0 +1,222 @@
+import operator
+import threading
+
+import settings
+from indicators import EMA, WMA
+
+
+def _both(a, b):
+    return a and b
+
+
+class Node:
+    '''
+    A value of the newest candle: a reading, or computed from other nodes
+    '''
+
+    def __init__(self, name, compute=None, *inputs):
+        self.name = name
+        self.compute = compute
+        self.inputs = inputs
+
+
+class Frame:
+    '''
+    The node values of one candle, each computed once and only when a rule reads it
+    '''
+
+    def __init__(self, readings):
+        self.readings = readings
+        self.values = {}
+
+    def __getitem__(self, node):
+        if node.compute is None:
+            return self.readings[node.name]
+        if node not in self.values:
+            self.values[node] = node.compute(*(self[i] for i in node.inputs))
+        return self.values[node]
+
+
+class Confirmed:
+    '''
+    Validate a buy (sell) once the up (down) condition held on count candles in a row
+
+    A candle is counted once however many ticks see it. Reaching the count
+    sets the validator to the confirm node, True when there is none.
+    '''
+
+    def __init__(self, up, down, count, confirmUp=None, confirmDown=None, labels=()):
+        self.up = up
+        self.down = down
+        self.count = count
+        self.confirmUp = confirmUp
+        self.confirmDown = confirmDown
+        self.labels = labels
+
+    def apply(self, state, frame, lastClose):
+        if frame[self.up]:
+            if lastClose != state.lastCloseTradeUp:
+                state.lastCloseTradeUp = lastClose
+                state.lastCloseUpSUM += 1
+            if state.lastCloseUpSUM == self.count:
+                state.validateBuy = frame[self.confirmUp] if self.confirmUp else True
+                state.validateSell = False
+                state.lastCloseUpSUM = 0
+                state.lastCloseTradeUp = None
+        else:
+            state.validateBuy = False
+            state.lastCloseUpSUM = 0
+            state.lastCloseTradeUp = None
+        if frame[self.down]:
+            if lastClose != state.lastCloseTradeDown:
+                state.lastCloseTradeDown = lastClose
+                state.lastCloseDownSUM += 1
+            if state.lastCloseDownSUM == self.count:
+                state.validateSell = frame[self.confirmDown] if self.confirmDown else True
+                state.validateBuy = False
+                state.lastCloseDownSUM = 0
+                state.lastCloseTradeDown = None
+        else:
+            state.validateSell = False
+            state.lastCloseDownSUM = 0
+            state.lastCloseTradeDown = None
+
+
+class Crossed:
+    '''
+    Validate a buy (sell) on every tick the up (down) condition holds
+    '''
+
+    def __init__(self, up, down, labels=()):
+        self.up = up
+        self.down = down
+        self.labels = labels
+
+    def apply(self, state, frame, lastClose):
+        state.validateBuy = frame[self.up]
+        state.validateSell = frame[self.down]
+
+
+class Closes:
+    '''
+    Count the candles closing above (below) a level, validating once there are count in a row
+
+    The counts only move when a new candle is seen; after a validation the
+    current candle is counted again on the next tick.
+    '''
+
+    def __init__(self, above, below, count, confirmUp, confirmDown, labels=()):
+        self.above = above
+        self.below = below
+        self.count = count
+        self.confirmUp = confirmUp
+        self.confirmDown = confirmDown
+        self.labels = labels
+
+    def apply(self, state, frame, lastClose):
+        if lastClose != state.lastCloseTrade:
+            state.lastCloseTrade = lastClose
+            state.lastCloseUpSUM = state.lastCloseUpSUM + 1 if frame[self.above] else 0
+            state.lastCloseDownSUM = state.lastCloseDownSUM + 1 if frame[self.below] else 0
+        if state.lastCloseUpSUM == self.count:
+            state.validateBuy = frame[self.confirmUp]
+            state.validateSell = False
+            state.lastCloseUpSUM = 0
+            state.lastCloseTrade = None
+        if state.lastCloseDownSUM == self.count:
+            state.validateSell = frame[self.confirmDown]
+            state.validateBuy = False
+            state.lastCloseDownSUM = 0
+            state.lastCloseTrade = None
+
+
+class Pipeline:
+    '''
+    The trading rules enabled in the settings, built once and applied to every candle
+
+    Rules read nodes: the indicator readings of the newest candle and
+    conditions derived from them, computed on first use. Enabled rules run
+    in order on the same TradeState and the last one gives the status line.
+    averages lists the moving averages the rules read, so the indicator
+    engine, compute_readings() and the backtest compute only those.
+    '''
+
+    def __init__(self, conf=settings):
+        close, K, D = Node('close'), Node('K'), Node('D')
+        stochUp = Node('stochUp', operator.gt, K, D)
+        stochDown = Node('stochDown', operator.lt, K, D)
+        if conf.trade_upper_stoch_validator:
+            upperUp = Node('upperUp', operator.gt, Node('K_upper'), Node('D_upper'))
+            stochUp = Node('stochUpperUp', _both, stochUp, upperUp)
+
+        self.averages = []
+        self.rules = []
+        if conf.trade_wma_cross:
+            low, middle, high = self._average('wmaLow', WMA, conf.trade_wma_low), \
+                self._average('wmaMiddle', WMA, conf.trade_wma_middle), \
+                self._average('wmaHigh', WMA, conf.trade_wma_high)
+            self.rules.append(Confirmed(
+                Node('wmaUp', operator.gt, low, middle), Node('wmaDown', operator.lt, low, high),
+                conf.trade_wma_cross_candle_qtd, stochUp, stochDown,
+                labels=[(f"WMA {conf.trade_wma_low}", low), (f"WMA {conf.trade_wma_middle}", middle),
+                        (f"WMA {conf.trade_wma_high}", high)]))
+        if conf.trade_ema_cross:
+            low = self._average('emaLow', EMA, conf.trade_ema_low)
+            high = self._average('emaHigh', EMA, conf.trade_ema_high)
+            self.rules.append(Crossed(
+                Node('emaBuy', _both, stochUp, Node('emaUp', operator.gt, low, high)),
+                Node('emaSell', _both, stochDown, Node('emaDown', operator.lt, low, high)),
+                labels=[(f"EMA {conf.trade_ema_low}", low), (f"EMA {conf.trade_ema_high}", high)]))
+        if conf.trade_ema_base_candle:
+            base = self._average('emaBaseClosed', EMA, conf.trade_ema_base_candle_value)
+            self.rules.append(Closes(
+                Node('aboveEmaBase', operator.gt, close, base),
+                Node('belowEmaBase', operator.lt, close, base),
+                conf.trade_ema_base_candle_qtd, stochUp, stochDown,
+                labels=[(f"EMA {conf.trade_ema_base_candle_value}", base)]))
+        if not self.rules:
+            labels = []
+            if conf.trade_upper_stoch_validator:
+                labels = [('Upper K%', Node('K_upper')), ('Upper D%', Node('D_upper'))]
+            self.rules.append(Confirmed(stochUp, stochDown, conf.trade_stochrsi_base_candle_qtd,
+                                        labels=labels))
+
+    def _average(self, name, kind, period):
+        self.averages.append((name, kind, period))
+        return Node(name)
+
+    def evaluate(self, state, readings):
+        '''
+        Update the trade validators from the newest readings and get the status line
+        '''
+        frame = Frame(readings)
+        statusMsg = (f"Price: {readings['close']} - RSI: {readings['rsi']} - "
+                     f"K%: {readings['K']} - D%: {readings['D']}")
+        lastClose = readings['timeend']
+        for rule in self.rules:
+            rule.apply(state, frame, lastClose)
+        return statusMsg + ''.join(f" - {label}: {frame[node]}" for label, node in self.rules[-1].labels)
+
+
+def pipeline_key(conf):
+    return (conf.trade_upper_stoch_validator, conf.trade_stochrsi_base_candle_qtd,
+            conf.trade_wma_cross, conf.trade_wma_low, conf.trade_wma_middle,
+            conf.trade_wma_high, conf.trade_wma_cross_candle_qtd,
+            conf.trade_ema_cross, conf.trade_ema_low, conf.trade_ema_high,
+            conf.trade_ema_base_candle, conf.trade_ema_base_candle_value,
+            conf.trade_ema_base_candle_qtd)
+
+
+_pipelines = {}
+_pipelinesLock = threading.Lock()
+
+
+def get_pipeline(conf=settings):
+    '''
+    Get the pipeline of the settings' rules, shared by settings with the same rules
+    '''
+    key = pipeline_key(conf)
+    with _pipelinesLock:
+        if key not in _pipelines:
+            _pipelines[key] = Pipeline(conf)
+        return _pipelines[key]
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import traceback
+
+import websockets
+
+import settings
+from bot import evaluate, notify_extremes, read_indicators, save_state, trade
+from candles import get_candle_store, get_upper_candles
+from metrics import inc, span
+from recorder import get_recorder
+
+
+def kline_from_event(k):
+    '''
+    Convert a kline stream payload into a get_klines row
+    '''
+    return [k['t'], k['o'], k['h'], k['l'], k['c'], k['v'],
+            k['T'], k['q'], k['n'], k['V'], k['Q'], k['B']]
+
+
+class StreamRunner:
+    '''
+    Evaluate the signal on kline and book ticker WebSocket events
+    '''
+
+    def __init__(self, client, state, url=None, on_decision=None):
+        self.client = client
+        self.state = state
+        self.url = url or settings.stream_url
+        self.on_decision = on_decision
+        self.symbol = f"{settings.trade_crypto}{settings.trade_coin}"
+        self.store = get_candle_store(client, self.symbol, settings.trade_time_frame)
+        # Built from the base candles, no stream of its own
+        self.upper = None
+        if settings.trade_upper_stoch_validator:
+            self.upper = get_upper_candles(client, self.symbol, settings.trade_time_frame,
+                                           settings.trade_upper_stoch_validator_value)
+        self.book = None
+
+    def streams(self):
+        name = self.symbol.lower()
+        return [f"{name}@kline_{settings.trade_time_frame}", f"{name}@bookTicker"]
+
+    def handle(self, message):
+        '''
+        Apply one combined stream message, returning True when the signal was evaluated
+        '''
+        data = json.loads(message)['data']
+        if data.get('e') == 'kline':
+            if data['k']['i'] != settings.trade_time_frame:
+                return False
+            self.store.merge([kline_from_event(data['k'])])
+            return True
+        if 'a' in data and 'b' in data:
+            # Keep the freshest prices so orders need no REST call
+            self.book = {'askPrice': data['a'], 'bidPrice': data['b']}
+        return False
+
+    async def decide(self):
+        candles = self.store.candles
+        candlesUpper = None
+        if self.upper and self.upper.resample:
+            candlesUpper = self.upper.update(candles)
+        elif self.upper:
+            # May download the upper candles when a base candle closed
+            candlesUpper = await asyncio.to_thread(self.upper.update, candles)
+        with span('decision'):
+            readings = read_indicators(self.symbol, candles, candlesUpper)
+            notify_extremes(readings, self.symbol)
+            statusMsg = evaluate(self.state, readings)
+        print(statusMsg)
+        if self.on_decision:
+            self.on_decision(self.state, readings)
+        if self.state.validateBuy or self.state.validateSell:
+            recorder = get_recorder()
+            if recorder and self.book:
+                recorder.book(self.symbol, self.book)
+            # Order placement blocks on REST, keep it off the event loop
+            await asyncio.to_thread(trade, self.client, self.state, readings, self.book)
+        save_state(self.state)
+
+    async def run(self, reconnect=True):
+        url = f"{self.url}/stream?streams={'/'.join(self.streams())}"
+        self.store.seed()
+        if self.upper:
+            self.upper.update(self.store.candles)
+        delay = 1
+        while True:
+            try:
+                async with websockets.connect(url) as ws:
+                    async for message in ws:
+                        delay = 1
+                        try:
+                            if self.handle(message):
+                                await self.decide()
+                        except Exception as e:
+                            inc('bot_exceptions_total', where='stream', type=type(e).__name__)
+                            print('Error while trading...\n{}\n'.format(
+                                traceback.format_exc()))
+                if not reconnect:
+                    return
+                print(f"Stream closed by the server. Reconnecting in {delay}s")
+            except (OSError, websockets.WebSocketException) as e:
+                if not reconnect:
+                    raise
+                print(f"Stream disconnected: {e}. Reconnecting in {delay}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+            # Catch up on candles missed while disconnected, over REST off the event loop
+            try:
+                await asyncio.to_thread(self.store.update)
+            except Exception as e:
+                print(f"Could not catch up on the candles: {e}")
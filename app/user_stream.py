@@ -0,0 +1,93 @@
+import asyncio
+import json
+import threading
+import traceback
+
+import websockets
+
+import settings
+from recorder import get_recorder
+
+# Binance closes a listen key after 60 minutes without keepalive
+KEEPALIVE_INTERVAL = 30 * 60
+
+
+class UserDataStream:
+    '''
+    Account and order events of the user data stream, read on a background thread
+    '''
+
+    def __init__(self, client, url=None):
+        self.client = client
+        self.url = url or settings.stream_url
+        self.listeners = []
+        self.connected = threading.Event()
+        # Incremented on every (re)connect, events may have been missed in between
+        self.generation = 0
+        self.thread = None
+
+    def subscribe(self, listener):
+        '''
+        Call listener(event) for every event, from the stream thread
+        '''
+        self.listeners.append(listener)
+
+    def dispatch(self, event):
+        for listener in self.listeners:
+            try:
+                listener(event)
+            except Exception:
+                print('Error in user data listener...\n{}\n'.format(traceback.format_exc()))
+
+    async def _keepalive(self, listenKey):
+        while True:
+            await asyncio.sleep(KEEPALIVE_INTERVAL)
+            await asyncio.to_thread(self.client.stream_keepalive, listenKey)
+
+    async def run(self, reconnect=True):
+        delay = 1
+        while True:
+            keepalive = None
+            try:
+                listenKey = await asyncio.to_thread(self.client.stream_get_listen_key)
+                async with websockets.connect(f"{self.url}/ws/{listenKey}") as ws:
+                    keepalive = asyncio.create_task(self._keepalive(listenKey))
+                    self.generation += 1
+                    self.connected.set()
+                    delay = 1
+                    async for message in ws:
+                        self.dispatch(json.loads(message))
+            except Exception as e:
+                print(f"User data stream disconnected: {e}. Reconnecting in {delay}s")
+            finally:
+                self.connected.clear()
+                if keepalive:
+                    keepalive.cancel()
+            if not reconnect:
+                return
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+
+    def start(self):
+        self.thread = threading.Thread(target=lambda: asyncio.run(self.run()), daemon=True)
+        self.thread.start()
+        return self
+
+
+_stream = None
+_stream_lock = threading.Lock()
+
+
+def get_user_stream(client):
+    '''
+    Get the process-wide user data stream, starting it on first use
+    '''
+    global _stream
+    with _stream_lock:
+        if _stream is None:
+            _stream = UserDataStream(client)
+            recorder = get_recorder()
+            if recorder:
+                _stream.subscribe(recorder.account)
+            _stream.start()
+        return _stream
@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+# The bot's modules import each other by their flat names, as when run from app/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+
+import clock  # noqa: E402
+
+
+@pytest.fixture
+def virtual_clock():
+    '''
+    A virtual clock for the duration of a test, so sleeps and backoffs take no time
+    '''
+    virtual = clock.VirtualClock(1_700_000_000)
+    clock.use(virtual)
+    yield virtual
+    clock.use(clock.RealClock())
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+import talib
+
+from batch_indicators import ema, stochrsi, wma
+from bot import Stoch
+
+TOLERANCE = 1e-6
+RSI, STOCH, SMOOTHK, SMOOTHD = 14, 14, 3, 3
+
+
+def closes(length=300):
+    '''
+    Random walks, with rows listed later, too short to warm up and without any candle
+    '''
+    rng = np.random.default_rng(0)
+    close = 30000 * np.exp(np.cumsum(rng.normal(0, 0.002, (5, length)), axis=1))
+    close[1, :length // 2] = np.nan
+    close[2, :length - 20] = np.nan
+    close[3, :length - 5] = np.nan
+    close[4] = np.nan
+    return close
+
+
+def expected(row):
+    row = row[~np.isnan(row)]
+    rsi = talib.RSI(row, RSI)
+    rsiSeries = pd.Series(rsi)
+    K, D = Stoch(rsiSeries, rsiSeries, rsiSeries, SMOOTHK, SMOOTHD, STOCH)
+    return {'rsi': rsi, 'K': K.to_numpy(), 'D': D.to_numpy(),
+            'ema': talib.EMA(row, 20), 'wma': talib.WMA(row, 10)}
+
+
+def assert_row(got, want):
+    # Padded with NaN up to the first candle of the row
+    assert np.isnan(got[:len(got) - len(want)]).all()
+    got = got[len(got) - len(want):]
+    assert (np.isnan(got) == np.isnan(want)).all()
+    both = ~np.isnan(want)
+    assert got[both] == pytest.approx(want[both], abs=TOLERANCE, rel=1e-9)
+
+
+def test_rows_match_talib_and_stoch():
+    close = closes()
+    rsi, K, D = stochrsi(close, RSI, STOCH, SMOOTHK, SMOOTHD)
+    batched = {'rsi': rsi, 'K': K, 'D': D, 'ema': ema(close, 20), 'wma': wma(close, 10)}
+    for i, row in enumerate(close):
+        for name, want in expected(row).items():
+            assert batched[name].shape == close.shape
+            assert_row(batched[name][i], want)
+    # The rows without enough candles are still warming up
+    assert np.isnan(K[2]).all() and np.isnan(rsi[3]).all() and np.isnan(ema(close, 20)[4]).all()
+
+
+def test_matrix_shorter_than_the_periods():
+    close = closes(8)
+    rsi, K, D = stochrsi(close, RSI, STOCH, SMOOTHK, SMOOTHD)
+    for values in (rsi, K, D, ema(close, 20), wma(close, 10)):
+        assert values.shape == close.shape and np.isnan(values).all()
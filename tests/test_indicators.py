@@ -0,0 +1,67 @@
+import math
+
+import pytest
+
+import settings
+from bot import compute_readings, read_indicators
+from indicators import IndicatorEngine
+from replay_server import synthetic_klines
+
+TOLERANCE = 1e-6
+
+
+@pytest.fixture
+def every_rule(monkeypatch):
+    '''
+    Every moving average a strategy can read, on the default periods
+    '''
+    for name in ('trade_wma_cross', 'trade_ema_cross', 'trade_ema_base_candle'):
+        monkeypatch.setattr(settings, name, 1)
+    monkeypatch.setattr(settings, 'trade_upper_stoch_validator', 0)
+
+
+def test_engine_matches_talib_and_stoch(every_rule):
+    klines = synthetic_klines('15m', 700, seed=7)
+    engine = IndicatorEngine(settings)
+    checked = 0
+    for i, kline in enumerate(klines):
+        # Revisions of the open candle before it closes, as the live feed sends
+        for tick in (1, 2, 3):
+            partial = list(kline)
+            partial[4] = f"{float(kline[1]) + (float(kline[4]) - float(kline[1])) * tick / 3:.8f}"
+            readings = engine.update(partial)
+        if i < 100 or i % 25:
+            continue
+        expected = compute_readings(klines[:i + 1])
+        for name, value in expected.items():
+            if name != 'timeend' and not math.isnan(value):
+                assert readings[name] == pytest.approx(value, abs=TOLERANCE), (i, name)
+        checked += 1
+    assert checked == 24
+
+
+def test_sync_feeds_only_new_candles(every_rule):
+    klines = synthetic_klines('15m', 600, seed=3)
+    engine = IndicatorEngine(settings)
+    engine.sync(klines[:550])
+    # The open candle seen last is applied again, then the newer ones
+    readings = engine.sync(klines[540:600])
+    expected = compute_readings(klines)
+    assert readings['K'] == pytest.approx(expected['K'], abs=TOLERANCE)
+    assert readings['rsi'] == pytest.approx(expected['rsi'], abs=TOLERANCE)
+
+
+def test_closed_reads_the_candle_that_just_closed(every_rule, virtual_clock):
+    klines = synthetic_klines('15m', 600, seed=5)
+    # The next candle opened a moment ago, the one before was read while still open
+    virtual_clock.now = (klines[-1][0] + 250) / 1000
+    partial = list(klines[-2])
+    partial[4] = partial[1]
+    read_indicators('CLOSEDBUSD', klines[:-2] + [partial])
+    readings = read_indicators('CLOSEDBUSD', klines, closed=True)
+    expected = compute_readings(klines[:-1])
+    assert readings['close'] == float(klines[-2][4])
+    assert readings['K'] == pytest.approx(expected['K'], abs=TOLERANCE)
+    assert readings['rsi'] == pytest.approx(expected['rsi'], abs=TOLERANCE)
+    # The open candle is read on the next evaluation in between
+    assert read_indicators('CLOSEDBUSD', klines)['close'] == float(klines[-1][4])
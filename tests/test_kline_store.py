@@ -0,0 +1,135 @@
+import numpy as np
+
+import settings
+from candles import CandleStore, INTERVAL_MS
+from kline_store import PAGE_LIMIT, KlineStore
+from replay_server import synthetic_klines
+
+STEP = INTERVAL_MS['1m']
+# Candles open on whole minutes, as on the exchange
+START = 1600000000000 // STEP * STEP
+
+
+class KlinesClient:
+    '''
+    get_klines over a fixed list of rows, recording the startTime of every request
+    '''
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.starts = []
+
+    def get_klines(self, symbol, interval, limit=500, startTime=None):
+        self.starts.append(startTime)
+        if startTime is None:
+            return self.rows[-limit:]
+        return [row for row in self.rows if row[0] >= startTime][:limit]
+
+
+def history(count, gaps=()):
+    '''
+    1m rows with the candles of gaps (index ranges) missing, the last one open on the virtual clock
+    '''
+    rows = synthetic_klines('1m', count, start=START)
+    for start, stop in sorted(gaps, reverse=True):
+        del rows[start:stop]
+    return rows
+
+
+def open_now(virtual_clock, rows):
+    virtual_clock.now = (rows[-1][0] + STEP / 2) / 1000
+
+
+def test_backfill_pages_and_keeps_open_candle_out(tmp_path, virtual_clock):
+    rows = history(2500)
+    open_now(virtual_clock, rows)
+    client = KlinesClient(rows)
+    store = KlineStore(str(tmp_path), 'BTCBUSD', '1m')
+
+    open_klines = store.backfill(client, rows[0][0])
+    assert open_klines == [rows[-1]]
+    assert len(store) == 2499
+    assert client.starts == [rows[0][0], rows[PAGE_LIMIT][0], rows[2 * PAGE_LIMIT][0]]
+    assert store.read()['open_time'].tolist() == [row[0] for row in rows[:-1]]
+    assert store.rows(2)[-1][:7] == [rows[-2][0], *map(float, rows[-2][1:6]), rows[-2][6]]
+
+    # Only the candles after the last one stored are asked for again
+    client.starts.clear()
+    assert store.backfill(client) == [rows[-1]]
+    assert client.starts == [rows[-1][0]]
+
+
+def test_torn_append_is_cut_back(tmp_path):
+    rows = history(10)
+    store = KlineStore(str(tmp_path), 'BTCBUSD', '1m')
+    assert store.append(rows[:5], now=rows[-1][6] + 1) == 5
+    # A crash after writing some of the fields of the next candles
+    with open(store._file('open_time'), 'ab') as f:
+        f.write(np.array([rows[5][0], rows[6][0]], dtype='<i8').tobytes())
+    with open(store._file('close'), 'ab') as f:
+        f.write(b'\0\0\0')
+
+    store = KlineStore(str(tmp_path), 'BTCBUSD', '1m')
+    assert len(store) == 5
+    assert store.last_open_time() == rows[4][0]
+    assert store.append(rows[5:], now=rows[-1][6] + 1) == 5
+    assert store.read()['open_time'].tolist() == [row[0] for row in rows]
+
+
+def test_exchange_gap_is_stored_and_not_downloaded_again(tmp_path, virtual_clock):
+    # No candles for ten minutes, as during a maintenance window
+    rows = history(1500, gaps=[(1200, 1210)])
+    open_now(virtual_clock, rows)
+    client = KlinesClient(rows)
+    store = KlineStore(str(tmp_path), 'BTCBUSD', '1m')
+    store.append(rows[:1200], now=rows[-1][0])
+
+    store.backfill(client)
+    assert len(store) == len(rows) - 1
+    client.starts.clear()
+    store.backfill(client)
+    assert client.starts == [rows[-1][0]]
+
+
+def test_live_candles_after_missing_ones_are_refused(tmp_path):
+    rows = history(20)
+    store = KlineStore(str(tmp_path), 'BTCBUSD', '1m')
+    store.append(rows[:10], now=rows[-1][6] + 1)
+    assert store.append(rows[12:15], now=rows[-1][6] + 1) == 0
+    assert len(store) == 10
+    assert store.append(rows[10:15], now=rows[-1][6] + 1) == 5
+
+
+def seeded(tmp_path, monkeypatch, rows, stored):
+    monkeypatch.setattr(settings, 'kline_cache_dir', str(tmp_path))
+    monkeypatch.setattr(settings, 'record_dir', '')
+    KlineStore(str(tmp_path), 'BTCBUSD', '1m').append(rows[:stored], now=rows[-1][0])
+    client = KlinesClient(rows)
+    store = CandleStore(client, 'BTCBUSD', '1m')
+    store.seed()
+    return store, client
+
+
+def assert_window(candles, rows):
+    assert len(candles) == 500
+    assert candles.open_time.tolist() == [row[0] for row in rows[-500:]]
+    assert candles[-1][0] == rows[-1][0]
+
+
+def test_seed_from_store_is_continuous(tmp_path, monkeypatch, virtual_clock):
+    rows = history(1500)
+    open_now(virtual_clock, rows)
+    store, client = seeded(tmp_path, monkeypatch, rows, 1450)
+    assert_window(store.candles, rows)
+    assert np.all(np.diff(store.candles.open_time) == STEP)
+    # Only what the kline store missed was downloaded
+    assert client.starts == [rows[1450][0]]
+
+
+def test_seed_falls_back_when_the_store_does_not_reach_the_open_candle(tmp_path, monkeypatch, virtual_clock):
+    # The exchange has no candles just before the open one
+    rows = history(1500, gaps=[(1495, 1499)])
+    open_now(virtual_clock, rows)
+    store, client = seeded(tmp_path, monkeypatch, rows, 1450)
+    assert_window(store.candles, rows)
+    assert client.starts[-1] is None
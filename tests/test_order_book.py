@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from order_book import OrderBook
+
+
+class SnapshotClient:
+    def __init__(self, *snapshots):
+        self.snapshots = list(snapshots)
+        self.calls = 0
+
+    def get_order_book(self, symbol, limit):
+        self.calls += 1
+        return self.snapshots.pop(0)
+
+
+def snapshot(lastUpdateId, bids, asks):
+    return {'lastUpdateId': lastUpdateId,
+            'bids': [[p, q] for p, q in bids.items()], 'asks': [[p, q] for p, q in asks.items()]}
+
+
+def event(U, u, bids=None, asks=None):
+    return {'U': U, 'u': u, 'b': [[p, q] for p, q in (bids or {}).items()],
+            'a': [[p, q] for p, q in (asks or {}).items()]}
+
+
+def follow(book, events):
+    async def run():
+        queue = asyncio.Queue()
+        for e in events:
+            queue.put_nowait(e)
+        return await book._follow(queue)
+    return asyncio.run(run())
+
+
+def test_gap_in_update_ids_ends_the_book_and_a_new_snapshot_rebuilds_it():
+    client = SnapshotClient(
+        snapshot(100, {'10': '1', '9': '1'}, {'12': '1'}),
+        snapshot(110, {'8': '3'}, {'13': '1'}))
+    book = OrderBook(client, 'BTCBUSD', url='ws://unused')
+
+    # 101 straddles the snapshot, 103 follows on, 107 skips 104 to 106
+    follow(book, [event(99, 101, bids={'10': '0'}), event(102, 103, bids={'11': '2'}),
+                  event(106, 107, asks={'14': '1'})])
+    assert book.bids == {9.0: 1.0, 11.0: 2.0}
+    assert 14.0 not in book.asks
+    assert book.lastUpdateId == 103
+    assert book.ticker()['bidPrice'] == 11.0
+
+    book.synced.clear()
+    assert book.ticker() is None
+    # Rebuilt from a new snapshot; events it already holds are skipped
+    with pytest.raises(ConnectionError):
+        follow(book, [event(108, 109, bids={'7': '1'}), event(110, 111, asks={'12.5': '2'}), None])
+    assert client.calls == 2
+    assert book.bids == {8.0: 3.0}
+    assert book.asks == {12.5: 2.0, 13.0: 1.0}
+    assert book.lastUpdateId == 111
+    assert book.best_ask() == 12.5
+
+
+def test_snapshot_older_than_the_first_event_is_fetched_again():
+    client = SnapshotClient(snapshot(90, {'10': '1'}, {'12': '1'}),
+                            snapshot(100, {'10': '2'}, {'12': '1'}))
+    book = OrderBook(client, 'BTCBUSD', url='ws://unused')
+    follow(book, [event(95, 101, asks={'11': '1'}), event(103, 104)])
+    assert client.calls == 2
+    assert book.bids == {10.0: 2.0}
+    assert book.best_ask() == 11.0
+    assert book.fill_price('BUY', 1.5) == pytest.approx((11 + 0.5 * 12) / 1.5)
@@ -0,0 +1,163 @@
+import threading
+
+import requests
+
+import account
+import bot
+import orders
+import settings
+from account import AccountService
+from orders import OrderManager
+from replay import api_error
+
+
+class FakeStream:
+    def __init__(self, connected=True):
+        self.connected = threading.Event()
+        if connected:
+            self.connected.set()
+        self.generation = 1
+        self.listeners = []
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+
+class FakeClient:
+    '''
+    Answers get_order from a list of responses, an exception in it is raised once
+    '''
+
+    def __init__(self, responses=()):
+        self.responses = list(responses)
+        self.placed = []
+        self.cancelled = []
+        self.polls = 0
+        self.bought = 0.0
+
+    def order_market_buy(self, symbol, quantity, newClientOrderId=None):
+        self.placed.append((symbol, quantity))
+        return order(len(self.placed), 'NEW', type='MARKET')
+
+    def get_order(self, symbol, orderId=None, origClientOrderId=None):
+        self.polls += 1
+        response = self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+        if isinstance(response, Exception):
+            raise response
+        if response['status'] == 'FILLED':
+            self.bought = float(response['executedQty'])
+        return response
+
+    def get_account(self):
+        return {'balances': [{'asset': 'BTC', 'free': str(self.bought), 'locked': '0'}]}
+
+    def cancel_order(self, symbol, orderId):
+        self.cancelled.append(orderId)
+        self.responses = [order(orderId, 'CANCELED', executedQty='0.5')]
+
+
+def order(orderId, status, type='LIMIT', executedQty='0'):
+    return {'symbol': 'BTCBUSD', 'orderId': orderId, 'clientOrderId': f"c{orderId}",
+            'side': 'BUY', 'type': type, 'price': '100', 'origQty': '1',
+            'executedQty': executedQty, 'cummulativeQuoteQty': '0', 'status': status}
+
+
+def report(orderId, status):
+    return {'e': 'executionReport', 's': 'BTCBUSD', 'i': orderId, 'c': f"c{orderId}", 'S': 'BUY',
+            'o': 'LIMIT', 'p': '100', 'q': '1', 'z': '1', 'Z': '100', 'X': status}
+
+
+def test_report_before_placement_returns(virtual_clock):
+    stream = FakeStream()
+    client = FakeClient()
+    manager = OrderManager(client, stream)
+    # The fill is streamed before the placement call has returned
+    stream.listeners[0](report(7, 'FILLED'))
+    assert manager.wait(order(7, 'NEW'))['status'] == 'FILLED'
+    assert client.polls == 0
+    assert not manager.orders and not manager.early
+
+
+def test_polls_while_stream_is_down(virtual_clock):
+    client = FakeClient([order(1, 'NEW'), order(1, 'NEW'), order(1, 'FILLED')])
+    manager = OrderManager(client, FakeStream(connected=False))
+    assert manager.wait(order(1, 'NEW'))['status'] == 'FILLED'
+    assert client.polls == 3
+
+
+def test_stale_order_is_cancelled(virtual_clock):
+    client = FakeClient([order(1, 'NEW')])
+    manager = OrderManager(client)
+    stat = manager.wait(order(1, 'NEW'), stale_after=30)
+    assert client.cancelled == [1]
+    assert stat['status'] == 'CANCELED' and stat['executedQty'] == '0.5'
+
+
+def test_transient_poll_error_keeps_waiting(virtual_clock):
+    client = FakeClient([requests.exceptions.ReadTimeout('timed out'), order(1, 'FILLED')])
+    manager = OrderManager(client)
+    assert manager.wait(order(1, 'NEW'))['status'] == 'FILLED'
+
+
+def test_transient_poll_error_places_one_order(virtual_clock, monkeypatch):
+    client = FakeClient([requests.exceptions.ConnectionError('reset'), order(1, 'FILLED', executedQty='1')])
+    monkeypatch.setattr(orders, '_manager', OrderManager(client))
+    monkeypatch.setattr(account, '_service', AccountService(client))
+    monkeypatch.setattr(settings, 'state_dir', '')
+    monkeypatch.setattr(settings, 'telegram_token', '')
+    conf = settings.load({'TRADE_MARKET': '1'})
+    stat = bot.buy_alt(client, 'BUSD', 'BTC', 100.0, 1.0, conf)
+    assert stat['status'] == 'FILLED'
+    assert client.placed == [('BTCBUSD', 1.0)]
+
+
+class FlakyOrderClient(FakeClient):
+    '''
+    The first order fails with error, after being accepted when accepted is set
+    '''
+
+    def __init__(self, error, accepted):
+        super().__init__()
+        self.error = error
+        self.accepted = accepted
+        self.sent = []
+        self.lookups = []
+
+    def order_market_buy(self, symbol, quantity, newClientOrderId=None):
+        self.sent.append(newClientOrderId)
+        if len(self.sent) == 1:
+            if self.accepted:
+                self.placed.append((symbol, quantity))
+            raise self.error
+        self.placed.append((symbol, quantity))
+        return order(len(self.placed), 'NEW', type='MARKET')
+
+    def get_order(self, symbol, orderId=None, origClientOrderId=None):
+        self.lookups.append(origClientOrderId)
+        if not self.placed:
+            raise api_error(-2013, 'Order does not exist.')
+        return order(1, 'NEW', type='MARKET')
+
+
+def test_order_timed_out_but_accepted_is_not_sent_again(virtual_clock):
+    client = FlakyOrderClient(requests.exceptions.ReadTimeout('timed out'), accepted=True)
+    conf = settings.load({'TRADE_MARKET': '1'})
+    assert bot.place_order(client, 'BUY', 'BTCBUSD', 1.0, 100.0, conf)['orderId'] == 1
+    assert client.placed == [('BTCBUSD', 1.0)]
+    assert len(client.sent) == 1 and client.lookups == client.sent
+
+
+def test_order_lost_on_the_way_is_sent_again_with_the_same_id(virtual_clock):
+    client = FlakyOrderClient(requests.exceptions.ConnectionError('reset'), accepted=False)
+    conf = settings.load({'TRADE_MARKET': '1'})
+    assert bot.place_order(client, 'BUY', 'BTCBUSD', 1.0, 100.0, conf)['orderId'] == 1
+    assert client.placed == [('BTCBUSD', 1.0)]
+    assert client.lookups == client.sent[:1] and client.sent[0] == client.sent[1]
+
+
+def test_rejected_order_is_sent_again_without_lookup(virtual_clock):
+    client = FlakyOrderClient(api_error(-1021, 'Timestamp for this request is outside of the recvWindow.'),
+                              accepted=False)
+    conf = settings.load({'TRADE_MARKET': '1'})
+    assert bot.place_order(client, 'BUY', 'BTCBUSD', 1.0, 100.0, conf)['orderId'] == 1
+    assert len(client.sent) == 2 and not client.lookups
@@ -0,0 +1,52 @@
+import threading
+import time
+
+import pytest
+
+from mock_exchange import MockExchange
+from ratelimit import BACKOFF_BASE, RateLimiter, limit
+
+
+@pytest.fixture
+def exchange():
+    exchange = MockExchange()
+    exchange.add_symbol('BTCBUSD', '15m')
+    exchange.add_symbol('ETHBUSD', '15m')
+    exchange.start()
+    yield exchange
+    exchange.stop()
+
+
+def test_used_weight_is_read_from_each_response(exchange):
+    limiter = RateLimiter(1200)
+    used = []
+    limiter.update = used.append
+    client = limit(exchange.client(), limiter)
+
+    def fetch(symbol):
+        for _ in range(10):
+            client.get_klines(symbol=symbol, interval='15m', limit=5)
+
+    minute = int(time.time() // 60)
+    threads = [threading.Thread(target=fetch, args=(symbol,)) for symbol in ('BTCBUSD', 'ETHBUSD')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if int(time.time() // 60) != minute:
+        pytest.skip('the exchange started counting a new minute')
+    # One reading per response, each its own: the exchange counts 2 per klines request
+    assert sorted(used) == list(range(2, 42, 2))
+
+
+def test_backoff_grows_until_a_request_succeeds():
+    limiter = RateLimiter(1200)
+    first = limiter.penalize(429)
+    limiter.update(1200)
+    second = limiter.penalize(429)
+    assert limiter.bans == 2
+    # The second ban waits at least half of twice the base, jitter included
+    assert second >= BACKOFF_BASE * 2 * 0.5
+    limiter.succeeded()
+    assert limiter.bans == 0
+    assert first > 0
@@ -0,0 +1,28 @@
+import datetime
+
+from candles import next_open
+from scheduler import CandleScheduler
+
+
+def ms(*date):
+    return int(datetime.datetime(*date, tzinfo=datetime.timezone.utc).timestamp() * 1000)
+
+
+def test_next_open_fixed_intervals():
+    assert next_open('15m', ms(2024, 3, 5, 10, 7)) == ms(2024, 3, 5, 10, 15)
+    assert next_open('15m', ms(2024, 3, 5, 10, 15)) == ms(2024, 3, 5, 10, 30)
+    # Weekly candles open on Monday
+    assert next_open('1w', ms(2024, 3, 6)) == ms(2024, 3, 11)
+
+
+def test_next_open_calendar_months():
+    assert next_open('1M', ms(2024, 2, 1)) == ms(2024, 3, 1)
+    assert next_open('1M', ms(2024, 2, 29, 23, 59)) == ms(2024, 3, 1)
+    assert next_open('1M', ms(2024, 12, 15)) == ms(2025, 1, 1)
+
+
+def test_scheduler_wakes_on_month_close():
+    scheduler = CandleScheduler(None, ['1d', '1M'])
+    now = ms(2024, 4, 30, 12) / 1000
+    assert scheduler.boundary('1M', now) == ms(2024, 5, 1) / 1000
+    assert scheduler.boundary('1d', now) == ms(2024, 5, 1) / 1000
@@ -0,0 +1,65 @@
+import json
+
+from binance.exceptions import BinanceAPIException
+
+import bot
+import orders
+import settings
+import state_store
+from orders import OrderManager
+from state_store import StateStore
+
+
+def test_torn_journal_line_is_dropped(tmp_path):
+    store = StateStore(str(tmp_path))
+    store.save_state('BTCBUSD:15m', {'lastStatus': 1})
+    store.order_opened({'symbol': 'BTCBUSD', 'orderId': 1, 'status': 'NEW'})
+    store.journal.close()
+    # A crash in the middle of writing the next entry
+    with open(tmp_path / 'journal.jsonl', 'a') as f:
+        f.write('{"closed": "BTCBU')
+
+    store = StateStore(str(tmp_path))
+    assert store.state('BTCBUSD:15m') == {'lastStatus': 1}
+    assert [o['orderId'] for o in store.open_orders('BTCBUSD')] == [1]
+    store.save_state('BTCBUSD:15m', {'lastStatus': 2})
+    store.journal.close()
+    # The new entry starts on a line of its own
+    with open(tmp_path / 'journal.jsonl') as f:
+        assert [json.loads(line) for line in f][-1] == {'key': 'BTCBUSD:15m', 'state': {'lastStatus': 2}}
+    assert StateStore(str(tmp_path)).state('BTCBUSD:15m') == {'lastStatus': 2}
+
+
+def test_snapshot_keeps_state(tmp_path):
+    store = StateStore(str(tmp_path), snapshot_every=3)
+    for status in range(5):
+        store.save_state('BTCBUSD:15m', {'lastStatus': status})
+    store.journal.close()
+    assert (tmp_path / 'snapshot.json').exists()
+    assert StateStore(str(tmp_path)).state('BTCBUSD:15m') == {'lastStatus': 4}
+
+
+class UnknownOrderClient:
+    '''
+    An exchange that has never heard of the journaled order
+    '''
+
+    def get_order(self, symbol, orderId):
+        raise BinanceAPIException(None, 400, json.dumps({'code': -2013, 'msg': 'Order does not exist.'}))
+
+    def cancel_order(self, symbol, orderId):
+        raise BinanceAPIException(None, 400, json.dumps({'code': -2011, 'msg': 'Unknown order sent.'}))
+
+
+def test_restore_forgets_unknown_order(tmp_path, monkeypatch, virtual_clock):
+    store = StateStore(str(tmp_path))
+    store.order_opened({'symbol': 'BTCBUSD', 'orderId': 9, 'side': 'BUY', 'status': 'NEW'})
+    monkeypatch.setattr(state_store, '_store', store)
+    monkeypatch.setattr(settings, 'state_dir', str(tmp_path))
+    monkeypatch.setattr(orders, '_manager', OrderManager(UnknownOrderClient()))
+    conf = settings.load({'NOTIFICATION_ONLY': '1'})
+
+    start = virtual_clock.monotonic()
+    bot.restore_state(None, conf)
+    assert virtual_clock.monotonic() - start <= bot.SETTLE_TIMEOUT
+    assert store.open_orders('BTCBUSD') == []
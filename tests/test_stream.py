@@ -0,0 +1,100 @@
+import asyncio
+import threading
+
+import pytest
+
+import candles
+import indicators
+import settings
+import stream
+from bot import TradeState
+from replay_server import ReplayClient, ReplayServer, synthetic_events, synthetic_klines
+from stream import StreamRunner
+
+SYMBOL = 'BTCBUSD'
+
+
+@pytest.fixture
+def runner_conf(monkeypatch):
+    '''
+    Fresh candle stores and indicator engines, no orders and no upper validator
+    '''
+    monkeypatch.setattr(candles, '_stores', {})
+    monkeypatch.setattr(indicators, '_engines', {})
+    monkeypatch.setattr(settings, 'trade_crypto', 'BTC')
+    monkeypatch.setattr(settings, 'trade_coin', 'BUSD')
+    monkeypatch.setattr(settings, 'trade_time_frame', '15m')
+    monkeypatch.setattr(settings, 'trade_upper_stoch_validator', 0)
+    monkeypatch.setattr(settings, 'state_dir', '')
+    monkeypatch.setattr(settings, 'record_dir', '')
+    trades = []
+    monkeypatch.setattr(stream, 'trade', lambda *args: trades.append(args))
+    return trades
+
+
+class CatchUpClient(ReplayClient):
+    '''
+    Serves only the history until released, recording the threads requests come from
+    '''
+
+    def __init__(self, klines, history):
+        super().__init__({'15m': klines[:history]})
+        self.all = klines
+        self.threads = []
+
+    def release(self):
+        self.klines = {'15m': self.all}
+
+    def get_klines(self, *args, **kwargs):
+        self.threads.append(threading.current_thread())
+        return super().get_klines(*args, **kwargs)
+
+
+def test_decides_on_every_kline_event(runner_conf):
+    klines = synthetic_klines('15m', 520)
+    messages = synthetic_events(SYMBOL, '15m', klines[500:], ticks_per_candle=2)
+    decisions = []
+
+    async def run():
+        async with ReplayServer(messages) as server:
+            runner = StreamRunner(ReplayClient({'15m': klines[:500]}), TradeState(), url=server.url,
+                                  on_decision=lambda state, readings: decisions.append(readings))
+            await runner.run(reconnect=False)
+            return runner
+
+    runner = asyncio.run(run())
+    # A book ticker and a kline per tick, every kline evaluated
+    assert len(decisions) == len(messages) // 2
+    assert runner.store.candles[-1][0] == klines[-1][0]
+    assert decisions[-1]['close'] == round(float(klines[-1][4]), 8)
+    assert runner.book is not None
+
+
+def test_clean_close_backs_off_and_catches_up(runner_conf):
+    klines = synthetic_klines('15m', 520)
+    client = CatchUpClient(klines, 500)
+    messages = synthetic_events(SYMBOL, '15m', klines[500:505], ticks_per_candle=1)
+
+    async def newest(runner, kline):
+        while not runner.store.candles or runner.store.candles[-1][0] != kline[0]:
+            await asyncio.sleep(0.01)
+
+    async def run():
+        async with ReplayServer(messages) as server:
+            runner = StreamRunner(client, TradeState(), url=server.url)
+            task = asyncio.create_task(runner.run())
+            try:
+                # The server sends its messages and closes; the candles after are missed
+                await asyncio.wait_for(newest(runner, klines[504]), 10)
+                client.release()
+                requests = len(client.threads)
+                started = asyncio.get_running_loop().time()
+                await asyncio.wait_for(newest(runner, klines[-1]), 10)
+                return requests, asyncio.get_running_loop().time() - started
+            finally:
+                task.cancel()
+
+    requests, waited = asyncio.run(run())
+    # Not reconnected at once, and the catch-up ran off the event loop
+    assert waited >= 0.5
+    assert all(thread is not threading.main_thread() for thread in client.threads[requests:])
@@ -0,0 +1,153 @@
+import datetime
+
+import pytest
+
+import settings
+from candles import BUCKET_OFFSET, INTERVAL_MS, KLINE_UPDATE_LIMIT, CandleStore, UpperCandles
+from replay_server import synthetic_klines
+
+
+class Exchange:
+    '''
+    get_klines over the first `listed` candles of a base series, upper intervals aggregated from them
+    '''
+
+    def __init__(self, interval, count, listed):
+        step = INTERVAL_MS[interval]
+        self.interval = interval
+        self.base = synthetic_klines(interval, count, start=1600000000000 // step * step)
+        self.listed = listed
+        self.requests = []
+
+    def get_klines(self, symbol, interval, limit=500, startTime=None):
+        self.requests.append((interval, startTime))
+        rows = self.base[:self.listed]
+        if interval != self.interval:
+            rows = aggregate(rows, interval)
+        if startTime is None:
+            return rows[-limit:]
+        return [row for row in rows if row[0] >= startTime][:limit]
+
+
+def bucket(openTime, interval):
+    if interval == '1M':
+        day = datetime.datetime.fromtimestamp(openTime / 1000, datetime.timezone.utc)
+        return int(datetime.datetime(day.year, day.month, 1, tzinfo=datetime.timezone.utc).timestamp() * 1000)
+    step, offset = INTERVAL_MS[interval], BUCKET_OFFSET.get(interval, 0)
+    return (openTime - offset) // step * step + offset
+
+
+def aggregate(base, interval):
+    rows = {}
+    for kline in base:
+        start = bucket(kline[0], interval)
+        row = rows.get(start)
+        if row is None:
+            rows[start] = [start, kline[1], kline[2], kline[3], kline[4], kline[5], kline[6]]
+        else:
+            row[2] = max(row[2], kline[2], key=float)
+            row[3] = min(row[3], kline[3], key=float)
+            row[4], row[6] = kline[4], kline[6]
+            row[5] = f"{float(row[5]) + float(kline[5]):.8f}"
+    return list(rows.values())
+
+
+def assert_matches(candles, exchange, interval):
+    expected = aggregate(exchange.base[:exchange.listed], interval)[-len(candles):]
+    assert [row[0] for row in candles] == [row[0] for row in expected]
+    for got, want in zip(candles, expected):
+        assert got[1:5] == pytest.approx([float(v) for v in want[1:5]])
+
+
+@pytest.fixture(autouse=True)
+def no_files(monkeypatch):
+    monkeypatch.setattr(settings, 'kline_cache_dir', '')
+    monkeypatch.setattr(settings, 'record_dir', '')
+
+
+def stores(exchange, interval, upper):
+    base = CandleStore(exchange, 'BTCBUSD', interval)
+    resampled = UpperCandles(exchange, 'BTCBUSD', interval, upper)
+    assert resampled.resample
+    resampled.update(base.update())
+    return base, resampled
+
+
+def follow(exchange, base, resampled, candles):
+    '''
+    List the next base candles one at a time, checking the upper candles after each
+    '''
+    for _ in range(candles):
+        exchange.listed += 1
+        exchange.requests.clear()
+        assert_matches(resampled.update(base.update()), exchange, resampled.store.interval)
+        # Built from the base candles, only those are downloaded
+        assert {request[0] for request in exchange.requests} == {base.interval}
+
+
+def test_resampled_candles_match_aggregated_klines():
+    exchange = Exchange('1h', 1500, 1000)
+    follow(exchange, *stores(exchange, '1h', '4h'), 30)
+
+
+def test_upper_candle_starting_before_the_base_window():
+    # A day is 1440 candles, the open one began long before the 500 held
+    exchange = Exchange('1m', 2400, 2100)
+    base, resampled = stores(exchange, '1m', '1d')
+    follow(exchange, base, resampled, 30)
+    assert resampled.store.candles[-1][0] < base.candles[0][0]
+    # Then a day opens within the window
+    follow(exchange, base, resampled, 10)
+    assert resampled.store.candles[-1][0] > base.candles[0][0]
+
+
+def test_weekly_candles_open_on_monday():
+    exchange = Exchange('1d', 900, 600)
+    base, resampled = stores(exchange, '1d', '1w')
+    follow(exchange, base, resampled, 20)
+    for row in resampled.store.candles:
+        assert datetime.datetime.fromtimestamp(row[0] / 1000, datetime.timezone.utc).weekday() == 0
+
+
+def test_reseeds_when_too_far_behind():
+    exchange = Exchange('1h', 3000, 1000)
+    base = CandleStore(exchange, 'BTCBUSD', '1h')
+    resampled = UpperCandles(exchange, 'BTCBUSD', '1h', '4h')
+    resampled.update(base.update())
+    exchange.listed += 4 * KLINE_UPDATE_LIMIT + 8
+    exchange.requests.clear()
+    assert_matches(resampled.update(base.update()), exchange, '4h')
+    assert ('4h', None) in exchange.requests
+
+
+def test_due_and_fetched_handshake():
+    exchange = Exchange('1h', 2000, 1000)
+    base = CandleStore(exchange, 'BTCBUSD', '1h')
+    upper = UpperCandles(exchange, 'BTCBUSD', '1h', '1M')
+    assert not upper.resample
+    candles = base.update()
+    # Nothing to fetch along with the base candles before the first download
+    assert not upper.due(candles[-1][0])
+    upper.update(candles)
+    now = candles[-1][0]
+    assert not upper.due(now + INTERVAL_MS['1h'] - 1)
+    assert upper.due(now + INTERVAL_MS['1h'])
+
+    # The same base candle again downloads nothing
+    exchange.requests.clear()
+    upper.update(candles)
+    assert exchange.requests == []
+
+    # A new base candle: the caller fetched the upper candles with it, or update() does
+    exchange.listed += 1
+    candles = base.update()
+    exchange.requests.clear()
+    upper.store.update()
+    upper.update(candles, fetched=True)
+    assert [request[0] for request in exchange.requests] == ['1M']
+    assert not upper.due(candles[-1][0])
+    exchange.listed += 1
+    candles = base.update()
+    exchange.requests.clear()
+    assert_matches(upper.update(candles), exchange, '1M')
+    assert [request[0] for request in exchange.requests] == ['1M']